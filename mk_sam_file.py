@@ -1,14 +1,44 @@
 #!/usr/bin/env python
 
+import io
 import os
 import sys
 import math
+import tempfile
+import contextlib
+import multiprocessing
 import numpy as np
 import pandas as pd
 from mk_sam_utilities import *
+from sam_format import SampleFormatter, SAM_FORMAT_URL, describe_problems
+from sam_validate import check_site, SiteValidationError, split_readings, \
+    first_reading
+from sam_merge import merge_sample_file
+from sam_xlsx import read_workbook
+from sam_archive import SiteArchive
+from sam_magic import orientation_method, location_name, naming_convention, \
+    site_records, records_tables, write_tables
+import sam_db
+import sam_cache
+import sam_shared
+from sam_pipeline import prefetch, bounded_imap, Sink, DEPTH
+from sam_summary import site_summary, write_summary, MISMATCH_LIMIT
+from sam_qc import qc_summary, log_qc, circular_mean
+from sam_uncertainty import monte_carlo, log_uncertainty, UNCERTAINTY_COLUMNS
+import sam_log
 from datetime import datetime as dt
 from functools import reduce
 
+df_cols = ['sample_name', 'comment', 'strat_level',
+           'magnetic_core_strike', 'core_dip', 'bedding_strike',
+           'bedding_dip', 'correct_bedding_using_local_dec',
+           'mass', 'runs', 'sun_core_strike', 'calculated_IGRF',
+           'IGRF_local_dec', 'calculated_mag_dec', 'core_strike',
+           'corrected_bedding_strike']
+sdf_cols = ['sample_name', 'shadow_angle', 'GMT_offset',
+            'year', 'month', 'days', 'hours', 'minutes']
+time_types = ['year', 'month', 'days', 'hours', 'minutes']
+
 
 def main():
     """
@@ -17,125 +47,649 @@ def main():
 
     DESCRIPTION
         Takes formated CSV and creates and writes a .sam header file and a set
-        of sample files for any number of samples.
+        of sample files for any number of samples. Any number of site
+        templates can be given; all of them are read and checked before the
+        first file is written. Workbooks filled in from
+        sam_sample_template.xlsx are read directly, one site per sheet.
 
     SYNTAX
         ~/$ python mk_sam_file.py site.csv [optional - output_directory]
+        ~/$ python mk_sam_file.py site1.csv site2.csv ... [options]
+        ~/$ python mk_sam_file.py season.xlsx [options]
+
+    OPTIONS
+        -od OUTPUT_DIRECTORY : directory for all output (default is the
+                               directory of each template)
+        -summary FILE : also write one table with a row for every sample of
+                        every site (.parquet, .feather or .npz)
+        -v : print the values of every sample and every file written
+        -q : only print warnings
+        -log FILE : append every event as JSON lines to FILE ('-' for stdout)
+        -archive FILE : write the output of all sites into one .zip or .tar
+                        (.tar.gz, .tgz, .tar.bz2, .tar.xz) archive with a
+                        folder per site instead of separate files (-merge
+                        does not apply)
+        -merge : keep the measurements already in existing sample files,
+                 only update their orientation lines and append new runs
+        -mc DRAWS : Monte Carlo uncertainties of core_strike and
+                    corrected_bedding_strike from DRAWS realizations of the
+                    field readings per sample (see sam_uncertainty.py)
+        -db FILE : store the sites and samples in a SQLite database that can
+                   be queried with sam_db.py
+        -magic DIRECTORY : write the MagIC 3.0 sites, samples and specimens
+                           tables of all sites to DIRECTORY (see sam_magic.py)
+        -cache : keep every parsed .csv template in a .site.npz file next
+                 to it and read templates that did not change since from
+                 there (see sam_cache.py)
+        -sun MODEL : evaluate the solar position once per day and interpolate,
+                     with the formulas of sundec (almanac) or the more
+                     accurate ones of the NOAA solar calculator (noaa)
+        -qc : exit with status 1 if the sun vs. magnetic compass check of any
+              site fails (see sam_qc.py)
+        -procs N : calculate and write N sites at the same time in worker
+                   processes, which share one copy of the field model
+                   coefficients (see sam_shared.py)
+        -pipeline : overlap reading, calculating and writing: the next
+                    template is read while the current one is checked and
+                    the files of a site are written by a background thread
+                    while the next sites are calculated (in the workers with
+                    -procs), at most a few sites ahead of the writing.
+                    Templates are read twice, to check them all and again
+                    just before each site is calculated, so that memory
+                    does not grow with the batch (-cache makes the second
+                    read cheap)
 
     OUTPUT
         .sam and sample files
 
     """
+    args = sys.argv[1:]
+    output_directory, summary_file, event_file = None, None, None
+    db_file, archive_file, sun_model = None, None, None
+    magic_directory = None
+    mc_draws, procs = 0, 1
+    cache = '-cache' in args
+    if cache:
+        args.remove('-cache')
+    pipeline = '-pipeline' in args
+    if pipeline:
+        args.remove('-pipeline')
+    merge = '-merge' in args
+    if merge:
+        args.remove('-merge')
+    verbosity = sam_log.NORMAL
+    qc_gate = '-qc' in args
+    if qc_gate:
+        args.remove('-qc')
+    if '-v' in args:
+        args.remove('-v')
+        verbosity = sam_log.VERBOSE
+    if '-q' in args:
+        args.remove('-q')
+        verbosity = sam_log.QUIET
+    if '-mc' in args:
+        ind = args.index('-mc')
+        mc_draws = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-procs' in args:
+        ind = args.index('-procs')
+        procs = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-archive' in args:
+        ind = args.index('-archive')
+        archive_file = args[ind+1]
+        del args[ind:ind+2]
+    if '-sun' in args:
+        ind = args.index('-sun')
+        sun_model = args[ind+1]
+        del args[ind:ind+2]
+        if sun_model not in SUN_MODELS:
+            raise ValueError('-sun must be one of: ' + ', '.join(SUN_MODELS))
+    if '-db' in args:
+        ind = args.index('-db')
+        db_file = args[ind+1]
+        del args[ind:ind+2]
+    if '-magic' in args:
+        ind = args.index('-magic')
+        magic_directory = args[ind+1]
+        del args[ind:ind+2]
+    if '-log' in args:
+        ind = args.index('-log')
+        event_file = args[ind+1]
+        del args[ind:ind+2]
+    if '-od' in args:
+        ind = args.index('-od')
+        output_directory = args[ind+1]
+        del args[ind:ind+2]
+    if '-summary' in args:
+        ind = args.index('-summary')
+        summary_file = args[ind+1]
+        del args[ind:ind+2]
+    # keep supporting the original ``site.csv output_directory`` form
+    if len(args) == 2 and not args[1].lower().endswith(('.csv', '.xlsx')):
+        output_directory = args.pop()
+    file_names = args
+    sam_log.setup_logging(verbosity, event_file)
+
+    # read and check every site before anything is calculated or written
+    formatter = SampleFormatter()
+    names, sites, errors = [], [], []
+    templates = site_templates(file_names)
+    if pipeline:
+        read = prefetch(lambda site: read_template(site, cache), templates)
+    else:
+        read = (read_template(site, cache) for site in templates)
+    for site_name, template, hdf, df, sdf in read:
+        try:
+            check_site(site_name, hdf, df, sdf, formatter)
+        except SiteValidationError as err:
+            errors.append(err)
+        names.append(site_name)
+        if not pipeline:
+            sites.append((site_name, template, hdf, df, sdf))
+    if errors:
+        raise SiteValidationError.combine(errors)
+    if pipeline:
+        # every site is read again just before it is calculated so that the
+        # frames of the batch are not held (-cache makes the second read
+        # cheap)
+        sites = prefetch(lambda site: read_template(site, cache),
+                         site_templates(file_names))
+
+    summaries, failed, stored, magic_records = [], [], [], []
+    archive = SiteArchive(archive_file) if archive_file is not None else None
+    targets = []
+    for file_name in names:
+        if archive is not None:
+            # the rendered files are added to the archive (-merge does not
+            # apply)
+            od = None
+        elif output_directory is None:
+            od = os.path.split(file_name)[0]
+        else:
+            od = output_directory
+        targets.append((file_name, od, merge and od is not None))
+
+    def site_jobs():
+        for (file_name, template, hdf, df, sdf), (name, od, site_merge) in \
+                zip(sites, targets):
+            if file_name != name:
+                raise ValueError('the sites of %s changed while they were '
+                                 'processed' % name)
+            yield (file_name, template, hdf, df, sdf, od, site_merge,
+                   sun_model, formatter)
+
+    jobs = site_jobs()
+    pool, store = None, None
+    if procs > 1 and len(names) > 1:
+        handle, store = tempfile.mkstemp(suffix='.coef')
+        os.close(handle)
+        sam_shared.publish(store)
+        pool = multiprocessing.Pool(min(procs, len(names)), start_worker,
+                                    (store, verbosity, event_file))
+    if pipeline:
+        # calculated here or by the workers, written by the sink; both stop
+        # when the sink is DEPTH sites behind
+        results = bounded_imap(pool, calculate_job, jobs, procs + DEPTH)
+    elif pool is not None:
+        results = pool.imap(write_site, jobs)
+    else:
+        results = map(write_site, jobs)
+    try:
+        # the sink finishes the sites submitted to it even if one fails
+        with (Sink(write_rendered_site) if pipeline else
+              contextlib.nullcontext()) as sink:
+            for (file_name, od, site_merge), (hdf, df, sdf, output) in \
+                    zip(targets, results):
+                # workers return copies with the calculated values
+                site_id = hdf['site_info']['site_id']
+                if sink is not None:
+                    files, warnings = output
+                    sink.submit((od, site_id, files, warnings, site_merge,
+                                 archive))
+                elif output is not None:
+                    files, warnings = output
+                    archive_site_files(archive, site_id, files, warnings)
+                sites_qc, summary = qc_summary(site_summary(hdf, df, sdf))
+                if mc_draws:
+                    uncertainty = monte_carlo(summary, mc_draws)
+                    log_uncertainty(uncertainty)
+                    for column in UNCERTAINTY_COLUMNS:
+                        summary[column] = uncertainty[column].values
+                log_qc(sites_qc, summary)
+                failed += sites_qc['site_id'][~sites_qc['passed']].tolist()
+                summaries.append(summary)
+                stored.append((file_name, hdf, summary))
+                if magic_directory is not None:
+                    magic_records.append(site_records(hdf, df))
+    except BaseException:
+        # the sites still queued in the pool are dropped, nothing more is
+        # added to the archive and the previous one is kept
+        if pool is not None:
+            pool.terminate()
+        if archive is not None:
+            archive.discard()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+            os.remove(store)
+    if archive is not None:
+        archive.close()
+        sam_log.info('write_archive', 'Writing file - ' + archive_file,
+                     path=archive_file, sites=len(names))
+
+    if summary_file is not None:
+        summary_file = write_summary(pd.concat(summaries), summary_file)
+        sam_log.info('write_summary', 'Writing file - ' + summary_file,
+                     path=summary_file, samples=sum(map(len, summaries)))
+
+    if magic_directory is not None:
+        tables = records_tables(magic_records)
+        write_tables(magic_directory, tables)
+        sam_log.info('write_magic', 'Wrote MagIC tables of %d site(s) to %s' %
+                     (len(tables['sites']), magic_directory),
+                     path=magic_directory, sites=len(tables['sites']))
+
+    if db_file is not None:
+        con = sam_db.connect(db_file)
+        sam_db.store_sites(con, stored)
+        con.close()
+        sam_log.info('write_db', 'Stored %d site(s) in %s' % (len(stored), db_file),
+                     path=db_file, sites=len(stored))
+
+    if qc_gate and failed:
+        sam_log.warning('qc_gate', 'declination check failed for: ' +
+                        ', '.join(failed), sites=failed)
+        sys.exit(1)
+
+
+def site_templates(file_names):
+    """
+    Yields the site name and template text of every site of the given
+    files: a .csv template is read from its file later (the text is None),
+    a workbook gives a template per sheet (see sam_xlsx.py).
+    """
+    for file_name in file_names:
+        if file_name.lower().endswith('.xlsx'):
+            for sheet, template in read_workbook(file_name):
+                yield '%s:%s' % (file_name, sheet), template
+        else:
+            yield file_name, None
+
+
+def read_template(site, cache=False):
+    """
+    DESCRIPTION
+        Reads a site of site_templates.
 
-    ###########################################################################
-    #                              Read In Files                              #
-    ###########################################################################
+        @param: site - site name and template text
+        @param: cache - read .csv templates through the cache (see
+                ingest_site)
 
-    # fetching comand line data
-    file_name = sys.argv[1]
-    directory = os.path.split(file_name)[0]
+    OUTPUT
+        site name, template text, hdf, df, sdf
 
-    try:
-        output_directory = sys.argv[2]
-    except IndexError:
-        output_directory = directory
-
-    if output_directory != '' and not os.path.exists(output_directory):
-        os.makedirs(output_directory)
-
-    print('Reading in file - ' + file_name)
-
-    df_cols = ['sample_name', 'comment', 'strat_level',
-               'magnetic_core_strike', 'core_dip', 'bedding_strike',
-               'bedding_dip', 'correct_bedding_using_local_dec',
-               'mass', 'runs', 'sun_core_strike', 'calculated_IGRF',
-               'IGRF_local_dec', 'calculated_mag_dec', 'core_strike',
-               'corrected_bedding_strike']
-    sdf_cols = ['sample_name', 'shadow_angle', 'GMT_offset',
-                'year', 'month', 'days', 'hours', 'minutes']
-
-    # file read in
-    hdf = pd.read_csv(file_name, header=0, index_col=0, nrows=5, usecols=[0, 1])
-    df = pd.read_csv(file_name, header=6, index_col=0,
-                     usecols=df_cols, dtype=object).transpose()
-    sdf = pd.read_csv(file_name, header=6, index_col=0,
-                      usecols=sdf_cols).transpose()
-
-    # variable assignments
-    samples = df.keys()
-    attributes = ['core_strike', 'core_dip',
-                  'bedding_strike', 'bedding_dip', 'mass']
-    site_values = ['site_lat', 'site_long']
-    time_types = ['year', 'month', 'days', 'hours', 'minutes']
+    """
+    site_name, template = site
+    if template is None:
+        hdf, df, sdf = ingest_site(site_name, cache)
+    else:
+        hdf, df, sdf = read_site(site_name, template)
+    return site_name, template, hdf, df, sdf
+
+
+def read_site(file_name, template=None):
+    """
+    DESCRIPTION
+        Reads a site template.
+
+        @param: file_name - path of the .csv template
+        @param: template - text of the template if it is not read from
+                file_name (a sheet of an .xlsx workbook, see sam_xlsx.py)
+
+    OUTPUT
+        hdf - site DataFrame
+        df - sample Dataframe (transposed, samples are columns)
+        sdf - sun compass Dataframe (transposed, samples are columns)
+
+    """
+    sam_log.info('read', 'Reading in file - ' + file_name, path=file_name)
+    hdf, samples, sun = read_frames(file_name, template)
+    return hdf, samples.transpose(), sun.transpose()
+
+
+def read_frames(file_name, template=None):
+    """
+    Parses a site template into the site DataFrame and the sample and sun
+    compass DataFrames as they are in the template (a row per sample), see
+    read_site.
+    """
+    def source():
+        return file_name if template is None else io.StringIO(template)
 
-    ###########################################################################
-    #                         Find Calculated Values                          #
-    ###########################################################################
+    hdf = pd.read_csv(source(), header=0, index_col=0, nrows=5, usecols=[0, 1])
+    samples = pd.read_csv(source(), header=6, index_col=0,
+                          usecols=df_cols, dtype=object)
+    sun = pd.read_csv(source(), header=6, index_col=0, usecols=sdf_cols)
+    return hdf, samples, sun
+
+
+def ingest_site(file_name, cache=False):
+    """
+    DESCRIPTION
+        Reads a .csv site template the way main does, fixing its line
+        breaks first.
+
+        @param: file_name - path of the .csv template
+        @param: cache - keep the parsed template in a .site.npz sidecar
+                (see sam_cache.py) and read unchanged templates from it
+
+    OUTPUT
+        hdf, df, sdf as read_site returns them
+
+    """
+    frames = sam_cache.load_site(file_name) if cache else None
+    if frames is not None:
+        sam_log.info('read', 'Reading in file - %s (cached)' % file_name,
+                     path=file_name, cached=True)
+    else:
+        fix_line_breaks(file_name)
+        sam_log.info('read', 'Reading in file - ' + file_name, path=file_name)
+        frames = read_frames(file_name)
+        if cache and sam_cache.save_site(file_name, frames) is None:
+            sam_log.debug('cache', 'could not cache ' + file_name,
+                          path=file_name)
+    hdf, samples, sun = frames
+    return hdf, samples.transpose(), sun.transpose()
+
+
+def write_site(job):
+    """
+    DESCRIPTION
+        Calculates and writes one site of main, in this process or in a
+        worker (see start_worker).
+
+        @param: job - file_name, template, hdf, df, sdf, output directory
+                (None to return the rendered files for the archive), merge,
+                sun_model and formatter (see process_site)
+
+    OUTPUT
+        hdf, df and sdf with the calculated values and the files and
+        warnings of calculate_site (None if they were written)
+
+    """
+    file_name, template, hdf, df, sdf, od, merge, sun_model, formatter = job
+    if od is None:
+        return hdf, df, sdf, calculate_site(file_name, hdf, df, sdf,
+                                            formatter, template, sun_model)
+    process_site(file_name, od, hdf, df, sdf, formatter, merge, template,
+                 sun_model)
+    return hdf, df, sdf, None
+
+
+def calculate_job(job):
+    """
+    Calculates and renders one site of main for write_rendered_site, in
+    this process or in a worker (see write_site and calculate_site).
+    Returns hdf, df and sdf with the calculated values and the rendered
+    files and warnings of the site.
+    """
+    file_name, template, hdf, df, sdf, od, merge, sun_model, formatter = job
+    files, warnings = calculate_site(file_name, hdf, df, sdf, formatter,
+                                     template, sun_model)
+    return hdf, df, sdf, (files, warnings)
+
+
+def write_rendered_site(item):
+    """
+    DESCRIPTION
+        Writes a site of calculate_job, the output stage of main with
+        -pipeline.
+
+        @param: item - output directory (None to write into the archive),
+                site_id, files, warnings, merge and the archive
+
+    """
+    od, site_id, files, warnings, merge, archive = item
+    if od is not None:
+        write_site_files(od, site_id, files, warnings, merge)
+    else:
+        archive_site_files(archive, site_id, files, warnings)
 
-    print('---------------------LOCAL MAGNETIC DECLINATION-----------------------')
+
+def start_worker(store, verbosity, event_file):
+    """
+    Sets up a worker process of main: attaches the coefficient store
+    published by the main process (see sam_shared.py) and logs like it.
+    """
+    sam_shared.attach(store)
+    sam_log.setup_logging(verbosity, event_file)
+
+
+def process_site(file_name, output_directory, hdf, df, sdf, formatter=None,
+                 merge=False, template=None, sun_model=None):
+    """
+    DESCRIPTION
+        Calculates the orientations of a site that passed check_site and
+        writes the .sam, sample, .csv and .inp files.
+
+        @param: file_name - path of the .csv template
+        @param: output_directory - directory to write to
+        @param: hdf - site DataFrame
+        @param: df - sample Dataframe
+        @param: sdf - sun compass Dataframe
+        @param: formatter - SampleFormatter for the sample files
+        @param: merge - merge into existing sample files instead of
+                rewriting them (see write_sample_files)
+        @param: template - text of the template if it was not read from
+                file_name (see read_site)
+        @param: sun_model - solar position model (see sun_core_strikes)
+
+    """
+    if formatter is None:
+        formatter = SampleFormatter()
+    files, warnings = calculate_site(file_name, hdf, df, sdf, formatter,
+                                     template, sun_model)
+    write_site_files(output_directory, hdf['site_info']['site_id'], files,
+                     warnings, merge)
+
+
+def calculate_site(file_name, hdf, df, sdf, formatter, template=None,
+                   sun_model=None):
+    """
+    DESCRIPTION
+        Calculates the orientations of a site that passed check_site and
+        renders its .sam, sample, .csv and .inp files without writing them
+        (see process_site).
+
+    OUTPUT
+        files - list of the rendered files for write_files
+        warnings - sam_log.SiteWarnings of the site, not shown yet
+
+    """
+    site_id = hdf['site_info']['site_id']
+    warnings = sam_log.SiteWarnings(site_id)
+    calculate_values(hdf, df, sdf, warnings, sun_model)
+    sam_log.debug('output', '---------------------OUTPUT-----------------------')
+    files = [(site_id + '.sam', render_sam_file(df, hdf), None)]
+    files += render_sample_files(df, hdf, formatter, warnings)
+    files.append((site_id + '.csv',
+                  render_csv_file(file_name, df, sdf, hdf, template), None))
+    files.append((site_id + '.inp', render_inp_file(df, hdf), None))
+    return files, warnings
+
+
+def write_site_files(output_directory, site_id, files, warnings, merge=False):
+    """
+    DESCRIPTION
+        Writes the files of a site rendered by calculate_site and shows its
+        warnings.
+
+        @param: output_directory - directory to write to
+        @param: site_id - site of the files
+        @param: files, warnings - from calculate_site
+        @param: merge - merge into existing sample files (see write_files)
+
+    """
+    if output_directory != '':
+        # workers writing sites to the same directory may race to create it
+        os.makedirs(output_directory, exist_ok=True)
+    write_files(output_directory, files, merge)
+    warnings.flush()
+    # .sam, .csv and .inp plus one file per sample
+    sam_log.info('write_site', 'Wrote %d files for %s to %s' %
+                 (len(files), site_id, output_directory or '.'),
+                 site_id=site_id, samples=len(files) - 3,
+                 output_directory=output_directory)
+
+
+def archive_site_files(archive, site_id, files, warnings):
+    """
+    Adds the files of a site rendered by calculate_site to a SiteArchive and
+    shows its warnings (see write_site_files).
+    """
+    archive.add_site(site_id, files)
+    warnings.flush()
+    sam_log.info('write_site', 'Added %d files for %s to %s' %
+                 (len(files), site_id, archive.file_name), site_id=site_id,
+                 samples=len(files) - 3, archive=archive.file_name)
+
+
+def sun_core_strikes(hdf, sdf, sun_model=None):
+    """
+    DESCRIPTION
+        Calculates the sun compass core strikes of all samples of a site
+        with complete sun compass data at once. Every reading of samples
+        oriented more than once (see sam_validate.split_readings) is
+        reduced in the same batch and the readings of a sample are averaged
+        as directions.
+
+        @param: hdf - site DataFrame
+        @param: sdf - sun compass Dataframe
+        @param: sun_model - None for the sundec calculation of every reading,
+                or a model of mk_sam_utilities.SUN_MODELS to use the
+                per-day solar ephemeris (see sundec_ephemeris)
+
+    OUTPUT
+        dictionary of sample -> (core strike, number of readings, circular
+        standard deviation of the readings in degrees)
+
+    """
+    samples = list(sdf.keys())
+    readings, mismatched = split_readings(sdf.transpose())
+    readings = readings[readings[sdf_cols[1:]].notnull().all(axis=1).values]
+    if len(readings) == 0:
+        return {}
+    # sundec reads whole numbers from the date string
+    args = [np.trunc(readings[time_type].values) for time_type in time_types]
+    args += [readings['GMT_offset'].values,
+             float(hdf['site_info']['site_lat']),
+             float(hdf['site_info']['site_long']),
+             readings['shadow_angle'].values]
+    if sun_model is None:
+        strikes = sundec_array(*args)
+    else:
+        strikes = sundec_ephemeris(*args, model=sun_model)
+
+    codes = readings['sample'].values
+    mean, R, n = circular_mean(strikes, codes, len(samples))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spread = np.degrees(np.sqrt(-2.*np.log(np.minimum(R, 1.))))
+    # a single reading is kept as calculated
+    single = n == 1
+    mean[codes[single[codes]]] = strikes[single[codes]]
+    spread[single] = 0.
+    return dict((samples[i], (float(mean[i]) % 360., int(n[i]),
+                              float(spread[i])))
+                for i in np.flatnonzero(n > 0))
+
+
+def calculate_values(hdf, df, sdf, warnings=None, sun_model=None):
+    """
+    DESCRIPTION
+        Fills in the calculated fields of the sample DataFrame: sun compass
+        and IGRF declinations, the local declination from comparing the two
+        compasses and the core and bedding strikes that will be used.
+
+        @param: hdf - site DataFrame
+        @param: df - sample Dataframe
+        @param: sdf - sun compass Dataframe
+        @param: warnings - sam_log.SiteWarnings collecting the warnings of
+                the site (they are shown right away if not given)
+        @param: sun_model - solar position model (see sun_core_strikes)
+
+    """
+    samples = df.keys()
+    site_id = hdf['site_info']['site_id']
+    if warnings is None:
+        warnings = sam_log.SiteWarnings(site_id)
+        flush = True
+    else:
+        flush = False
+
+    sam_log.debug('declination', '---------------------LOCAL MAGNETIC DECLINATION-----------------------')
 
     # calculate sun_core_strike for all samples
+    readings = pd.Series(1, index=samples, dtype=float)
+    spreads = pd.Series(np.nan, index=samples)
+    for sample, (strike, n, spread) in \
+            sun_core_strikes(hdf, sdf, sun_model).items():
+        df[sample]['sun_core_strike'] = round(strike, 1)
+        readings[sample], spreads[sample] = n, spread
+        if n > 1:
+            sam_log.debug('sun_readings', site_id + str(sample) + ' sun compass '
+                          'strike is the mean of %d readings, circular standard '
+                          'deviation %.1f' % (n, spread), site_id=site_id,
+                          sample=str(sample), readings=n, spread=spread)
+        if spread > MISMATCH_LIMIT:
+            warnings.add('sun_spread', sample, "sun compass readings are more "
+                         "than %g degree apart" % MISMATCH_LIMIT,
+                         readings=n, spread=spread)
+    # kept for the summary table, they are not written to the .csv
+    df.loc['sun_readings'] = readings.values
+    df.loc['sun_core_strike_spread'] = spreads.values
+
     for sample in samples:
-        if (not sdf[sample].isnull().any()):
-            # df[sample]['sun_core_strike'] = float('nan')
-            # continue
-            # else:
-            time_values = []
-            for i in range(len(time_types)):
-                time_values.append(str(int(sdf[sample][time_types[i]])))
-            assert (len(time_values[0]) == 4),\
-                "must input full year for sun compass calculation (i.e. YYYY)"
-            sundata = {}
-            if (len(time_values[1]) == 1):
-                time_values[1] = '0' + time_values[1]
-            if (len(time_values[2]) == 1):
-                time_values[2] = '0' + time_values[2]
-            if (len(time_values[3]) == 1):
-                time_values[3] = '0' + time_values[3]
-            if (len(time_values[4]) == 1):
-                time_values[4] = '0' + time_values[4]
-            sundata['date'] = reduce(lambda x, y: x + ':' + y, time_values)
-            sundata['lat'] = hdf['site_info']['site_lat']
-            sundata['lon'] = hdf['site_info']['site_long']
-            sundata['shadow_angle'] = sdf[sample]['shadow_angle']
-            sundata['delta_u'] = sdf[sample]['GMT_offset']
-            df[sample]['sun_core_strike'] = round(sundec(sundata), 1)
-
-    # calculate IGRF
-        if (sdf[sample]['GMT_offset':'month'].isnull()).any():
-            raise ValueError("not enough data to calculate IGRF to correct "
-                             "bedding please input at least GMT_offset, "
-                             "year, month, day of measurement\n")
+        # calculate IGRF from the (first) sun compass reading
+        if math.isnan(float(hdf['site_info']['site_elevation'])):
+            hdf['site_info']['site_elevation'] = 0.0
+        when = {}
+        for time_type in time_types:
+            when[time_type] = first_reading(sdf[sample][time_type])
+            if math.isnan(when[time_type]):
+                sdf[sample][time_type] = 1
+                when[time_type] = 1
+        date = to_year_fraction(dt(int(when['year']),
+                                   int(when['month']),
+                                   int(when['days']),
+                                   int(when['hours']),
+                                   int(when['minutes'])))
+        df[sample]['calculated_IGRF'] = list(
+                igrf([date,
+                      float(hdf['site_info']['site_elevation'])/1000,
+                      float(hdf['site_info']['site_lat']),
+                      float(hdf['site_info']['site_long'])]))
+        if float(df[sample]['calculated_IGRF'][0]) > 180:
+            df[sample]['IGRF_local_dec'] = df[sample]['calculated_IGRF'][0] - 360
         else:
-            if math.isnan(float(hdf['site_info']['site_elevation'])):
-                hdf['site_info']['site_elevation'] = 0.0
-            for time_type in time_types:
-                if math.isnan(float(sdf[sample][time_type])):
-                    sdf[sample][time_type] = 1
-            date = to_year_fraction(dt(int(sdf[sample]['year']),
-                                       int(sdf[sample]['month']),
-                                       int(sdf[sample]['days']),
-                                       int(sdf[sample]['hours']),
-                                       int(sdf[sample]['minutes'])))
-            df[sample]['calculated_IGRF'] = list(
-                    igrf([date,
-                          float(hdf['site_info']['site_elevation'])/1000,
-                          float(hdf['site_info']['site_lat']),
-                          float(hdf['site_info']['site_long'])]))
-            if float(df[sample]['calculated_IGRF'][0]) > 180:
-                df[sample]['IGRF_local_dec'] = df[sample]['calculated_IGRF'][0] - 360
-            else:
-                df[sample]['IGRF_local_dec'] = df[sample]['calculated_IGRF'][0]
-            # print out the local IGRF
-            print(hdf['site_info']['site_id'] + str(sample) + " has local IGRF declination of: ")
-            print(df[sample]['IGRF_local_dec'])
+            df[sample]['IGRF_local_dec'] = df[sample]['calculated_IGRF'][0]
+        # print out the local IGRF
+        sam_log.debug('igrf_dec', site_id + str(sample) +
+                      " has local IGRF declination of: " +
+                      str(df[sample]['IGRF_local_dec']),
+                      site_id=site_id, sample=str(sample),
+                      igrf_dec=float(df[sample]['IGRF_local_dec']))
 
         # calculate magnetic declination
-        print('The local declination calculated through magnetic and sun compass comparison is:')
         if math.isnan(float(df[sample]['sun_core_strike'])) or \
                 math.isnan(float(df[sample]['magnetic_core_strike'])):
             df[sample]['calculated_mag_dec'] = 'insufficient data'
-            print('insufficient data')
+            sam_log.debug('calculated_mag_dec', 'The local declination calculated '
+                          'through magnetic and sun compass comparison is: '
+                          'insufficient data', site_id=site_id,
+                          sample=str(sample), calculated_mag_dec=None)
         else:
             calc_mag_dec = (float(df[sample]['sun_core_strike']) -
                             float(df[sample]['magnetic_core_strike']))
@@ -145,62 +699,24 @@ def main():
                 df[sample]['calculated_mag_dec'] = calc_mag_dec - 360
             else:
                 df[sample]['calculated_mag_dec'] = calc_mag_dec
-            print("    {:+.2f}".format(df[sample]['calculated_mag_dec']))
+            sam_log.debug('calculated_mag_dec', 'The local declination calculated '
+                          'through magnetic and sun compass comparison is: '
+                          "{:+.2f}".format(df[sample]['calculated_mag_dec']),
+                          site_id=site_id, sample=str(sample),
+                          calculated_mag_dec=df[sample]['calculated_mag_dec'])
             if abs(float(df[sample]['IGRF_local_dec']) -
-                   float(df[sample]['calculated_mag_dec'])) > 5:
-                print("WARNING: local IGRF declination & calculated magnetic "
-                      "declination are more than 5 degree different")
-        print('')
-    print('')
-    print('Site averages:')
-    print('Average of local IGRF declination is: ' + str(df.transpose()['IGRF_local_dec'].mean()))
-    # print('Average of calculated local declination: ' +
-    #       str(df.transpose()['calculated_mag_dec'].mean()))
-    print('')
-    print('---------------------OUTPUT-----------------------')
-
-    ###########################################################################
-    #                         Create .SAM Header File                         #
-    ###########################################################################
-
-    # setting name
-    sam_header = hdf['site_info']['site_name'] + '\r\n'
-
-    # creating long lat and dec info
-    for value in site_values:
-        hdf['site_info'][value] = str(round(float(hdf['site_info'][value]), 1))
-        # format latitude values
-        if value == 'site_lat':
-            sam_header += ' ' + hdf['site_info'][value]
-            # format longitude values and force to 0-360
-        if value == 'site_long':
-            sam_header += ' {:05.1f}'.format(float(hdf['site_info'][value])%360)
-    sam_header += ' '*(3) + '0.0'
-    sam_header += '\r\n'
-
-    # making writing sample info
-    for sample in samples:
-        sam_header += hdf['site_info']['site_id'] + str(sample) + '\r\n'
-
-    # creating and writing file
-    print('Writing file - ' + os.path.join(output_directory, hdf['site_info']['site_id'] + '.sam'))
-    sam_file = open(os.path.join(output_directory,
-                                 hdf['site_info']['site_id'] + '.sam'), 'w+')
-    sam_file.write(sam_header)
-    sam_file.close()
-
-    ###########################################################################
-    #                           Create Sample Files                           #
-    ###########################################################################
+                   float(df[sample]['calculated_mag_dec'])) > MISMATCH_LIMIT:
+                warnings.add('dec_mismatch', sample, "local IGRF declination & "
+                             "calculated magnetic declination are more than "
+                             "%g degree different" % MISMATCH_LIMIT,
+                             igrf_dec=float(df[sample]['IGRF_local_dec']),
+                             calculated_mag_dec=df[sample]['calculated_mag_dec'])
+    igrf_mean = df.transpose()['IGRF_local_dec'].mean()
+    sam_log.info('site_averages', site_id + ' average of local IGRF '
+                 'declination is: ' + str(igrf_mean), site_id=site_id,
+                 igrf_dec_mean=igrf_mean)
 
     for sample in samples:
-        # assign variables for easy refrence
-        site_id = hdf['site_info']['site_id']
-        if not math.isnan(df[sample]['runs']):
-            runs = df[sample]['runs'].split(';')
-        else:
-            runs = []
-
         # decide which core_strike to use, default is sun_core_strike but if not supplied
         # magnetic_core_strike will be used
         if type(df[sample]['correct_bedding_using_local_dec']) == float and \
@@ -220,94 +736,267 @@ def main():
                 df[sample]['core_strike'] = float(df[sample]['sun_core_strike'])
                 df[sample]['comment'] = 'sun compass orientation'
 
-        if ((df[sample]['correct_bedding_using_local_dec']) == 'yes' or
-                (df[sample]['correct_bedding_using_local_dec']) == 'Yes' or
-                (df[sample]['correct_bedding_using_local_dec']) == 'YES'):
+        if (df[sample]['correct_bedding_using_local_dec'] in
+                ['yes', 'Yes', 'YES']):
             df[sample]['corrected_bedding_strike'] = (float(df[sample]['bedding_strike']) +
                                                       float(df[sample]['IGRF_local_dec']))
 
+    if flush:
+        warnings.flush()
+
+
+def write_sam_file(output_directory, df, hdf):
+    """
+    DESCRIPTION
+        Writes the .sam header file of a site.
+
+        @param: output_directory - directory to write to
+        @param: df - sample Dataframe
+        @param: hdf - site DataFrame
+
+    """
+    write_text(os.path.join(output_directory,
+                            hdf['site_info']['site_id'] + '.sam'),
+               render_sam_file(df, hdf))
+
+
+def render_sam_file(df, hdf):
+    """
+    Returns the text of the .sam header file of a site.
+    """
+    samples = df.keys()
+    site_values = ['site_lat', 'site_long']
+
+    # setting name, the site_id if the template has none
+    site_name = hdf['site_info']['site_name']
+    if not isinstance(site_name, str):
+        site_name = hdf['site_info']['site_id']
+    sam_header = site_name + '\r\n'
+
+    # creating long lat and dec info
+    for value in site_values:
+        # round a copy, the full precision values are kept for the summary
+        rounded = str(round(float(hdf['site_info'][value]), 1))
+        # format latitude values
+        if value == 'site_lat':
+            sam_header += ' ' + rounded
+            # format longitude values and force to 0-360
+        if value == 'site_long':
+            sam_header += ' {:05.1f}'.format(float(rounded)%360)
+    sam_header += ' '*(3) + '0.0'
+    sam_header += '\r\n'
+
+    # making writing sample info
+    for sample in samples:
+        sam_header += hdf['site_info']['site_id'] + str(sample) + '\r\n'
+    return sam_header
+
+
+def write_sample_files(output_directory, df, hdf, formatter, warnings=None,
+                       merge=False):
+    """
+    DESCRIPTION
+        Writes one file per sample holding the sample orientation followed by
+        any measurement runs.
+
+        With merge, existing sample files are not rewritten: their header
+        lines are updated (in place when the length allows) and only runs
+        that are not yet in the file are appended (see
+        sam_merge.merge_sample_file).
+
+        @param: output_directory - directory to write to
+        @param: df - sample Dataframe
+        @param: hdf - site DataFrame
+        @param: formatter - SampleFormatter used for the header lines
+        @param: warnings - sam_log.SiteWarnings collecting the warnings of
+                the site (they are shown right away if not given)
+        @param: merge - merge into existing sample files
+
+    """
+    site_id = hdf['site_info']['site_id']
+    if warnings is None:
+        warnings = sam_log.SiteWarnings(site_id)
+        flush = True
+    else:
+        flush = False
+    write_files(output_directory,
+                render_sample_files(df, hdf, formatter, warnings), merge)
+    if flush:
+        warnings.flush()
+
+
+def render_sample_files(df, hdf, formatter, warnings):
+    """
+    DESCRIPTION
+        Renders the file of every sample (see write_sample_files).
+
+    OUTPUT
+        list of (file name, text, (header lines, runs)) for write_files
+
+    """
+    site_id = hdf['site_info']['site_id']
+    heads, sample_runs = sample_heads(df, hdf, formatter, warnings)
+    files = []
+    for i, sample in enumerate(df.keys()):
+        new_file = heads[i]
+
+        # if there are previous sample runs write that to the bottem of the file
+        for run in sample_runs[i]:
+            new_file += run + '\r\n'
+
+        new_file = new_file.rstrip('\r\n') + '\r\n'
+        files.append((site_id + str(sample), new_file,
+                      (heads[i], sample_runs[i])))
+    return files
+
+
+def write_files(output_directory, files, merge=False):
+    """
+    DESCRIPTION
+        Writes rendered files.
+
+        @param: output_directory - directory to write to
+        @param: files - list of (file name, text, sample) where sample is
+                the header lines and runs of a sample file (see
+                render_sample_files) and None for other files
+        @param: merge - merge sample files into existing ones (see
+                sam_merge.merge_sample_file) instead of rewriting them
+
+    """
+    for name, text, sample in files:
+        path = os.path.join(output_directory, name)
+        if merge and sample is not None and os.path.exists(path):
+            header, appended = merge_sample_file(path, *sample)
+            sam_log.debug('merge', 'Merging into file - %s (header %s, %d '
+                          'run(s) appended)' % (path, header, appended),
+                          path=path, header=header, appended=appended)
+            continue
+        write_text(path, text)
+
+
+def write_text(path, text):
+    sam_log.debug('write', 'Writing file - ' + path)
+    out_file = open(path, 'w+')
+    out_file.write(text)
+    out_file.close()
+
+
+def sample_heads(df, hdf, formatter, warnings):
+    """
+    DESCRIPTION
+        Fills in the defaults of the sample fields and renders the two
+        header lines (name and comment, orientation) of every sample file.
+        The rounded values are written back to df for the rewritten .csv.
+
+        @param: df - sample Dataframe
+        @param: hdf - site DataFrame
+        @param: formatter - SampleFormatter used for the header lines
+        @param: warnings - sam_log.SiteWarnings collecting the warnings of
+                the site
+
+    OUTPUT
+        heads - list of the header lines of every sample
+        sample_runs - list of the measurement runs of every sample
+
+    """
+    samples = df.keys()
+    site_id = hdf['site_info']['site_id']
+    comments, sample_runs, bedding_fields, default_mass = [], [], [], []
+    columns = dict((field, []) for field in formatter.fields)
+
+    for sample in samples:
+        if isinstance(df[sample]['runs'], str):
+            runs = df[sample]['runs'].split(';')
+        else:
+            runs = []
+        sample_runs.append(runs)
+
+        correct_bedding = (df[sample]['correct_bedding_using_local_dec'] in
+                           ['yes', 'Yes', 'YES'])
+
         comment = df[sample]['comment']
 
         # check for no comment
         if type(comment) == float and math.isnan(comment):
             comment = ''
+        comments.append(comment)
 
-        # ensure input is valid
-        assert (len(site_id) <= 5),\
-            "Locality ID exceeds 5 characters: refer to:"\
-            "http://cires.colorado.edu/people/jones.craig/PMag_Formats.html "\
-            "(although that says that 4 is the limit)"
-        assert (len(comment) <= 255),\
-            "Sample comment exceeds 255 characters: refer to:"\
-            "http://cires.colorado.edu/people/jones.craig/PMag_Formats.html"
-        assert (len(str(sample)) <= 9),\
-            "Sample name exceeds 9 characters: refer to:"\
-            "http://cires.colorado.edu/people/jones.craig/PMag_Formats.html"
-
-        # write sample name and comment for sample file
-        new_file = site_id + ' ' + str(sample) + ' ' + comment + '\r\n'
-
-        # start second line strat_level get's special treatment
+        # strat_level get's special treatment and is written as entered
         if (math.isnan(float(df[sample]['strat_level']))):
             df[sample]['strat_level'] = "     0"
         df[sample]['strat_level'] = str((df[sample]['strat_level']))
-        assert (len(df[sample]['strat_level']) <= 6),\
-            "Length of strat_level exceeds 6 characters: refer to:"\
-            "http://cires.colorado.edu/people/jones.craig/PMag_Formats.html"
-        new_file += ' ' + ' '*(6-len(df[sample]['strat_level'])) + df[sample]['strat_level']
-
-        # write in sample attributes on the second line
-        for attribute in attributes:
-            # assert (str(df[sample][attribute]).isdigit()),\
-            #         str( attribute) + ' is a requred numeric value'
-            # set default bedding strike and dip to 0 if user did not supply
-            if (attribute =='bedding_strike') and (math.isnan(float(df[sample][attribute]))):
-                df[sample][attribute] = 90.0
-            if (attribute =='bedding_dip') and (math.isnan(float(df[sample][attribute]))):
-                df[sample][attribute] = 0.0
-            if attribute == 'bedding_strike' and \
-                        ((df[sample]['correct_bedding_using_local_dec']) == 'yes' or
-                         (df[sample]['correct_bedding_using_local_dec']) == 'Yes' or
-                         (df[sample]['correct_bedding_using_local_dec']) == 'YES') and\
-                    not math.isnan(df[sample]['corrected_bedding_strike']):
-                attribute = 'corrected_bedding_strike'
-
-            if type(df[sample][attribute]) == float and math.isnan(df[sample][attribute]):
-                if attribute == 'mass':
-                    df[sample][attribute] = '1.0'
-                    print(
-                        "no mass found for sample %s, setting to default = 1.0 g" % (sample))
-                else:
-                    df[sample][attribute] = ''
-            else:
-                df[sample][attribute] = str(round(float(df[sample][attribute]), 1))
-
-            # attributes must follow standard sam format
-            assert (len(df[sample][attribute]) <= 5),\
-                "Length of " + attribute + \
-                " exceeds 5 characters: refer to:" + \
-                "http://cires.colorado.edu/people/jones.craig/PMag_Formats.html"
-
-            new_file += ' ' + ' '*(5-len(df[sample][attribute])) + df[sample][attribute]
+        columns['strat_level'].append(df[sample]['strat_level'])
+
+        # set default bedding strike and dip to 0 if user did not supply
+        if math.isnan(float(df[sample]['bedding_strike'])):
+            df[sample]['bedding_strike'] = 90.0
+        if math.isnan(float(df[sample]['bedding_dip'])):
+            df[sample]['bedding_dip'] = 0.0
+        if correct_bedding and not math.isnan(df[sample]['corrected_bedding_strike']):
+            bedding_fields.append('corrected_bedding_strike')
+        else:
+            bedding_fields.append('bedding_strike')
+
+        default_mass.append(type(df[sample]['mass']) == float and
+                            math.isnan(df[sample]['mass']))
+        if default_mass[-1]:
+            df[sample]['mass'] = '1.0'
+            warnings.add('default_mass', sample,
+                         "no mass found, setting to default = 1.0 g")
+
+        for field in ['core_strike', 'core_dip', 'bedding_dip', 'mass']:
+            columns[field].append(float(df[sample][field]))
+        columns['bedding_strike'].append(float(df[sample][bedding_fields[-1]]))
+
+    # round and pad every sample at once, attributes must follow standard sam
+    # format (refer to: SAM_FORMAT_URL)
+    formatted = formatter.format_columns(columns)
+    heads, problems = formatter.render_formatted(site_id, samples, comments,
+                                                 formatted)
+    if problems:
+        raise ValueError("values do not fit the SAM format, refer to: " +
+                         SAM_FORMAT_URL + "\n    " +
+                         "\n    ".join(describe_problems(problems, samples)))
+
+    # keep the rounded values for the rewritten .csv
+    for i, sample in enumerate(samples):
+        for field in ['core_strike', 'core_dip', 'bedding_dip', 'mass']:
+            df[sample][field] = str(formatted[field][i])
+        df[sample][bedding_fields[i]] = str(formatted['bedding_strike'][i])
+    # kept for the summary table, it is not written to the .csv
+    df.loc['default_mass'] = default_mass
+    return heads, sample_runs
+
+
+def write_csv_file(file_name, output_directory, df, sdf, hdf, template=None):
+    """
+    DESCRIPTION
+        Rewrites the site template with the calculated fields filled in.
 
-        new_file += '\r\n'
+        @param: file_name - path of the original .csv template
+        @param: output_directory - directory to write to
+        @param: df - sample Dataframe
+        @param: sdf - sun compass Dataframe
+        @param: hdf - site DataFrame
+        @param: template - text of the template if it was not read from
+                file_name (see read_site)
 
-        # if there are previous sample runs write that to the bottem of the file
-        for run in runs:
-            new_file += run + '\r\n'
+    """
+    write_text(os.path.join(output_directory,
+                            hdf['site_info']['site_id'] + '.csv'),
+               render_csv_file(file_name, df, sdf, hdf, template))
 
-        # create and write sample file
-        new_file = new_file.rstrip('\r\n') + '\r\n'
-        print('Writing file - ' + os.path.join(output_directory, site_id + str(sample)))
-        sample_file = open(os.path.join(output_directory, site_id + str(sample)), 'w+')
-        sample_file.write(new_file)
-        sample_file.close()
 
-    ###########################################################################
-    #                        Write New Values to .csv                         #
-    ###########################################################################
+def render_csv_file(file_name, df, sdf, hdf, template=None):
+    """
+    Returns the text of the rewritten site template (see write_csv_file).
+    """
+    samples = df.keys()
 
-    csv_file = open(file_name, newline='')
+    if template is None:
+        csv_file = open(file_name, newline='')
+    else:
+        csv_file = io.StringIO(template, newline='')
     csv_str = ''
 
     for i in range(5):
@@ -342,20 +1031,14 @@ def main():
             else:
                 raise KeyError('there is no item: ' + header[i])
         csv_str += reduce(lambda x, y: x + ',' + y, items) + '\r\n'
-
-    print('Writing file - ' + os.path.join(output_directory, hdf['site_info']['site_id'] + '.csv'))
-    new_csv_file = open(os.path.join(output_directory, hdf['site_info']['site_id'] + '.csv'), 'w+')
-    new_csv_file.write(csv_str)
-    new_csv_file.close()
-
-    generate_inp_file(output_directory, df, hdf)
+    csv_file.close()
+    return csv_str
 
 
-def fix_line_breaks():
-    """ Reads in the file given as a command line argument and rewrites it both line
-        break types '\ r' and '\ n' so that python will for sure register all lines
+def fix_line_breaks(file_name):
+    """ Reads in the given file and rewrites it both line break types '\ r'
+        and '\ n' so that python will for sure register all lines
     """
-    file_name = sys.argv[1]
     # fix line breaks between different OS and python's default
     try:
         csv_file = open(file_name, 'r')
@@ -395,94 +1078,38 @@ def generate_inp_file(od, df, hdf):
         .inp file
 
     """
+    if od != '' and not os.path.exists(od):
+        os.makedirs(od)
+    write_text(os.path.join(od, hdf['site_info']['site_id'] + '.inp'),
+               render_inp_file(df, hdf))
 
+
+def render_inp_file(df, hdf):
+    """
+    Returns the text of the .inp file of a site (see generate_inp_file).
+    """
     # initialize inp file
     inps = ""
     inps += "CIT\n"
     inps += "sam_path\tfield_magic_codes\tlocation\tnaming_convention\tnum_terminal_char\tdont_average_replicate_measurements\tpeak_AF\ttime_stamp\n"
     inps += (os.path.join('.', hdf['site_info']['site_id'] + '.sam')) + '\t'
-    if all(df.T['comment'] == 'sun compass orientation'):
-        inps += 'SO-SUN\t'
-    elif all(df.T['comment'] == 'mag compass orientation (IGRF corrected)'):
-        inps += 'SO-MAG\t'
-    else:
-        inps += 'SO-SM\t'
-
-    inps += (hdf['site_info']['site_name'] if hdf['site_info']['site_name']
-             != '' or hdf['site_info']['site_name'] is not None else 'unknown') + '\t'
-
-    # DETERMINE SITE NAMING CONVENTION
-    first_sample_id = str(df.keys()[0])
-    """Sample naming conventions:
-    [1] XXXXY: where XXXX is an arbitrary length site designation and Y
-    is the single character sample designation.  e.g., TG001a is the
-    first sample from site TG001.    [default]
-    [2] XXXX-YY: YY sample from site XXXX (XXX, YY of arbitary length)
-    [3] XXXX.YY: YY sample from site XXXX (XXX, YY of arbitary length)
-    [4-Z] XXXX[YYY]:  YYY is sample designation with Z characters from site XXX
-    [5] site name = sample name
-    [6] site name entered in site_name column in the orient.txt format input file
-    [7-Z] [XXX]YYY:  XXX is site designation with Z characters from samples  XXXYYY
-    """
-    # check for naming convention 2
-    if first_sample_id[0] == '-' or hdf['site_info']['site_id'][-1] == '-':
-        inps += '2\t'
-        # if delimiter in sample id, remove it
-        if first_sample_id[0] == '-':
-            first_sample_id.replace('-', '', 1)
-    # check for naming convention 3
-    elif first_sample_id[0] == '.' or hdf['site_info']['site_id'][-1] == '.':
-        inps += '3\t'
-        if first_sample_id[0] == '.':
-            first_sample_id.replace('.', '', 1)
-    # check for naming convention 5
-    elif hdf['site_info']['site_id'] == first_sample_id:
-        inps += '5\t'
-    # assign 4 as last resort -- should also notify user of uncertain values
-    else:
-        inps += '4\t'
-
-    # DETERMINE NUMBER OF TERMINAL CHARACTERS
-    sample_list = list(map(str, df.keys()))
-    sample_ct = len(sample_list)
-    # get length of shortest sample name
-    char_num = len(min(sample_list, key=len))
-    term_ct, term_unique = 0, 0
-    # initialize list keeping track of remaining (left) characters
-    the_rest = sample_list
-    # scan sample name from right to left
-    while term_ct < char_num:
-        # pop off last character from each name
-        lastchar = [t[-1] for t in the_rest]
-        the_rest = [t[0:-1] for t in the_rest]
-        term_ct += 1
-        unique_chars = np.unique(lastchar)
-        unique_rest = np.unique(the_rest)
-        # determine the number of characters distinguishing specimen/sample
-        # NOTE: this is not flawless, but appears to work in most cases.
-        if len(unique_chars) == 1 and len(unique_rest) == sample_ct:
-            # term_unique += 1
-            term_unique = term_ct
-            continue
-        if len(unique_rest) < sample_ct:
-            break
-
+    inps += orientation_method(df) + '\t'
+    inps += location_name(hdf) + '\t'
+    convention, term_unique = naming_convention(df, hdf)
+    inps += convention + '\t'
     inps += str(int(term_unique)) + '\t'
     inps += "True\t"
     inps += "None\t"
     inps += '0.0\n'
-
-    print('Writing file - ' + os.path.join(od, hdf['site_info']['site_id'] + '.inp'))
-    if od != '' and not os.path.exists(od):
-        os.makedirs(od)
-    inpf = open(os.path.join(od, hdf['site_info']['site_id'] + '.inp'), 'w+')
-    inpf.write(inps)
-    inpf.close()
+    return inps
 
 
 if __name__ == "__main__":
     if '-h' in sys.argv:
         help(main)
         sys.exit()
-    fix_line_breaks()
-    main()
+    try:
+        main()
+    except SiteValidationError as err:
+        print(err, file=sys.stderr)
+        sys.exit(1)
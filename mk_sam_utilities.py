@@ -1,9 +1,15 @@
 import sys
 import numpy.linalg
 import time
+import functools
 from datetime import datetime as dt
 import numpy as np
 
+# generation of the reference field used by doigrf, stored with processed
+# results so that they can be traced back to the model
+FIELD_MODEL = 'IGRF-13'
+
+
 def igrf(input_list):
     """
     prints out Declination, Inclination, Intensity data
@@ -61,54 +67,131 @@ def doigrf(lon, lat, alt, date, **kwargs):
     To check the results you can run the interactive program at the NGDC
     www.ngdc.noaa.gov/geomag-web
     """
-    import coefficients as cf
-    gh, sv = [], []
     colat = 90. - lat
 #! convert to colatitude for MB routine
     if lon < 0:
         lon = lon + 360.
 # ensure all positive east longitudes
     itype = 1
+    models, igrf13coeffs, psvmodels, psvcoeffs = get_field_model(**kwargs)
+# use geodetic coordinates
+    if 'models' in kwargs:
+        if 'mod' in list(kwargs.keys()):
+            return psvmodels, psvcoeffs
+        else:
+            return models, igrf13coeffs
+    if date < -12000:
+        print('too old')
+        return
+    gh, sv, model = field_coefficients(date, kwargs.get('mod'), models,
+                                       igrf13coeffs, psvmodels, psvcoeffs)
+    x, y, z, f = magsyn(gh, sv, model, date, itype, alt, colat, lon)
+    if 'coeffs' in list(kwargs.keys()):
+        return gh
+    return x, y, z, f
+
+
+# PSV models for dates before 1900 that load_field_model reads (any other
+# name gives cals10k, the IGRF is used without a model)
+PSV_MODELS = ['arch3k', 'cals3k', 'pfm9k', 'hfm10k', 'cals10k.2', 'cals10k.1b',
+              'cals10k', 'shadif14k', 'shawq2k', 'shawqIA']
+
+# coefficient tables already loaded by get_field_model, by PSV model
+_field_models = {}
+
+
+def get_field_model(**kwargs):
+    """
+    Loads the igrf13 coefficients and, if a model is given with mod=..., the
+    coefficients of that PSV model (see doigrf for the list of models). The
+    tables are only loaded once per model and must not be modified.
+
+    Returns models, igrf13coeffs, psvmodels, psvcoeffs where the PSV values
+    are None without mod.
+    """
+    mod = kwargs.get('mod')
+    if mod not in _field_models:
+        _field_models[mod] = load_field_model(mod)
+    return _field_models[mod]
+
+
+def use_field_model(field_model, mod=None):
+    """
+    Makes get_field_model return field_model (models, igrf13coeffs,
+    psvmodels, psvcoeffs) for mod instead of loading the coefficients, e.g.
+    tables shared between processes (see sam_shared.py).
+    """
+    _field_models[mod] = tuple(field_model)
+
+
+def load_field_model(mod=None):
+    """
+    Reads the coefficient tables for get_field_model.
+    """
+    import coefficients as cf
+    psvmodels, psvcoeffs = None, None
     models, igrf13coeffs = cf.get_igrf13()
     #models, igrf12coeffs = cf.get_igrf12()
-    if 'mod' in list(kwargs.keys()):
-        if kwargs['mod'] == 'arch3k':
+    if mod is not None:
+        if mod == 'arch3k':
             psvmodels, psvcoeffs = cf.get_arch3k()  # use ARCH3k coefficients
-        elif kwargs['mod'] == 'cals3k':
+        elif mod == 'cals3k':
             # use CALS3K_4b coefficients between -1000,1940
             psvmodels, psvcoeffs = cf.get_cals3k()
-        elif kwargs['mod'] == 'pfm9k':
+        elif mod == 'pfm9k':
             # use PFM9k (Nilsson et al., 2014), coefficients from -7000 to 1900
             psvmodels, psvcoeffs = cf.get_pfm9k()
-        elif kwargs['mod'] == 'hfm10k':
+        elif mod == 'hfm10k':
             # use HFM.OL1.A1 (Constable et al., 2016), coefficients from -8000
             # to 1900
             psvmodels, psvcoeffs = cf.get_hfm10k()
-        elif kwargs['mod'] == 'cals10k.2':
+        elif mod == 'cals10k.2':
             # use CALS10k.2 (Constable et al., 2016), coefficients from -8000
             # to 1900
             psvmodels, psvcoeffs = cf.get_cals10k_2()
-        elif kwargs['mod'] == 'shadif14k':
+        elif mod == 'shadif14k':
             # use CALS10k.2 (Constable et al., 2016), coefficients from -8000
             # to 1900
             psvmodels, psvcoeffs = cf.get_shadif14k()
-        elif kwargs['mod'] == 'shawq2k':
+        elif mod == 'shawq2k':
             psvmodels, psvcoeffs = cf.get_shawq2k()
-        elif kwargs['mod'] == 'shawqIA':
+        elif mod == 'shawqIA':
             psvmodels, psvcoeffs = cf.get_shawqIA()
         else:
             # Korte and Constable, 2011;  use prior to -1000, back to -8000
             psvmodels, psvcoeffs = cf.get_cals10k()
-# use geodetic coordinates
-    if 'models' in kwargs:
-        if 'mod' in list(kwargs.keys()):
-            return psvmodels, psvcoeffs
+    return models, igrf13coeffs, psvmodels, psvcoeffs
+
+
+def field_model_epoch(date, mod=None):
+    """
+    Returns the epoch of the coefficients field_coefficients uses for date,
+    i.e. the begin date passed to magsyn. Works on scalars and arrays.
+    """
+    date = numpy.asarray(date, dtype=float)
+    if mod == 'shadif14k':
+        incr = numpy.where(date < -10000, 100, 50)
+    else:
+        if mod == 'cals10k':
+            psv_incr = 50
+        elif mod == 'shawq2k' or mod == 'shawqIA':
+            psv_incr = 25
         else:
-            return models, igrf13coeffs
-    if date < -12000:
-        print('too old')
-        return
-    if 'mod' in list(kwargs.keys()) and kwargs['mod'] == 'shadif14k':
+            psv_incr = 10
+        incr = numpy.where(date < -1000, 10,
+                           numpy.where(date < 1900, psv_incr, 5))
+    return date - date % incr
+
+
+def field_coefficients(date, mod, models, igrf13coeffs, psvmodels, psvcoeffs):
+    """
+    Calculates the main field and secular variation coefficients for date
+    as used by doigrf (interpolated between model epochs before 2020 and
+    extrapolated from the 2020 secular variation after).
+
+    Returns gh, sv and the epoch they refer to (begin date for magsyn).
+    """
+    if mod == 'shadif14k':
         if date < -10000:
             incr = 100
         else:
@@ -116,17 +199,15 @@ def doigrf(lon, lat, alt, date, **kwargs):
         model = date - date % incr
         gh = psvcoeffs[psvmodels.index(int(model))]
         sv = (psvcoeffs[psvmodels.index(int(model + incr))] - gh)/ float(incr)
-        x, y, z, f = magsyn(gh, sv, model, date, itype, alt, colat, lon)
     elif date < -1000:
         incr = 10
         model = date - date % incr
         gh = psvcoeffs[psvmodels.index(int(model))]
         sv = (psvcoeffs[psvmodels.index(int(model + incr))] - gh)/float(incr)
-        x, y, z, f = magsyn(gh, sv, model, date, itype, alt, colat, lon)
     elif date < 1900:
-        if kwargs['mod'] == 'cals10k':
+        if mod == 'cals10k':
             incr = 50
-        elif kwargs['mod'] == 'shawq2k' or kwargs['mod']=='shawqIA':
+        elif mod == 'shawq2k' or mod=='shawqIA':
             incr = 25
         else:
             incr = 10
@@ -137,43 +218,15 @@ def doigrf(lon, lat, alt, date, **kwargs):
         else:
             field2 = igrf13coeffs[models.index(1940)][0:120]
             sv = (field2 - gh)/float(1940 - model)
-        x, y, z, f = magsyn(gh, sv, model, date, itype, alt, colat, lon)
     else:
         model = date - date % 5
         if date <2020:
             gh = np.array(igrf13coeffs[models.index(model)])
             sv = (np.array(igrf13coeffs[models.index(model + 5)]) - gh)/5.
-            x, y, z, f = magsyn(gh, sv, model, date, itype, alt, colat, lon)
         else:
             gh = igrf13coeffs[models.index(2020)]
             sv = np.array(igrf13coeffs[models.index(2020.2)])
-            x, y, z, f = magsyn(gh, sv, model, date, itype, alt, colat, lon)
-    if 'coeffs' in list(kwargs.keys()):
-        return gh
-        #model = date - date % incr
-        #gh = psvcoeffs[psvmodels.index(model)]
-        #if model + incr < 1900:
-        #    sv = (psvcoeffs[psvmodels.index(model + incr)] - gh)/float(incr)
-        #else:
-        #    field2 = igrf13coeffs[models.index(1940)][0:120]
-        #    sv = (field2 - gh)/float(1940 - model)
-        #x, y, z, f = magsyn(gh, sv, model, date, itype, alt, colat, lon)
-    #else:
-    #    model = date - date % 5
-    #    if date <2020:
-    #        gh = np.array(igrf13coeffs[models.index(model)])
-    #        sv = (np.array(igrf13coeffs[models.index(model + 5)]) - gh)/5.
-    #        x, y, z, f = magsyn(gh, sv, model, date, itype, alt, colat, lon)
-    #    else:
-    #        gh = igrf13coeffs[models.index(2020)]
-    #        sv = np.array(igrf13coeffs[models.index(2020.2)])
-    #        x, y, z, f = magsyn(gh, sv, model, date, itype, alt, colat, lon)
-    #if 'coeffs' in list(kwargs.keys()):
-    #    return gh
-    #else:
-    #    return x, y, z, f
-    return x, y, z, f
-#
+    return gh, sv, model
 
 
 def unpack(gh):
@@ -231,7 +284,16 @@ def magsyn(gh, sv, b, date, itype, alt, colat, elong):
     igrf subroutine calculates
     the proper main field and secular variation coefficients (interpolated between
     dgrf values or extrapolated from 1995 sv values as appropriate).
+
+    Uses the compiled kernel of sam_jit when numba is installed.
     """
+    # imported on first use, importing numba takes most of the import time
+    # of this module
+    import sam_jit
+    if sam_jit.active():
+        x, y, z, f = sam_jit.magsyn_points(gh, sv, b, date, itype, alt, colat,
+                                           elong)
+        return x[()], y[()], z[()], f[()]
     p = numpy.zeros((66), 'f')
     q = numpy.zeros((66), 'f')
     cl = numpy.zeros((10), 'f')
@@ -324,6 +386,191 @@ def magsyn(gh, sv, b, date, itype, alt, colat, elong):
     return x, y, z, f
 
 
+def magsyn_array(gh, sv, b, date, itype, alt, colat, elong):
+    """
+    Array version of magsyn: computes x, y, z and f for many dates and
+    positions at once. The recurrence over the spherical harmonic terms is
+    the same as in magsyn but every step is done for all points together.
+
+    Input:
+          gh, sv = main field and secular variation coefficients, either
+                   one set (1D) for all points or one row per point (2D)
+          b, date, alt, colat, elong = arrays (or scalars) broadcast
+                   against each other, see magsyn
+          itype = 1, if geodetic coordinates are used, 2 if geocentric
+
+    Output:
+          x, y, z, f arrays (see magsyn)
+
+    Uses the compiled kernel of sam_jit when numba is installed.
+    """
+    import sam_jit
+    if sam_jit.active():
+        return sam_jit.magsyn_points(gh, sv, b, date, itype, alt, colat, elong)
+    b, date, alt, colat, elong = numpy.broadcast_arrays(
+        *[numpy.asarray(v, dtype=float) for v in [b, date, alt, colat, elong]])
+    shape = date.shape
+    b, date, alt, colat, elong = [v.ravel() for v in [b, date, alt, colat, elong]]
+    npts = date.size
+    gh = numpy.asarray(gh, dtype=float)
+    sv = numpy.asarray(sv, dtype=float)
+    if gh.ndim == 1:
+        gh = gh[:, None]
+    else:
+        gh = gh.T
+    if sv.ndim == 1:
+        sv = sv[:, None]
+    else:
+        sv = sv.T
+    # float32 like magsyn so both give the same numbers
+    p = numpy.zeros((66, npts), 'f')
+    q = numpy.zeros((66, npts), 'f')
+    cl = numpy.zeros((10, npts), 'f')
+    sl = numpy.zeros((10, npts), 'f')
+    t = date - b
+    r = alt
+    one = colat*0.0174532925
+    ct = numpy.cos(one)
+    st = numpy.sin(one)
+    one = elong*0.0174532925
+    cl[0] = numpy.cos(one)
+    sl[0] = numpy.sin(one)
+    x = numpy.zeros(npts)
+    y = numpy.zeros(npts)
+    z = numpy.zeros(npts)
+    cd, sd = 1.0, 0.0
+    l, ll, m, n = 1, 0, 1, 0
+    if itype != 2:
+        # if required, convert from geodectic to geocentric
+        a2 = 40680925.0
+        b2 = 40408585.0
+        one = a2 * st * st
+        two = b2 * ct * ct
+        three = one + two
+        rho = numpy.sqrt(three)
+        r = numpy.sqrt(alt*(alt+2.0*rho) + (a2*one+b2*two)/three)
+        cd = (alt + rho) / r
+        sd = (a2 - b2) / rho * ct * st / r
+        one = ct
+        ct = ct*cd - st*sd
+        st = st*cd + one*sd
+    ratio = 6371.2 / r
+    rr = ratio * ratio
+    pole = st == 0.0
+
+    # compute Schmidt quasi-normal coefficients p and x(=q)
+    p[0] = 1.0
+    p[2] = st
+    q[0] = 0.0
+    q[2] = ct
+    for k in range(1, 66):
+        if n < m:
+            m = 0
+            n = n + 1
+            rr = rr * ratio
+            fn = n
+            gn = n - 1
+        fm = m
+        if k != 2:
+            if m == n:
+                one = numpy.sqrt(1.0 - 0.5/fm)
+                j = k - n - 1
+                p[k] = one * st * p[j]
+                q[k] = one * (st*q[j] + ct*p[j])
+                cl[m-1] = cl[m-2]*cl[0] - sl[m-2]*sl[0]
+                sl[m-1] = sl[m-2]*cl[0] + cl[m-2]*sl[0]
+            else:
+                gm = m * m
+                one = numpy.sqrt(fn*fn - gm)
+                two = numpy.sqrt(gn*gn - gm) / one
+                three = (fn + gn) / one
+                i = k - n
+                j = i - n + 1
+                p[k] = three*ct*p[i] - two*p[j]
+                q[k] = three*(ct*q[i] - st*p[i]) - two*q[j]
+
+        # synthesize x, y, and z in geocentric coordinates.
+        one = (gh[l-1] + sv[ll+l-1]*t)*rr
+        if m != 0:
+            two = (gh[l] + sv[ll+l]*t)*rr
+            three = one*cl[m-1] + two*sl[m-1]
+            x = x + three*q[k]
+            z = z - (fn + 1.0)*three*p[k]
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                y = y + numpy.where(pole,
+                                    (one*sl[m-1] - two*cl[m-1])*q[k]*ct,
+                                    (one*sl[m-1] - two*cl[m-1])*fm*p[k]/st)
+            l = l + 2
+        else:
+            x = x + one*q[k]
+            z = z - (fn + 1.0)*one*p[k]
+            l = l + 1
+        m = m + 1
+    # convert to coordinate system specified by itype
+    one = x
+    x = x*cd + z*sd
+    z = z*cd - one*sd
+    f = numpy.sqrt(x*x + y*y + z*z)
+    return x.reshape(shape), y.reshape(shape), z.reshape(shape), f.reshape(shape)
+
+
+def doigrf_array(lon, lat, alt, date, mod=None, field_model=None):
+    """
+    Array version of doigrf. The coefficients are looked up once for every
+    model epoch that occurs in date and the field is synthesized for all
+    points of an epoch in a single magsyn_array call.
+
+    Parameters:
+    -----------
+    lon, lat, alt, date : arrays (or scalars) broadcast against each other,
+                          see doigrf
+    mod : PSV model to use before 1900, see doigrf
+    field_model : optional result of get_field_model(mod=mod) so that the
+                  coefficient tables are not loaded again
+
+    Return
+    -----------
+    x, y, z, f arrays (NaN for dates before -12000)
+    """
+    lon, lat, alt, date = numpy.broadcast_arrays(
+        *[numpy.asarray(v, dtype=float) for v in [lon, lat, alt, date]])
+    shape = date.shape
+    lon, lat, alt, date = [v.ravel() for v in [lon, lat, alt, date]]
+    if field_model is None:
+        field_model = get_field_model(mod=mod)
+    models, igrf13coeffs, psvmodels, psvcoeffs = field_model
+    colat = 90. - lat
+    lon = numpy.where(lon < 0, lon + 360., lon)
+    out = numpy.full((4, date.size), numpy.nan)
+    epochs = numpy.where(date < -12000, numpy.nan, field_model_epoch(date, mod))
+    for epoch in numpy.unique(epochs[~numpy.isnan(epochs)]):
+        idx = numpy.flatnonzero(epochs == epoch)
+        # every date of an epoch gets the coefficients of the first one
+        gh, sv, model = field_coefficients(date[idx[0]], mod, models,
+                                           igrf13coeffs, psvmodels, psvcoeffs)
+        gh = numpy.asarray(gh, dtype=float)[0:120]
+        sv = numpy.asarray(sv, dtype=float)[0:120]
+        out[:, idx] = magsyn_array(gh, sv, model, date[idx], 1, alt[idx],
+                                   colat[idx], lon[idx])
+    x, y, z, f = [v.reshape(shape) for v in out]
+    return x, y, z, f
+
+
+def igrf_array(date, alt, lat, lon, mod=None, field_model=None):
+    """
+    Array version of igrf: returns arrays of Declination, Inclination and
+    Intensity for dates (years and decimals of a year A.D.), altitudes (km),
+    latitudes and longitudes broadcast against each other.
+    """
+    x, y, z, f = doigrf_array(numpy.asarray(lon, dtype=float) % 360., lat, alt,
+                              date, mod=mod, field_model=field_model)
+    rad = numpy.pi/180.
+    with numpy.errstate(invalid='ignore'):
+        dec = (numpy.arctan2(y, x)/rad) % 360.
+        inc = numpy.arcsin(z/f)/rad
+    return dec, inc, f
+
+
 #def measurements_methods(meas_data, noave):
 #    """
 #    get list of unique specs
@@ -941,6 +1188,165 @@ def sundec(sundata):
     return suncor
 
 
+def sundec_array(year, mon, day, hours, minutes, delta_u, lat, lon,
+                 shadow_angle):
+    """
+    returns the declinations for arrays of suncompass data, element by
+    element the same as sundec
+
+    INPUT:
+      year, mon, day, hours, minutes : date and local time of the readings
+      delta_u : hours to subtract from local time to get Greenwich Mean Time
+      lat, lon : site latitude, longitude (negative for south and west)
+      shadow_angle : shadow angle of the desired direction wrt the sun
+
+      all inputs are broadcast against each other
+
+    OUTPUT:
+      array of declinations of the desired directions wrt true north.
+
+    Uses the compiled kernel of sam_jit when numba is installed.
+    """
+    import sam_jit
+    if sam_jit.active():
+        return sam_jit.sundec_points(year, mon, day, hours, minutes, delta_u,
+                                     lat, lon, shadow_angle)
+    rad = numpy.pi/180.
+    year, mon, day, hours, minutes, delta_u, lat, lon, shadow_angle = \
+        numpy.broadcast_arrays(*[numpy.asarray(v, dtype=float) for v in
+                                 [year, mon, day, hours, minutes, delta_u,
+                                  lat, lon, shadow_angle]])
+    hrs = hours - numpy.trunc(delta_u)
+    day = day + (hrs > 24) - (hrs < 0)
+    hrs = numpy.where(hrs > 24, hrs - 24, numpy.where(hrs < 0, hrs + 24, hrs))
+    julian_day = julian_array(mon, day, year)
+    utd = (hrs + minutes/60.)/24.
+    greenwich_hour_angle, delta = gha(julian_day, utd)
+    return (sun_azimuth_array(greenwich_hour_angle, delta, lat, lon) +
+            shadow_angle) % 360.
+
+
+def sun_azimuth_array(greenwich_hour_angle, delta, lat, lon):
+    """
+    returns the azimuth of the sun (as sundec finds it) from arrays of the
+    greenwich hour angle and declination of the sun and the site latitude
+    and longitude, all in degrees
+    """
+    rad = numpy.pi/180.
+    H = greenwich_hour_angle + lon
+    H = numpy.where(H > 360, H - 360, H)
+    lat = numpy.where((H > 90) & (H < 270), -lat, lat)
+    # now do spherical trig to get azimuth to sun
+    lat = lat*rad
+    delta = delta*rad
+    H = H*rad
+    ctheta = numpy.sin(lat)*numpy.sin(delta) + numpy.cos(lat) * \
+        numpy.cos(delta)*numpy.cos(H)
+    theta = numpy.arccos(ctheta)
+    beta = numpy.cos(delta)*numpy.sin(H)/numpy.sin(theta)
+    # check which beta
+    beta = numpy.arcsin(beta)/rad
+    beta = numpy.where(delta < lat, 180 - beta, beta)
+    return 180 - beta
+
+
+# solar position models of solar_ephemeris: 'almanac' are the formulas of
+# gha, 'noaa' the more accurate ones of the NOAA solar calculator (Meeus,
+# Astronomical Algorithms)
+SUN_MODELS = ['almanac', 'noaa']
+
+
+def solar_position(julian_day, f, model='almanac'):
+    """
+    returns the declination of the sun and the equation of time (both in
+    degrees) for julian_day (as returned by julian) and the fraction f of the
+    day in UT
+    """
+    rad = numpy.pi/180.
+    if model == 'almanac':
+        greenwich_hour_angle, delta = gha(julian_day, f)
+        eqt = (greenwich_hour_angle - f*360. - 180. + 180.) % 360. - 180.
+        return delta, eqt
+    if model != 'noaa':
+        raise ValueError('unknown solar position model: ' + str(model))
+    # julian returns the day number, the day starts half a day earlier
+    T = (julian_day - 0.5 + f - 2451545.0)/36525.
+    L0 = (280.46646 + T*(36000.76983 + T*0.0003032)) % 360.
+    M = 357.52911 + T*(35999.05029 - 0.0001537*T)
+    e = 0.016708634 - T*(0.000042037 + 0.0000001267*T)
+    C = numpy.sin(M*rad)*(1.914602 - T*(0.004817 + 0.000014*T)) + \
+        numpy.sin(2*M*rad)*(0.019993 - 0.000101*T) + \
+        numpy.sin(3*M*rad)*0.000289
+    omega = 125.04 - 1934.136*T
+    apparent_longitude = L0 + C - 0.00569 - 0.00478*numpy.sin(omega*rad)
+    epsilon = 23. + (26. + (21.448 - T*(46.815 + T*(0.00059 - T*0.001813))) /
+                     60.)/60. + 0.00256*numpy.cos(omega*rad)
+    delta = numpy.arcsin(numpy.sin(epsilon*rad) *
+                         numpy.sin(apparent_longitude*rad))/rad
+    y = numpy.tan(epsilon*rad/2.)**2
+    eqt = (y*numpy.sin(2*L0*rad) - 2*e*numpy.sin(M*rad) +
+           4*e*y*numpy.sin(M*rad)*numpy.cos(2*L0*rad) -
+           0.5*y*y*numpy.sin(4*L0*rad) - 1.25*e*e*numpy.sin(2*M*rad))/rad
+    return delta, eqt
+
+
+@functools.lru_cache(maxsize=1024)
+def solar_ephemeris(julian_day, model='almanac'):
+    """
+    returns the declination of the sun and the equation of time at the start
+    and the end of julian_day (delta0, delta1, eqt0, eqt1 in degrees), the
+    slowly varying terms of the solar position that sundec_ephemeris
+    interpolates over the day. Cached, most readings of a site are taken on a
+    handful of days.
+    """
+    delta0, eqt0 = solar_position(julian_day, 0., model)
+    delta1, eqt1 = solar_position(julian_day, 1., model)
+    return float(delta0), float(delta1), float(eqt0), float(eqt1)
+
+
+def sundec_ephemeris(year, mon, day, hours, minutes, delta_u, lat, lon,
+                     shadow_angle, model='almanac'):
+    """
+    returns the declinations for arrays of suncompass data like
+    sundec_array, but evaluates the solar declination and equation of time
+    once per day (see solar_ephemeris) and interpolates them to the time of
+    each reading. With the 'almanac' model the results differ from sundec
+    by less than 0.01 degrees, apart from readings with the sun close to the
+    zenith or its declination within a few hundredths of a degree of the
+    latitude (where the branch sundec picks flips); 'noaa' uses a more
+    accurate solar position.
+
+    INPUT:
+      as sundec_array
+      model : solar position model, one of SUN_MODELS
+
+    OUTPUT:
+      array of declinations of the desired directions wrt true north.
+    """
+    year, mon, day, hours, minutes, delta_u, lat, lon, shadow_angle = \
+        numpy.broadcast_arrays(*[numpy.asarray(v, dtype=float) for v in
+                                 [year, mon, day, hours, minutes, delta_u,
+                                  lat, lon, shadow_angle]])
+    hrs = hours - numpy.trunc(delta_u)
+    day = day + (hrs > 24) - (hrs < 0)
+    hrs = numpy.where(hrs > 24, hrs - 24, numpy.where(hrs < 0, hrs + 24, hrs))
+    julian_day = julian_array(mon, day, year)
+    utd = (hrs + minutes/60.)/24.
+
+    days, index = numpy.unique(julian_day, return_inverse=True)
+    terms = numpy.full((len(days), 4), numpy.nan)
+    for i, jd in enumerate(days):
+        if not numpy.isnan(jd):
+            terms[i] = solar_ephemeris(float(jd), model)
+    delta0, delta1, eqt0, eqt1 = terms[index.reshape(julian_day.shape)] \
+        .transpose(numpy.roll(range(julian_day.ndim + 1), 1))
+    delta = delta0 + (delta1 - delta0)*utd
+    eqt = eqt0 + (eqt1 - eqt0)*utd
+    greenwich_hour_angle = (utd*360. + eqt + 180.) % 360.
+    return (sun_azimuth_array(greenwich_hour_angle, delta, lat, lon) +
+            shadow_angle) % 360.
+
+
 def gha(julian_day, f):
     """
     returns greenwich hour angle
@@ -999,6 +1405,49 @@ def julian(mon, day, year):
     return julian_day
 
 
+def julian_array(mon, day, year):
+    """
+    returns julian days for arrays of dates, element by element the same as
+    julian (NaN for the year 0)
+    """
+    mon, day, year = numpy.broadcast_arrays(numpy.asarray(mon, dtype=float),
+                                            numpy.asarray(day, dtype=float),
+                                            numpy.asarray(year, dtype=float))
+    ig = 15+31*(10+12*1582)
+    bad = year == 0
+    year = numpy.where(year < 0, year + 1, year)
+    julian_year = numpy.where(mon > 2, year, year - 1)
+    julian_month = numpy.where(mon > 2, mon + 1, mon + 13)
+    j1 = numpy.trunc(365.25*julian_year)
+    j2 = numpy.trunc(30.6001*julian_month)
+    j3 = day+1720995
+    julian_day = j1+j2+j3
+    jadj = numpy.trunc(0.01*julian_year)
+    julian_day = numpy.where(day+31*(mon+12*year) >= ig,
+                             julian_day+2-jadj+numpy.trunc(0.25*jadj),
+                             julian_day)
+    return numpy.where(bad, numpy.nan, julian_day)
+
+
+def to_year_fraction_array(year, month, day, hours=0, minutes=0):
+    """
+    returns dates (years and decimals of a year) for arrays of calendar
+    dates and times. Unlike to_year_fraction the time is taken as UTC so
+    daylight saving changes of the local clock do not enter.
+    """
+    year, month, day, hours, minutes = numpy.broadcast_arrays(
+        *[numpy.asarray(v, dtype=float) for v in [year, month, day, hours,
+                                                   minutes]])
+    # datetime64 counts years from 1970
+    years = (year.astype(int) - 1970).astype('datetime64[Y]')
+    start = years.astype('datetime64[D]')
+    length = ((years + 1).astype('datetime64[D]') - start).astype(float)
+    days = (years.astype('datetime64[M]') + (month.astype(int) - 1)) \
+        .astype('datetime64[D]') + (day.astype(int) - 1)
+    elapsed = (days - start).astype(float) + hours/24. + minutes/1440.
+    return year + elapsed/length
+
+
 def to_year_fraction(date):
     """authored by ninjagecko on stackoverflow:
     http://stackoverflow.com/questions/6451655/python-how-to-convert-datetime-dates-to-decimal-years
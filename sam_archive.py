@@ -0,0 +1,105 @@
+import io
+import os
+import time
+import tarfile
+import zipfile
+
+# archive extensions and the tarfile mode writing them
+TAR_MODES = [('.tar.gz', 'w:gz'), ('.tgz', 'w:gz'), ('.tar.bz2', 'w:bz2'),
+             ('.tar.xz', 'w:xz'), ('.tar', 'w')]
+
+
+class SiteArchive(object):
+    """
+    DESCRIPTION
+        Collects the output of any number of sites in a single .zip or .tar
+        archive (.tar.gz, .tgz, .tar.bz2 and .tar.xz are compressed). The
+        files of every site are stored in a folder named after the site, the
+        layout RAPID expects, so the archive unpacks directly. Sites are
+        added one at a time from the texts rendered in memory and the
+        archive is written as they come, so memory use does not grow with
+        the batch and no file is written outside the archive.
+
+        The archive is written to file_name + '.partial' and only renamed
+        to file_name by close, so an existing archive is not replaced by the
+        output of a batch that failed: discard removes the partial archive
+        (as does leaving a with block with an exception).
+
+    SYNTAX
+        with SiteArchive('season.zip') as archive:
+            archive.add_site(site_id, files)
+
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.partial = file_name + '.partial'
+        name = file_name.lower()
+        directory = os.path.split(file_name)[0]
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+        if name.endswith('.zip'):
+            self.zip = zipfile.ZipFile(self.partial, 'w', zipfile.ZIP_DEFLATED)
+            self.tar = None
+            return
+        for ext, mode in TAR_MODES:
+            if name.endswith(ext):
+                self.tar = tarfile.open(self.partial, mode)
+                self.zip = None
+                return
+        raise ValueError('unknown archive type (use .zip, .tar, .tar.gz, '
+                         '.tgz, .tar.bz2 or .tar.xz): ' + file_name)
+
+    def add_site(self, site_id, files):
+        """
+        Adds files, a list of (file name, text, ...) as rendered by
+        mk_sam_file.calculate_site, to the folder site_id of the archive
+        and returns the number of files added.
+        """
+        now = time.time()
+        for name, text in (f[:2] for f in files):
+            arcname = site_id + '/' + name
+            data = text.encode('utf-8')
+            if self.zip is not None:
+                info = zipfile.ZipInfo(arcname, time.localtime(now)[:6])
+                info.compress_type = zipfile.ZIP_DEFLATED
+                info.external_attr = 0o644 << 16
+                self.zip.writestr(info, data)
+            else:
+                info = tarfile.TarInfo(arcname)
+                info.size, info.mtime, info.mode = len(data), now, 0o644
+                self.tar.addfile(info, io.BytesIO(data))
+        return len(files)
+
+    def close(self):
+        """
+        Finishes the archive and moves it to file_name.
+        """
+        if self.zip is not None:
+            self.zip.close()
+        else:
+            self.tar.close()
+        os.replace(self.partial, self.file_name)
+
+    def discard(self):
+        """
+        Closes and removes the partial archive, file_name is not touched.
+        """
+        try:
+            if self.zip is not None:
+                self.zip.close()
+            else:
+                self.tar.close()
+        finally:
+            if os.path.exists(self.partial):
+                os.remove(self.partial)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+        else:
+            self.discard()
+        return False
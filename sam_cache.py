@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+
+# part of the key of every sidecar: increase it whenever mk_sam_file.py
+# reads templates differently (columns, dtypes) so older sidecars are
+# parsed again
+PARSER_VERSION = 1
+SIDECAR_EXTENSION = '.site.npz'
+# the frames of a template, as read_frames returns them
+FRAMES = ['hdf', 'samples', 'sun']
+# joins the strings of a frame, the ASCII unit separator never appears in a
+# template
+SEPARATOR = '\x1f'
+
+
+def sidecar_file(file_name):
+    """
+    Returns the name of the sidecar of a template: site.csv is cached in
+    site.site.npz next to it.
+    """
+    return os.path.splitext(file_name)[0] + SIDECAR_EXTENSION
+
+
+def content_key(data):
+    """
+    Returns the key of the bytes of a template: their SHA-256 together with
+    the parser and pandas versions (pandas decides the inferred dtypes).
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    return '%s:%d:%s' % (digest, PARSER_VERSION, pd.__version__)
+
+
+def file_key(file_name):
+    with open(file_name, 'rb') as f:
+        return content_key(f.read())
+
+
+def encode_frame(name, frame):
+    """
+    DESCRIPTION
+        Stores a DataFrame in a few arrays without pickling: the numbers of
+        every dtype stacked in one array, the strings of all other columns
+        joined by SEPARATOR into one UTF-8 buffer (split again in one call)
+        with a mask of the missing values, and the labels and dtypes as
+        JSON. The index is stored as the first column.
+
+        @param: name - prefix of the array names ('<name>/...')
+        @param: frame - DataFrame of strings and numbers
+
+    OUTPUT
+        dictionary of the array names and arrays; raises ValueError for
+        values that would not read back the same (not strings, or holding
+        SEPARATOR)
+
+    """
+    parts = [frame.index] + [frame.iloc[:, j] for j in range(frame.shape[1])]
+    dtypes = [str(part.dtype) for part in parts]
+    arrays, numbers, strings, missing = {}, {}, [], []
+    for dtype, part in zip(dtypes, parts):
+        if part.dtype.kind in 'biuf':
+            numbers.setdefault(dtype, []).append(np.asarray(part))
+            continue
+        values = np.asarray(part, dtype=object).copy()
+        missing.append(np.asarray(pd.isnull(part)))
+        values[missing[-1]] = ''
+        if not all(isinstance(value, str) and SEPARATOR not in value
+                   for value in values):
+            raise ValueError('only strings and numbers can be cached')
+        strings += values.tolist()
+    for dtype, values in numbers.items():
+        arrays['%s/%s' % (name, dtype)] = np.stack(values)
+    arrays['%s/text' % name] = np.frombuffer(
+        SEPARATOR.join(strings).encode('utf-8'), dtype=np.uint8)
+    arrays['%s/missing' % name] = np.array(missing, dtype=bool).reshape(
+        len(missing), len(frame))
+    arrays['%s/meta' % name] = np.array(json.dumps({
+        'columns': list(frame.columns), 'index_name': frame.index.name,
+        'dtypes': dtypes}))
+    return arrays
+
+
+def decode_frame(name, npz):
+    """
+    Rebuilds the DataFrame named name of a sidecar (see encode_frame).
+    """
+    meta = json.loads(str(npz['%s/meta' % name]))
+    missing = npz['%s/missing' % name]
+    strings = np.empty(missing.shape, dtype=object)
+    if missing.size:
+        strings.flat[:] = npz['%s/text' % name].tobytes().decode(
+            'utf-8').split(SEPARATOR)
+    strings[missing] = np.nan
+    if all(dtype == 'object' for dtype in meta['dtypes']):
+        # strings only (the samples), built as a single block
+        index = pd.Index(strings[0], dtype=object, name=meta['index_name'])
+        return pd.DataFrame(strings[1:].T, index=index,
+                            columns=meta['columns'], dtype=object)
+    numbers = dict((dtype, iter(npz['%s/%s' % (name, dtype)]))
+                   for dtype in set(meta['dtypes'])
+                   if '%s/%s' % (name, dtype) in npz.files)
+    text = iter(strings)
+    parts = [next(numbers[dtype]) if dtype in numbers else next(text)
+             if dtype == 'object' else pd.array(next(text), dtype=dtype)
+             for dtype in meta['dtypes']]
+    index = pd.Index(parts[0], name=meta['index_name'])
+    return pd.DataFrame(dict(zip(meta['columns'], parts[1:])), index=index,
+                        columns=meta['columns'])
+
+
+def save_site(file_name, frames):
+    """
+    DESCRIPTION
+        Writes the sidecar of a template.
+
+        @param: file_name - path of the template, as it is now on disk
+        @param: frames - the hdf, samples and sun DataFrames read from it
+
+    OUTPUT
+        name of the sidecar, or None if the frames cannot be cached or the
+        directory is not writable
+
+    """
+    try:
+        arrays = {'key': np.array(file_key(file_name))}
+        for name, frame in zip(FRAMES, frames):
+            arrays.update(encode_frame(name, frame))
+        sidecar = sidecar_file(file_name)
+        # written under another name first so an interrupted run does not
+        # leave a broken sidecar
+        partial = sidecar + '.partial.npz'
+        np.savez(partial, **arrays)
+        os.replace(partial, sidecar)
+    except (IOError, OSError, ValueError):
+        return None
+    return sidecar
+
+
+def load_site(file_name):
+    """
+    DESCRIPTION
+        Reads the frames of a template from its sidecar.
+
+        @param: file_name - path of the template
+
+    OUTPUT
+        the hdf, samples and sun DataFrames, or None if there is no sidecar
+        or the template (or the parser) changed since it was written
+
+    """
+    sidecar = sidecar_file(file_name)
+    if not os.path.exists(sidecar):
+        return None
+    try:
+        with np.load(sidecar, allow_pickle=False) as npz:
+            if str(npz['key']) != file_key(file_name):
+                return None
+            return tuple(decode_frame(name, npz) for name in FRAMES)
+    except (IOError, OSError, ValueError, KeyError):
+        return None
+
+
+def main():
+    """
+    NAME
+        sam_cache.py
+
+    DESCRIPTION
+        Lists or removes the ingest cache of site templates. With -cache,
+        mk_sam_file.py stores every .csv template it parses in a .site.npz
+        sidecar next to it (site.csv -> site.site.npz), keyed by the SHA-256
+        of the template and the parser version. Later runs read unchanged
+        templates from the sidecar instead of decoding, fixing the line
+        breaks of and parsing the .csv again; a changed template is parsed
+        again and its sidecar rewritten.
+
+    SYNTAX
+        ~/$ python sam_cache.py site1.csv site2.csv ... [options]
+
+    OPTIONS
+        -clear : remove the sidecars of the templates
+
+    OUTPUT
+        whether the sidecar of every template is current, stale or missing
+
+    """
+    args = sys.argv[1:]
+    clear = '-clear' in args
+    if clear:
+        args.remove('-clear')
+    for file_name in args:
+        sidecar = sidecar_file(file_name)
+        if clear:
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+                print('removed ' + sidecar)
+            continue
+        if not os.path.exists(sidecar):
+            state = 'missing'
+        elif load_site(file_name) is None:
+            state = 'stale'
+        else:
+            state = 'current'
+        print('%s: %s' % (file_name, state))
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
@@ -0,0 +1,566 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import tempfile
+import numpy as np
+from datetime import datetime as dt
+from mk_sam_utilities import magsyn, magsyn_array, doigrf, doigrf_array, \
+    field_coefficients, get_field_model, sundec, sundec_array, \
+    sundec_ephemeris, gha, julian, julian_array, to_year_fraction, \
+    to_year_fraction_array
+import sam_jit
+from sam_merge import merge_sample_file
+
+# PSV models of doigrf and the first year they cover (all end at 1900, after
+# which IGRF is used)
+PSV_MODELS = {'arch3k': -1000, 'cals3k': -1000, 'pfm9k': -7000,
+              'hfm10k': -8000, 'cals10k.2': -8000, 'cals10k': -8000,
+              'shadif14k': -12000, 'shawq2k': -1000, 'shawqIA': -1000}
+LAST_YEAR = 2025
+
+
+class Check(object):
+    """
+    DESCRIPTION
+        A comparison of a fast implementation with the scalar reference
+        implementation it replaces. The reference always runs without the
+        compiled kernels of sam_jit.
+
+        @param: name - name of the check
+        @param: generate - function(rng) returning a random case (dictionary
+                of scalar inputs) or None if the draw is outside the domain
+        @param: reference - function(case) returning a tuple of floats
+        @param: fast - function(cases) evaluating a list of cases at once and
+                returning a tuple of arrays
+        @param: atol, rtol - allowed absolute and relative differences
+        @param: base - simplest value of every input, failing cases are
+                shrunk towards them
+        @param: angles - compare modulo 360 degrees
+
+    """
+
+    def __init__(self, name, generate, reference, fast, atol, rtol=0.,
+                 base=None, angles=False):
+        self.name = name
+        self.generate = generate
+        self.reference = reference
+        self.fast = fast
+        self.atol = atol
+        self.rtol = rtol
+        self.base = base or {}
+        self.angles = angles
+
+    def errors(self, cases):
+        """
+        Returns the reference and fast values of cases and which of them
+        differ by more than the tolerance. Cases outside the domain of the
+        reference (it returns None) are dropped, cases it raises on are
+        returned separately as (case, error) so they count as failures.
+        """
+        expected, kept, raised = [], [], []
+        for case in cases:
+            try:
+                with sam_jit.disabled():
+                    value = self.reference(case)
+            except Exception as ex:
+                raised.append((case, ex))
+                continue
+            if value is None:
+                continue
+            expected.append(np.asarray(value, dtype=float))
+            kept.append(case)
+        if not kept:
+            return kept, np.zeros((0, 0)), np.zeros((0, 0)), \
+                np.zeros(0, bool), raised
+        expected = np.array(expected)
+        got = np.array([np.asarray(v, dtype=float).ravel()
+                        for v in self.fast(kept)]).T
+        diff = got - expected
+        if self.angles:
+            diff = (diff + 180.) % 360. - 180.
+        both_nan = np.isnan(expected) & np.isnan(got)
+        bad = ~both_nan & ~(np.abs(diff) <=
+                            self.atol + self.rtol*np.abs(expected))
+        return kept, expected, got, bad.any(axis=1), raised
+
+    def fails(self, case):
+        try:
+            kept, expected, got, bad, raised = self.errors([case])
+        except Exception:
+            return True
+        return bool(kept) and bool(bad[0])
+
+    def shrink(self, case):
+        """
+        Simplifies a failing case one input at a time (towards the base
+        values, whole numbers and fewer decimals) as long as it still fails.
+        """
+        changed = True
+        while changed:
+            changed = False
+            for key in sorted(case):
+                for candidate in simpler(case[key], self.base.get(key, 0)):
+                    trial = dict(case)
+                    trial[key] = candidate
+                    if self.fails(trial):
+                        case, changed = trial, True
+                        break
+        return case
+
+    def run(self, n, rng):
+        """
+        Compares n random cases and returns (cases compared, largest
+        difference, number failed, list of shrunk failing cases, list of
+        (case, error) the reference raised on).
+        """
+        cases = []
+        while len(cases) < n:
+            case = self.generate(rng)
+            if case is not None:
+                cases.append(case)
+        try:
+            kept, expected, got, bad, raised = self.errors(cases)
+        except Exception:
+            # the batch itself failed, find the cases that fail alone
+            kept, raised = cases, []
+            bad = np.array([self.fails(case) for case in cases])
+            worst = np.nan
+        else:
+            diff = got - expected
+            if self.angles:
+                diff = (diff + 180.) % 360. - 180.
+            diff = np.abs(diff)
+            worst = np.nanmax(diff) if np.isfinite(diff).any() else 0.
+        failures = []
+        for i in np.flatnonzero(bad)[:3]:
+            failures.append(self.shrink(kept[i]))
+        return len(kept), worst, int(np.sum(bad)) + len(raised), failures, \
+            raised
+
+
+def complexity(value, base):
+    """
+    How complicated a value is: number of decimals, then distance from base.
+    """
+    for decimals in range(12):
+        if round(value, decimals) == value:
+            break
+    return decimals, abs(value - base)
+
+
+def simpler(value, base):
+    """
+    Candidate values that are simpler than value.
+    """
+    candidates = [base, float(round(value)), round(value, 1), round(value, 3),
+                  float(round((value + base)/2.))]
+    current = complexity(value, base)
+    out = []
+    for candidate in candidates:
+        if candidate != value and candidate not in out and \
+                complexity(candidate, base) < current:
+            out.append(candidate)
+    return out
+
+
+def column(cases, key):
+    return np.array([case[key] for case in cases], dtype=float)
+
+
+def random_location(rng, case):
+    """
+    Adds a latitude and longitude, with a share of them on the poles, the
+    equator and the dateline.
+    """
+    special = rng.random()
+    case['lat'] = float(rng.choice([-90., 90., 0.])) if special < 0.1 else \
+        round(float(rng.uniform(-90, 90)), 4)
+    case['lon'] = float(rng.choice([-180., 180., 0., 360.])) \
+        if 0.1 <= special < 0.2 else round(float(rng.uniform(-180, 360)), 4)
+    return case
+
+
+# julian
+def gen_julian(rng):
+    year = int(rng.integers(-12000, LAST_YEAR + 1))
+    if year == 0:
+        return None
+    return {'mon': float(rng.integers(1, 13)),
+            'day': float(rng.integers(1, 32)), 'year': float(year)}
+
+
+def ref_julian(case):
+    return (julian(int(case['mon']), int(case['day']), int(case['year'])),)
+
+
+def fast_julian(cases):
+    return (julian_array(column(cases, 'mon'), column(cases, 'day'),
+                         column(cases, 'year')),)
+
+
+# to_year_fraction (the reference uses the local clock of the computer, a
+# daylight saving hour is allowed for)
+def gen_year_fraction(rng):
+    return {'year': float(rng.integers(1900, 2101)),
+            'month': float(rng.integers(1, 13)),
+            'day': float(rng.integers(1, 29)),
+            'hours': float(rng.integers(0, 24)),
+            'minutes': float(rng.integers(0, 60))}
+
+
+def ref_year_fraction(case):
+    return (to_year_fraction(dt(*[int(case[k]) for k in
+                                  ['year', 'month', 'day', 'hours',
+                                   'minutes']])),)
+
+
+def fast_year_fraction(cases):
+    return (to_year_fraction_array(*[column(cases, k) for k in
+                                     ['year', 'month', 'day', 'hours',
+                                      'minutes']]),)
+
+
+# gha
+def gen_gha(rng):
+    case = gen_julian(rng)
+    if case is None:
+        return None
+    return {'julian_day': float(ref_julian(case)[0]),
+            'f': round(float(rng.random()), 6)}
+
+
+def ref_gha(case):
+    return gha(case['julian_day'], case['f'])
+
+
+def fast_gha(cases):
+    return gha(column(cases, 'julian_day'), column(cases, 'f'))
+
+
+# sundec, with readings around midnight so that the day rolls over
+def gen_sundec(rng):
+    case = {'year': float(rng.integers(1900, LAST_YEAR + 1)),
+            'mon': float(rng.integers(1, 13)),
+            'day': float(rng.integers(1, 29)),
+            'hours': float(rng.choice([0, 1, 22, 23]) if rng.random() < 0.3
+                           else rng.integers(0, 24)),
+            'minutes': float(rng.integers(0, 60)),
+            'delta_u': float(rng.integers(-12, 15)),
+            'shadow_angle': round(float(rng.uniform(0, 360)), 1)}
+    return random_location(rng, case)
+
+
+def ref_sundec(case):
+    date = '%d:%02d:%02d:%02d:%02d' % tuple(
+        int(case[k]) for k in ['year', 'mon', 'day', 'hours', 'minutes'])
+    return (sundec({'date': date, 'delta_u': case['delta_u'],
+                    'lat': case['lat'], 'lon': case['lon'],
+                    'shadow_angle': case['shadow_angle']}),)
+
+
+SUN_KEYS = ['year', 'mon', 'day', 'hours', 'minutes', 'delta_u', 'lat', 'lon',
+            'shadow_angle']
+
+
+def fast_sundec(cases):
+    return (sundec_array(*[column(cases, k) for k in SUN_KEYS]),)
+
+
+def gen_sundec_ephemeris(rng):
+    """
+    sundec readings in daylight, with the sun not close to the zenith where
+    its azimuth is ill-conditioned, and away from the latitude where sundec
+    switches branches (sun declination = latitude)
+    """
+    case = gen_sundec(rng)
+    rad = np.pi/180.
+    hrs = case['hours'] - int(case['delta_u'])
+    day = case['day'] + (hrs > 24) - (hrs < 0)
+    hrs = hrs - 24 if hrs > 24 else (hrs + 24 if hrs < 0 else hrs)
+    H, delta = gha(julian(int(case['mon']), int(day), int(case['year'])),
+                   (hrs + case['minutes']/60.)/24.)
+    altitude = np.arcsin(np.sin(case['lat']*rad)*np.sin(delta*rad) +
+                         np.cos(case['lat']*rad)*np.cos(delta*rad) *
+                         np.cos((H + case['lon'])*rad))/rad
+    if altitude < 5 or altitude > 80 or abs(delta - case['lat']) < 0.1:
+        return None
+    return case
+
+
+def fast_sundec_ephemeris(cases):
+    return (sundec_ephemeris(*[column(cases, k) for k in SUN_KEYS]),)
+
+
+# magsyn with the IGRF coefficients of the date
+def gen_magsyn(rng):
+    case = {'date': round(float(rng.uniform(1900, LAST_YEAR)), 4),
+            'itype': float(rng.choice([1, 2])),
+            'alt': round(float(rng.uniform(-0.5, 10)), 3)}
+    case = random_location(rng, case)
+    if case['itype'] == 2:
+        # radial distance from the center of the earth
+        case['alt'] += 6371.2
+    return case
+
+
+def magsyn_inputs(case):
+    gh, sv, model = field_coefficients(case['date'], None,
+                                       *get_field_model())
+    return (np.asarray(gh, float)[0:120], np.asarray(sv, float)[0:120],
+            model, case['date'], int(case['itype']), case['alt'],
+            90. - case['lat'], case['lon'] % 360.)
+
+
+def ref_magsyn(case):
+    return magsyn(*magsyn_inputs(case))
+
+
+def fast_magsyn(cases):
+    out = np.full((4, len(cases)), np.nan)
+    itypes = column(cases, 'itype')
+    for itype in np.unique(itypes):
+        idx = np.flatnonzero(itypes == itype)
+        gh, sv, b, date, it, alt, colat, elong = \
+            zip(*[magsyn_inputs(cases[i]) for i in idx])
+        out[:, idx] = magsyn_array(np.array(gh), np.array(sv), np.array(b),
+                                   np.array(date), int(itype), np.array(alt),
+                                   np.array(colat), np.array(elong))
+    return tuple(out)
+
+
+# doigrf over the range of every model (shadif14k is used for every date, it
+# does not switch to IGRF after 1900)
+MODELS = [None] + sorted(PSV_MODELS)
+
+
+def gen_doigrf(rng):
+    mod = MODELS[int(rng.integers(0, len(MODELS)))]
+    first = 1900 if mod is None else PSV_MODELS[mod]
+    last = 1900 if mod == 'shadif14k' else LAST_YEAR
+    case = {'model': float(MODELS.index(mod)),
+            'date': round(float(rng.uniform(first, last)), 4),
+            'alt': round(float(rng.uniform(-0.5, 10)), 3)}
+    return random_location(rng, case)
+
+
+def ref_doigrf(case):
+    mod = MODELS[int(case['model'])]
+    kwargs = {} if mod is None else {'mod': mod}
+    return doigrf(case['lon'], case['lat'], case['alt'], case['date'],
+                  **kwargs)
+
+
+def fast_doigrf(cases):
+    out = np.full((4, len(cases)), np.nan)
+    models = column(cases, 'model')
+    for model in np.unique(models):
+        idx = np.flatnonzero(models == model)
+        group = [cases[i] for i in idx]
+        out[:, idx] = doigrf_array(column(group, 'lon'), column(group, 'lat'),
+                                   column(group, 'alt'),
+                                   column(group, 'date'),
+                                   mod=MODELS[int(model)])
+    return tuple(out)
+
+
+def numpy_only(fast):
+    """
+    Runs fast without the compiled kernels, to check the numpy code when
+    numba is installed.
+    """
+    def run(cases):
+        with sam_jit.disabled():
+            return fast(cases)
+    return run
+
+
+DATE_BASE = {'year': 2000, 'mon': 1, 'month': 1, 'day': 1, 'hours': 12,
+             'date': 2000}
+CHECKS = [
+    Check('julian', gen_julian, ref_julian, fast_julian, 0., base=DATE_BASE),
+    Check('to_year_fraction', gen_year_fraction, ref_year_fraction,
+          fast_year_fraction, 1.2e-4, base=DATE_BASE),
+    Check('gha', gen_gha, ref_gha, fast_gha, 1e-9, angles=True,
+          base={'julian_day': 2451545}),
+    Check('sundec', gen_sundec, ref_sundec, fast_sundec, 1e-9, angles=True,
+          base=DATE_BASE),
+    Check('sundec_ephemeris', gen_sundec_ephemeris, ref_sundec,
+          fast_sundec_ephemeris, 0.01, angles=True, base=DATE_BASE),
+    Check('magsyn', gen_magsyn, ref_magsyn, fast_magsyn, 1e-3, 1e-6,
+          base=DATE_BASE),
+    Check('doigrf', gen_doigrf, ref_doigrf, fast_doigrf, 1e-3, 1e-6,
+          base=DATE_BASE),
+]
+if sam_jit.numba is not None:
+    CHECKS += [
+        Check('sundec_numpy', gen_sundec, ref_sundec, numpy_only(fast_sundec),
+              1e-9, angles=True, base=DATE_BASE),
+        Check('magsyn_numpy', gen_magsyn, ref_magsyn, numpy_only(fast_magsyn),
+              1e-3, 1e-6, base=DATE_BASE),
+    ]
+
+
+# regression cases of sam_merge.merge_sample_file: name, sample file before,
+# new header lines, runs of the template and sample file after the merge
+MERGE_HEAD = 'GB20-1a   a comment\r\n     0 123.4 45.0  90.0  0.0  1.0\r\n'
+MERGE_CASES = [
+    ('header only', MERGE_HEAD, MERGE_HEAD, ['RUN A', 'RUN B'],
+     MERGE_HEAD + 'RUN A\r\nRUN B\r\n'),
+    ('runs followed by RAPID lines',
+     MERGE_HEAD + 'RUN A\r\nRUN B\r\nRAPID D 1234567890\r\n', MERGE_HEAD,
+     ['RUN A', 'RUN B'],
+     MERGE_HEAD + 'RUN A\r\nRUN B\r\nRAPID D 1234567890\r\n'),
+    ('one run missing',
+     MERGE_HEAD + 'RUN A\r\nRAPID D 1234567890\r\n', MERGE_HEAD,
+     ['RUN A', 'RUN B'],
+     MERGE_HEAD + 'RUN A\r\nRAPID D 1234567890\r\nRUN B\r\n'),
+    ('long last line', MERGE_HEAD + 'RAPID ' + 'D'*600 + '\r\n', MERGE_HEAD,
+     ['RUN A'], MERGE_HEAD + 'RAPID ' + 'D'*600 + '\r\nRUN A\r\n'),
+    ('runs before a long last line',
+     MERGE_HEAD + 'RUN A\r\n' + 'D'*600 + '\r\n', MERGE_HEAD, ['RUN A'],
+     MERGE_HEAD + 'RUN A\r\n' + 'D'*600 + '\r\n'),
+    ('no final line break', MERGE_HEAD + 'RAPID D 1234567890', MERGE_HEAD,
+     ['RUN A'], MERGE_HEAD + 'RAPID D 1234567890\r\nRUN A\r\n'),
+    ('header of another length',
+     MERGE_HEAD + 'RUN A\r\nRAPID D 1234567890', MERGE_HEAD.replace(
+         'a comment', 'a longer comment'), ['RUN A', 'RUN B'],
+     MERGE_HEAD.replace('a comment', 'a longer comment') +
+     'RUN A\r\nRAPID D 1234567890\r\nRUN B\r\n'),
+]
+
+
+def run_merge_checks():
+    """
+    Merges the runs of every case of MERGE_CASES into a scratch sample file
+    and returns the names of the cases whose file differs from the expected
+    one.
+    """
+    failed = []
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'GB20-1a')
+        for name, before, head, runs, after in MERGE_CASES:
+            with open(path, 'wb') as f:
+                f.write(before.encode('ascii'))
+            merge_sample_file(path, head, runs)
+            # merging again must not change the file
+            merge_sample_file(path, head, runs)
+            with open(path, 'rb') as f:
+                if f.read() != after.encode('ascii'):
+                    failed.append(name)
+    return failed
+
+
+def run_checks(n=200, seed=None, names=None):
+    """
+    DESCRIPTION
+        Runs the checks and logs the result of each.
+
+        @param: n - random cases per check
+        @param: seed - seed of the random number generator
+        @param: names - names of the checks to run (default all)
+
+    OUTPUT
+        list of (name, cases compared, largest difference, number failed,
+        shrunk failing cases, (case, error) the reference raised on)
+
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+    for check in CHECKS:
+        if names is not None and check.name not in names:
+            continue
+        compared, worst, n_failed, failures, raised = check.run(n, rng)
+        results.append((check.name, compared, worst, n_failed, failures,
+                        raised))
+    return results
+
+
+def main():
+    """
+    NAME
+        sam_check.py
+
+    DESCRIPTION
+        Compares the fast (vectorized or cached) implementations of the
+        field and sun compass calculations with the scalar reference
+        implementations on random inputs: dates from -12000 to 2025 with
+        every PSV model, both hemispheres, the poles, the dateline and
+        readings around midnight. Failing cases are shrunk to a minimal
+        reproduction. Cases the reference raises on count as failures, and
+        so does a check that compares no cases (e.g. without the
+        coefficients package). Exits with status 1 if any check fails, so
+        it can run with the other checks before a change is merged. Runs
+        offline.
+
+        Tolerances: julian exact, to_year_fraction 1.2e-4 years (the
+        reference uses the local clock), gha and sundec 1e-9 degrees,
+        sundec_ephemeris 0.01 degrees (sun 5 to 80 degrees above the
+        horizon, away from sundec's branch switch), magsyn and doigrf 1e-3 nT + 1e-6 relative.
+
+        The merge check runs fixed cases of merging template runs into
+        sample files that RAPID appended measurements to (see
+        sam_merge.py): every case must give the expected file, also when
+        merged twice.
+
+        With numba installed the fast implementations use the compiled
+        kernels of sam_jit and sundec_numpy and magsyn_numpy check the
+        numpy code as well.
+
+    SYNTAX
+        ~/$ python sam_check.py [options]
+
+    OPTIONS
+        -n N : random cases per check (default 200)
+        -seed SEED : seed of the random inputs (default random)
+        -only NAME[,NAME] : only run these checks
+
+    """
+    args = sys.argv[1:]
+    n, seed, names = 200, None, None
+    if '-n' in args:
+        ind = args.index('-n')
+        n = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-seed' in args:
+        ind = args.index('-seed')
+        seed = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-only' in args:
+        ind = args.index('-only')
+        names = args[ind+1].split(',')
+        del args[ind:ind+2]
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % 2**32)
+    print('seed %d' % seed)
+
+    failed = False
+    for name, compared, worst, n_failed, failures, raised in \
+            run_checks(n, seed, names):
+        print('%-18s %5d cases, largest difference %.3g%s%s' %
+              (name, compared, worst,
+               ', %d FAILED' % n_failed if n_failed else '',
+               ', nothing compared' if compared == 0 and n > 0 else ''))
+        for case in failures:
+            print('    minimal failing case: %r' % case)
+        for case, ex in raised[:3]:
+            print('    reference error: %s: %s on %r' %
+                  (type(ex).__name__, ex, case))
+        failed = failed or n_failed > 0 or (compared == 0 and n > 0)
+    if names is None or 'merge' in names:
+        merge_failed = run_merge_checks()
+        print('%-18s %5d cases%s' % ('merge', len(MERGE_CASES),
+                                     ', %d FAILED' % len(merge_failed)
+                                     if merge_failed else ''))
+        for name in merge_failed:
+            print('    failing case: %s' % name)
+        failed = failed or len(merge_failed) > 0
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
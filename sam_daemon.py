@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import socket
+import logging
+import threading
+import socketserver
+from mk_sam_utilities import get_field_model, igrf
+from mk_sam_file import read_site, calculate_site, write_site_files
+from sam_format import SampleFormatter
+from sam_validate import check_site, SiteValidationError
+import sam_log
+
+# default number of sites processed at the same time
+WORKERS = os.cpu_count() or 1
+# default number of connections open at the same time, the others wait
+CONNECTIONS = 64
+# default largest request in bytes
+MAX_SIZE = 16*2**20
+# default seconds a client has to send its request
+TIMEOUT = 60.
+
+
+class RequestEvents(logging.Handler):
+    """
+    Collects the log events of the thread handling a request so that they
+    can be returned with the response.
+    """
+
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.local = threading.local()
+
+    def start(self):
+        self.local.events = []
+
+    def stop(self):
+        events, self.local.events = self.local.events, None
+        return events
+
+    def emit(self, record):
+        events = getattr(self.local, 'events', None)
+        if events is not None and record.levelno >= logging.WARNING:
+            events.append(record.getMessage())
+
+
+def parse_payload(payload):
+    """
+    DESCRIPTION
+        Reads a request. A payload starting with '{' is a JSON object:
+
+            {"template": "<text of the .csv template>",
+             "name": "site.csv",
+             "output_directory": "/path",
+             "merge": false}
+
+        where only template is required. Any other payload is the text of a
+        .csv template.
+
+    OUTPUT
+        dictionary with name, template, output_directory and merge
+
+    """
+    text = payload.decode('utf-8-sig', errors='replace') if \
+        isinstance(payload, bytes) else payload
+    if text.lstrip().startswith('{'):
+        request = json.loads(text)
+    else:
+        request = {'template': text}
+    if 'template' not in request:
+        raise ValueError('the request has no template')
+    template = request['template'].replace('\r\n', '\n').replace('\r', '\n')
+    return {'name': request.get('name', 'request.csv'),
+            'template': template,
+            'output_directory': request.get('output_directory'),
+            'merge': bool(request.get('merge', False))}
+
+
+def output_path(root, output_directory):
+    """
+    Returns the output_directory of a request resolved against root, raises
+    ValueError if there is no root or the directory is not inside it.
+    """
+    if root is None:
+        raise ValueError('output_directory is only allowed if the server was '
+                         'started with -root')
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, output_directory))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError("output_directory '%s' is not inside %s" %
+                         (output_directory, root))
+    return path
+
+
+def handle_request(request, formatter=None, root=None):
+    """
+    DESCRIPTION
+        Processes one site as mk_sam_file.py does. Without an
+        output_directory the rendered files are returned.
+
+        @param: request - dictionary from parse_payload
+        @param: formatter - SampleFormatter for the sample files
+        @param: root - directory the output_directory of a request is
+                relative to and has to be inside of, None to refuse
+                requests with an output_directory
+
+    OUTPUT
+        response dictionary: status ('ok', 'invalid' or 'error'),
+        site_id, files (name -> content, unless written), output_directory
+        (if written), problems (if invalid) or message (if error)
+
+    """
+    if formatter is None:
+        formatter = SampleFormatter()
+    name, template = request['name'], request['template']
+    od = request['output_directory']
+    if od is not None:
+        od = output_path(root, od)
+    hdf, df, sdf = read_site(name, template)
+    try:
+        check_site(name, hdf, df, sdf, formatter)
+    except SiteValidationError as err:
+        return {'status': 'invalid', 'problems': str(err)}
+    site_id = hdf['site_info']['site_id']
+    files, warnings = calculate_site(name, hdf, df, sdf, formatter, template)
+    if od is not None:
+        write_site_files(od, site_id, files, warnings, request['merge'])
+        return {'status': 'ok', 'site_id': site_id, 'output_directory': od}
+    warnings.flush()
+    return {'status': 'ok', 'site_id': site_id,
+            'files': {file_name: text for file_name, text, sample in files}}
+
+
+class SamRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads a request until the client shuts down its side of the connection
+    and answers with a single line of JSON. A request larger than the
+    max_size of the server or not sent within its read_timeout is answered
+    with an error.
+    """
+
+    def setup(self):
+        self.timeout = self.server.read_timeout
+        socketserver.StreamRequestHandler.setup(self)
+
+    def handle(self):
+        response = None
+        try:
+            payload = self.rfile.read(self.server.max_size + 1)
+        except socket.timeout:
+            response = {'status': 'error', 'message': 'the request was not '
+                        'sent within %g s' % self.server.read_timeout}
+        else:
+            if len(payload) > self.server.max_size:
+                response = {'status': 'error', 'message': 'the request '
+                            'exceeds %d bytes' % self.server.max_size}
+        if response is None:
+            response = self.process(payload)
+        self.wfile.write(json.dumps(response, default=str).encode('utf-8') +
+                         b'\n')
+
+    def process(self, payload):
+        events = self.server.events
+        with self.server.slots:
+            events.start()
+            try:
+                response = handle_request(parse_payload(payload),
+                                          self.server.formatter,
+                                          self.server.root)
+            except Exception as err:
+                response = {'status': 'error', 'message': '%s: %s' %
+                            (type(err).__name__, err)}
+            response['warnings'] = events.stop()
+        return response
+
+
+class SamServer(socketserver.ThreadingMixIn):
+    """
+    Handles every connection in its own thread, at most connections of them
+    open and at most workers of them processing a site at the same time.
+    Further connections wait in the listen queue until one is closed.
+    """
+    daemon_threads = True
+
+    def setup_workers(self, workers, connections=CONNECTIONS,
+                      max_size=MAX_SIZE, read_timeout=TIMEOUT, root=None):
+        self.slots = threading.BoundedSemaphore(workers)
+        self.connections = threading.BoundedSemaphore(connections)
+        self.max_size = max_size
+        self.read_timeout = read_timeout
+        self.root = root
+        self.formatter = SampleFormatter()
+        self.events = RequestEvents()
+        sam_log.logger.addHandler(self.events)
+
+    def process_request(self, request, client_address):
+        # taken before the thread of the connection is started
+        self.connections.acquire()
+        try:
+            socketserver.ThreadingMixIn.process_request(self, request,
+                                                        client_address)
+        except BaseException:
+            self.connections.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            socketserver.ThreadingMixIn.process_request_thread(
+                self, request, client_address)
+        finally:
+            self.connections.release()
+
+
+class SamTCPServer(SamServer, socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class SamUnixServer(SamServer, socketserver.UnixStreamServer):
+        pass
+
+
+def make_server(address, workers=WORKERS, connections=CONNECTIONS,
+                max_size=MAX_SIZE, read_timeout=TIMEOUT, root=None):
+    """
+    DESCRIPTION
+        Creates the server, a path is a Unix domain socket and a port number
+        is a TCP socket on localhost.
+
+        @param: address - socket path or port number
+        @param: workers - number of sites processed at the same time
+        @param: connections - number of connections open at the same time
+        @param: max_size - largest request in bytes
+        @param: read_timeout - seconds a client has to send its request
+        @param: root - directory requests may write to (see handle_request)
+
+    """
+    if isinstance(address, int):
+        server = SamTCPServer(('127.0.0.1', address), SamRequestHandler)
+    else:
+        if os.path.exists(address):
+            os.remove(address)
+        server = SamUnixServer(address, SamRequestHandler)
+    server.setup_workers(workers, connections, max_size, read_timeout, root)
+    return server
+
+
+def warm_up():
+    """
+    Loads the field model coefficients and runs the field synthesis once so
+    that the first request does not pay for it.
+    """
+    get_field_model()
+    igrf([2020., 0., 45., 0.])
+
+
+def request(address, payload, timeout=None):
+    """
+    DESCRIPTION
+        Sends a request to a running server.
+
+        @param: address - socket path or port number
+        @param: payload - text or bytes of a .csv template or a JSON request
+                (see parse_payload), or a dictionary that is sent as JSON
+        @param: timeout - seconds to wait for the response
+
+    OUTPUT
+        the response dictionary (see handle_request)
+
+    """
+    if isinstance(payload, dict):
+        payload = json.dumps(payload)
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    if isinstance(address, int):
+        sock = socket.create_connection(('127.0.0.1', address), timeout)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+    with sock:
+        sock.sendall(payload)
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def main():
+    """
+    NAME
+        sam_daemon.py
+
+    DESCRIPTION
+        Keeps the program, the field model and its caches loaded and
+        processes site templates sent over a socket, so that a site takes
+        milliseconds instead of the seconds needed to start mk_sam_file.py.
+
+        Every connection carries one request: the text of a .csv template or
+        a JSON object (see parse_payload), ended by closing the sending side
+        of the connection. The answer is one line of JSON holding the
+        contents of the .sam, sample, .csv and .inp files, or writing them to
+        output_directory when the request gives one. Requests may only
+        write inside the directory given with -root, an output_directory is
+        relative to it.
+
+    SYNTAX
+        ~/$ python sam_daemon.py -socket /tmp/sam.sock [options]
+        ~/$ python sam_daemon.py -port 8765 [options]
+
+        a request from the shell:
+        ~/$ nc -N -U /tmp/sam.sock < site.csv
+
+    OPTIONS
+        -socket PATH : listen on a Unix domain socket
+        -port PORT : listen on localhost TCP port PORT
+        -workers N : number of sites processed at the same time (default is
+                     the number of CPUs)
+        -root DIR : let requests write to output directories inside DIR
+                    (default is to refuse requests with an output_directory)
+        -max-conn N : number of connections open at the same time, others
+                      wait until one is closed (default is 64)
+        -max-size BYTES : largest request (default is 16 MB)
+        -timeout SECONDS : time a client has to send its request (default
+                           is 60)
+        -v : print the values of every sample
+        -q : only print warnings
+        -log FILE : append every event as JSON lines to FILE
+
+    """
+    args = sys.argv[1:]
+    address, workers, event_file = None, WORKERS, None
+    connections, max_size, read_timeout, root = CONNECTIONS, MAX_SIZE, \
+        TIMEOUT, None
+    verbosity = sam_log.NORMAL
+    if '-socket' in args:
+        ind = args.index('-socket')
+        address = args[ind+1]
+        del args[ind:ind+2]
+    if '-port' in args:
+        ind = args.index('-port')
+        address = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-workers' in args:
+        ind = args.index('-workers')
+        workers = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-root' in args:
+        ind = args.index('-root')
+        root = os.path.realpath(args[ind+1])
+        del args[ind:ind+2]
+    if '-max-conn' in args:
+        ind = args.index('-max-conn')
+        connections = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-max-size' in args:
+        ind = args.index('-max-size')
+        max_size = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-timeout' in args:
+        ind = args.index('-timeout')
+        read_timeout = float(args[ind+1])
+        del args[ind:ind+2]
+    if '-log' in args:
+        ind = args.index('-log')
+        event_file = args[ind+1]
+        del args[ind:ind+2]
+    if '-v' in args:
+        args.remove('-v')
+        verbosity = sam_log.VERBOSE
+    if '-q' in args:
+        args.remove('-q')
+        verbosity = sam_log.QUIET
+    if address is None:
+        help(main)
+        sys.exit(1)
+    sam_log.setup_logging(verbosity, event_file)
+
+    warm_up()
+    server = make_server(address, workers, connections, max_size,
+                         read_timeout, root)
+    sam_log.info('daemon', 'Listening on %s with %d worker(s)' %
+                 (address, workers), address=address, workers=workers)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if not isinstance(address, int) and os.path.exists(address):
+            os.remove(address)
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
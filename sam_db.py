@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import sqlite3
+from datetime import datetime as dt
+import numpy as np
+import pandas as pd
+from mk_sam_utilities import FIELD_MODEL
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sites (
+    site_key INTEGER PRIMARY KEY,
+    site_id TEXT NOT NULL,
+    site_name TEXT,
+    site_lat REAL,
+    site_long REAL,
+    site_elevation REAL,
+    source_file TEXT NOT NULL,
+    processed_at TEXT,
+    field_model TEXT,
+    UNIQUE (site_id, source_file)
+);
+CREATE TABLE IF NOT EXISTS samples (
+    site_key INTEGER NOT NULL REFERENCES sites (site_key) ON DELETE CASCADE,
+    site_id TEXT NOT NULL,
+    sample_name TEXT NOT NULL,
+    sample_date TEXT,
+    magnetic_core_strike REAL,
+    bedding_strike REAL,
+    correct_bedding INTEGER,
+    shadow_angle REAL,
+    GMT_offset REAL,
+    sun_core_strike REAL,
+    IGRF_local_dec REAL,
+    calculated_mag_dec REAL,
+    core_strike REAL,
+    corrected_bedding_strike REAL,
+    core_strike_std REAL,
+    corrected_bedding_strike_std REAL,
+    sun_compass INTEGER,
+    dec_mismatch INTEGER,
+    dec_outlier INTEGER,
+    warnings TEXT,
+    PRIMARY KEY (site_key, sample_name)
+);
+CREATE INDEX IF NOT EXISTS sites_site_id ON sites (site_id);
+CREATE INDEX IF NOT EXISTS samples_site_id ON samples (site_id);
+CREATE INDEX IF NOT EXISTS samples_date ON samples (sample_date);
+CREATE INDEX IF NOT EXISTS samples_dec_mismatch ON samples (dec_mismatch);
+CREATE INDEX IF NOT EXISTS samples_dec_outlier ON samples (dec_outlier);
+"""
+
+SAMPLE_COLUMNS = ['site_key', 'site_id', 'sample_name', 'sample_date',
+                  'magnetic_core_strike', 'bedding_strike', 'correct_bedding',
+                  'shadow_angle', 'GMT_offset', 'sun_core_strike',
+                  'IGRF_local_dec', 'calculated_mag_dec', 'core_strike',
+                  'corrected_bedding_strike', 'core_strike_std',
+                  'corrected_bedding_strike_std', 'sun_compass',
+                  'dec_mismatch', 'dec_outlier', 'warnings']
+# summary flags that have a column of their own
+FLAG_COLUMNS = ['dec_mismatch', 'dec_outlier']
+# summary flags that are listed in the warnings column
+WARNING_FLAGS = FLAG_COLUMNS + ['default_mass', 'sun_spread']
+
+
+def connect(db_file):
+    """
+    Opens (and if needed creates) a results database.
+    """
+    con = sqlite3.connect(db_file)
+    con.execute('PRAGMA foreign_keys = ON')
+    con.executescript(SCHEMA)
+    return con
+
+
+def sample_dates(summary):
+    """
+    Returns the local date and time of every sample as 'YYYY-MM-DD HH:MM'
+    (None where the date is incomplete).
+    """
+    parts = summary[['year', 'month', 'days', 'hours', 'minutes']]
+    dates = []
+    for year, month, day, hour, minute in parts.itertuples(index=False):
+        if np.isnan([year, month, day, hour, minute]).any():
+            dates.append(None)
+        else:
+            dates.append('%04d-%02d-%02d %02d:%02d' %
+                         (year, month, day, hour, minute))
+    return dates
+
+
+def store_sites(con, sites):
+    """
+    DESCRIPTION
+        Stores processed sites in a single transaction. A site that was
+        stored before from the same template is replaced.
+
+        @param: con - connection from connect
+        @param: sites - list of (file_name, hdf, summary) with the site
+                DataFrame and the summary table (sam_summary.site_summary,
+                optionally with the sam_qc and sam_uncertainty columns) of
+                every site
+
+    """
+    processed_at = dt.now().isoformat(timespec='seconds')
+    with con:
+        for file_name, hdf, summary in sites:
+            site = hdf['site_info']
+            source_file = os.path.abspath(file_name)
+            # site_name is optional
+            name = site['site_name'] if isinstance(site['site_name'], str) \
+                else None
+            con.execute('DELETE FROM sites WHERE site_id = ? AND source_file = ?',
+                        (site['site_id'], source_file))
+            cur = con.execute(
+                'INSERT INTO sites (site_id, site_name, site_lat, site_long, '
+                'site_elevation, source_file, processed_at, field_model) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (site['site_id'], name, float(site['site_lat']),
+                 float(site['site_long']), float(site['site_elevation']),
+                 source_file, processed_at, FIELD_MODEL))
+            rows = summary.reset_index(drop=True).copy()
+            rows['site_key'] = cur.lastrowid
+            rows['sample_date'] = sample_dates(rows)
+            for column in SAMPLE_COLUMNS:
+                if column not in rows:
+                    rows[column] = None
+            flags = [column for column in WARNING_FLAGS if column in summary]
+            rows['warnings'] = [','.join(flag for flag in flags if row[flag])
+                                for row in rows[flags].to_dict('records')]
+            for column in ['correct_bedding', 'sun_compass'] + FLAG_COLUMNS:
+                rows[column] = rows[column].astype(float)
+            values = rows[SAMPLE_COLUMNS].astype(object)
+            values = values.where(values.notnull(), None)
+            con.executemany('INSERT INTO samples VALUES (%s)' %
+                            ', '.join('?' * len(SAMPLE_COLUMNS)),
+                            values.itertuples(index=False, name=None))
+
+
+def query_samples(con, site_id=None, date_from=None, date_to=None,
+                  mismatch=False, outlier=False, where=None):
+    """
+    DESCRIPTION
+        Selects samples joined with their site.
+
+        @param: con - connection from connect
+        @param: site_id - only this site
+        @param: date_from, date_to - sample dates ('YYYY-MM-DD', inclusive)
+        @param: mismatch - only samples flagged with dec_mismatch
+        @param: outlier - only samples flagged with dec_outlier
+        @param: where - additional SQL condition
+
+    OUTPUT
+        DataFrame of the matching samples
+
+    """
+    conditions, params = [], []
+    if site_id is not None:
+        conditions.append('samples.site_id = ?')
+        params.append(site_id)
+    if date_from is not None:
+        conditions.append('sample_date >= ?')
+        params.append(date_from)
+    if date_to is not None:
+        # dates carry the time, compare up to the end of the day
+        conditions.append('sample_date <= ?')
+        params.append(date_to + ' 99')
+    if mismatch:
+        conditions.append('dec_mismatch = 1')
+    if outlier:
+        conditions.append('dec_outlier = 1')
+    if where is not None:
+        conditions.append('(%s)' % where)
+    sql = ('SELECT samples.*, sites.site_name, sites.site_lat, sites.site_long, '
+           'sites.source_file, sites.processed_at, sites.field_model '
+           'FROM samples JOIN sites USING (site_key)')
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY samples.site_id, sample_date, sample_name'
+    return pd.read_sql_query(sql, con, params=params)
+
+
+def main():
+    """
+    NAME
+        sam_db.py
+
+    DESCRIPTION
+        Queries a results database written by mk_sam_file.py -db and prints
+        the matching samples as csv. The warnings column lists the flags of
+        every sample: dec_mismatch, dec_outlier, default_mass (no mass was
+        entered) and sun_spread (sun compass readings more than 5 degrees
+        apart).
+
+    SYNTAX
+        ~/$ python sam_db.py results.db [options]
+
+    OPTIONS
+        -site SITE_ID : only samples of this site
+        -from YYYY-MM-DD : only samples taken on or after this date
+        -to YYYY-MM-DD : only samples taken on or before this date
+        -mismatch : only samples whose calculated declination is more than 5
+                    degrees from IGRF
+        -outlier : only samples flagged as declination outliers
+        -where CONDITION : any further SQL condition on the samples table
+        -sql QUERY : run QUERY instead
+        -o FILE : write the csv to FILE
+
+    EXAMPLE
+        all samples from 2019 with a sun/mag mismatch over 5 degrees:
+        ~/$ python sam_db.py results.db -from 2019-01-01 -to 2019-12-31 -mismatch
+
+        all samples written with the default mass:
+        ~/$ python sam_db.py results.db -where "warnings LIKE '%default_mass%'"
+
+    """
+    args = sys.argv[1:]
+    options = {}
+    for flag in ['-site', '-from', '-to', '-where', '-sql', '-o']:
+        if flag in args:
+            ind = args.index(flag)
+            options[flag] = args[ind+1]
+            del args[ind:ind+2]
+    for flag in ['-mismatch', '-outlier']:
+        options[flag] = flag in args
+        if options[flag]:
+            args.remove(flag)
+    con = connect(args[0])
+    if '-sql' in options:
+        result = pd.read_sql_query(options['-sql'], con)
+    else:
+        result = query_samples(con, options.get('-site'), options.get('-from'),
+                               options.get('-to'), options['-mismatch'],
+                               options['-outlier'], options.get('-where'))
+    con.close()
+    result.to_csv(options.get('-o', sys.stdout), index=False)
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+
+import io
+import os
+import sys
+import time
+import itertools
+import numpy as np
+import pandas as pd
+from mk_sam_utilities import FIELD_MODEL, PSV_MODELS, get_field_model, \
+    igrf_array, field_model_epoch, field_coefficients, to_year_fraction_array
+
+# columns of the input records, model is optional (one of PSV_MODELS,
+# records without a model use the IGRF and give NaN before 1900)
+INPUT_COLUMNS = ['date', 'lat', 'lon', 'elevation', 'model']
+OUTPUT_COLUMNS = ['dec', 'inc', 'intensity']
+CHUNK_SIZE = 100000
+# year-month-day with an optional time
+ISO_DATE = (r'^\s*(-?\d{1,5})-(\d{1,2})-(\d{1,2})'
+            r'(?:[T ](\d{1,2}):(\d{2})(?::(\d{2}(?:\.\d*)?))?)?Z?\s*$')
+# the numbers of the csv output
+CSV_FORMAT = '%.2f,%.2f,%.1f'
+
+
+def decimal_dates(values):
+    """
+    DESCRIPTION
+        Converts dates to years and decimals of a year: numbers are taken
+        as they are, text as ISO dates and times (2019-07-14 or
+        2019-07-14T15:05, UTC; years before 1 A.D. as -0500-01-01).
+
+    OUTPUT
+        float array, NaN where a date cannot be read
+
+    """
+    values = pd.Series(values)
+    dates = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+    text = np.isnan(dates) & values.notnull().to_numpy()
+    if text.any():
+        parts = values[text].astype(str).str.extract(ISO_DATE)
+        parts = parts.apply(pd.to_numeric).to_numpy(dtype=float)
+        year, month, day = parts[:, 0], parts[:, 1], parts[:, 2]
+        hours, minutes, seconds = [np.nan_to_num(parts[:, j])
+                                   for j in [3, 4, 5]]
+        ok = ~np.isnan(year) & (month >= 1) & (month <= 12) & (day >= 1) & \
+            (day <= 31)
+        parsed = np.full(len(parts), np.nan)
+        parsed[ok] = to_year_fraction_array(
+            year[ok], month[ok], day[ok], hours[ok],
+            minutes[ok] + seconds[ok]/60.)
+        dates[text] = parsed
+    return dates
+
+
+def valid_dates(date, mod=None, field_model=None):
+    """
+    Returns where the field of a model can be calculated: from 1900 for the
+    IGRF, from the first epoch of the coefficients of PSV models.
+    """
+    date = np.asarray(date, dtype=float)
+    valid = ~np.isnan(date)
+    if mod is None:
+        return valid & (date >= 1900.)
+    valid &= date >= -12000.
+    if field_model is None:
+        field_model = get_field_model(mod=mod)
+    epochs = np.where(valid, field_model_epoch(date, mod), np.nan)
+    for epoch in np.unique(epochs[valid]):
+        try:
+            field_coefficients(epoch, mod, *field_model)
+        except (ValueError, IndexError):
+            valid &= epochs != epoch
+    return valid
+
+
+def declinations(date, lat, lon, elevation, mod=None):
+    """
+    DESCRIPTION
+        Calculates the field of any number of points.
+
+        @param: date - years and decimals of a year (A.D.)
+        @param: lat, lon - in degrees
+        @param: elevation - in meters
+        @param: mod - PSV model for dates before 1900 (see PSV_MODELS),
+                None for the IGRF only
+
+    OUTPUT
+        dec, inc (degrees) and intensity (nT) arrays, NaN for points outside
+        of the model or with missing values
+
+    """
+    date, lat, lon, elevation = np.broadcast_arrays(
+        *[np.asarray(v, dtype=float) for v in [date, lat, lon, elevation]])
+    field_model = get_field_model(mod=mod)
+    valid = valid_dates(date, mod, field_model) & (np.abs(lat) <= 90.) & \
+        ~np.isnan(lon)
+    out = np.full((3,) + date.shape, np.nan)
+    if valid.any():
+        out[:, valid] = igrf_array(date[valid],
+                                   np.nan_to_num(elevation[valid])/1000.,
+                                   lat[valid], lon[valid], mod=mod,
+                                   field_model=field_model)
+    return out[0], out[1], out[2]
+
+
+def evaluate(records):
+    """
+    DESCRIPTION
+        Calculates the field of a chunk of records, the points of every
+        model in one batch.
+
+        @param: records - DataFrame with INPUT_COLUMNS (model may be
+                missing)
+
+    OUTPUT
+        (len(records), 3) array of dec, inc and intensity
+        number of records with an unknown model
+
+    """
+    dates = decimal_dates(records['date'])
+    values = [pd.to_numeric(records[column], errors='coerce')
+              .to_numpy(dtype=float) for column in ['lat', 'lon', 'elevation']]
+    if 'model' in records:
+        models = records['model'].fillna('').astype(str).str.strip().to_numpy()
+    else:
+        models = np.full(len(records), '')
+    out = np.full((len(records), 3), np.nan)
+    unknown = 0
+    for model in np.unique(models):
+        rows = models == model
+        if model not in [''] + PSV_MODELS:
+            unknown += rows.sum()
+            continue
+        out[rows] = np.column_stack(declinations(
+            dates[rows], *[v[rows] for v in values],
+            mod=model if model != '' else None))
+    return out, unknown
+
+
+def read_csv_chunks(f, chunk_size=CHUNK_SIZE):
+    """
+    Yields DataFrames of chunk_size records of a csv stream (date, lat, lon,
+    elevation and optionally model per line, an optional header line and
+    lines starting with # are skipped).
+    """
+    first = True
+    while True:
+        lines = list(itertools.islice(f, chunk_size))
+        if not lines:
+            return
+        text = ''.join(lines)
+        options = dict(header=None, names=INPUT_COLUMNS, comment='#',
+                       skipinitialspace=True, dtype={'model': str})
+        try:
+            chunk = pd.read_csv(io.StringIO(text), **options)
+        except pd.errors.EmptyDataError:
+            continue
+        except pd.errors.ParserError:
+            # the c parser does not take a single line with fewer fields
+            # than names
+            chunk = pd.read_csv(io.StringIO(text), engine='python', **options)
+        if first and len(chunk) and \
+                np.isnan(pd.to_numeric(chunk['lat'].iloc[:1],
+                                       errors='coerce')).all():
+            chunk = chunk.iloc[1:]
+        first = False
+        yield chunk
+
+
+def read_binary_chunks(f, chunk_size=CHUNK_SIZE, npy=False):
+    """
+    DESCRIPTION
+        Yields DataFrames of chunk_size records of a binary stream.
+
+        @param: f - binary file or stream
+        @param: npy - the stream is a .npy file: an (N, 4) array or a
+                structured array with date, lat, lon, elevation (and model)
+                fields; otherwise it holds little-endian float64 records of
+                date, lat, lon and elevation without a header
+
+    """
+    dtype = np.dtype('<f8')
+    fields = None
+    if npy:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+        if fortran:
+            raise ValueError('Fortran ordered arrays are not supported')
+        if dtype.names is not None:
+            fields = [name for name in INPUT_COLUMNS if name in dtype.names]
+        elif len(shape) != 2 or shape[1] != 4:
+            raise ValueError('the array must have 4 columns: ' +
+                             ', '.join(INPUT_COLUMNS[:4]))
+    width = dtype.itemsize if fields is not None else 4*dtype.itemsize
+    while True:
+        data = f.read(chunk_size*width)
+        data = data[:len(data) - len(data) % width]
+        if not data:
+            return
+        if fields is not None:
+            records = np.frombuffer(data, dtype=dtype)
+            yield pd.DataFrame(dict((name, records[name]) for name in fields))
+        else:
+            values = np.frombuffer(data, dtype=dtype).reshape(-1, 4)
+            yield pd.DataFrame(values, columns=INPUT_COLUMNS[:4])
+
+
+def main():
+    """
+    NAME
+        sam_declination.py
+
+    DESCRIPTION
+        Calculates the declination, inclination and intensity of the
+        reference field for any number of points streamed from a file or
+        stdin, without a site template: for field planning or for checking
+        the declinations of other data. The points are read, calculated
+        and written in chunks, so memory does not grow with their number.
+
+        Every csv input line holds the date (years and decimals of a year,
+        or an ISO date and UTC time such as 2019-07-14T15:05), latitude,
+        longitude (degrees), elevation (meters) and optionally a PSV model
+        (arch3k, cals3k, pfm9k, hfm10k, cals10k.2, cals10k.1b, cals10k,
+        shadif14k, shawq2k, shawqIA) for dates before 1900. Without a model
+        the IGRF (IGRF-13) is used, points before 1900 give nan. A header
+        line and lines starting with # are skipped. Every output line
+        holds dec, inc (degrees) and intensity (nT) of the input line.
+
+    SYNTAX
+        ~/$ python sam_declination.py [points.csv] [options] > field.csv
+        ~/$ cat points.csv | python sam_declination.py > field.csv
+
+    OPTIONS
+        -in FORMAT : csv (default), npy (a .npy file of an (N, 4) float
+                     array or of records with date, lat, lon, elevation
+                     and model fields) or bin (little-endian float64
+                     date, lat, lon, elevation records without a header)
+        -out FORMAT : csv (default) or bin (little-endian float64 dec, inc,
+                      intensity records)
+        -mod MODEL : PSV model of the points without one
+        -chunk N : points per chunk (default 100000)
+        -noheader : no header line in the csv output
+        -q : no summary on stderr
+
+    """
+    args = sys.argv[1:]
+    in_format, out_format, default_model = 'csv', 'csv', ''
+    chunk_size = CHUNK_SIZE
+    header = '-noheader' not in args
+    if not header:
+        args.remove('-noheader')
+    quiet = '-q' in args
+    if quiet:
+        args.remove('-q')
+    if '-in' in args:
+        ind = args.index('-in')
+        in_format = args[ind+1]
+        del args[ind:ind+2]
+    if '-out' in args:
+        ind = args.index('-out')
+        out_format = args[ind+1]
+        del args[ind:ind+2]
+    if '-mod' in args:
+        ind = args.index('-mod')
+        default_model = args[ind+1]
+        del args[ind:ind+2]
+    if '-chunk' in args:
+        ind = args.index('-chunk')
+        chunk_size = int(args[ind+1])
+        del args[ind:ind+2]
+    if in_format not in ['csv', 'npy', 'bin'] or out_format not in ['csv',
+                                                                    'bin']:
+        raise ValueError('-in must be csv, npy or bin and -out csv or bin')
+
+    if args:
+        f = open(args[0], 'r' if in_format == 'csv' else 'rb')
+    else:
+        f = sys.stdin if in_format == 'csv' else sys.stdin.buffer
+    if in_format == 'csv':
+        chunks = read_csv_chunks(f, chunk_size)
+    else:
+        chunks = read_binary_chunks(f, chunk_size, in_format == 'npy')
+    out = sys.stdout if out_format == 'csv' else sys.stdout.buffer
+    if out_format == 'csv' and header:
+        out.write(','.join(OUTPUT_COLUMNS) + '\n')
+
+    start = time.time()
+    points, missing, unknown = 0, 0, 0
+    for records in chunks:
+        if default_model != '':
+            if 'model' not in records:
+                records = records.assign(model=default_model)
+            else:
+                records = records.assign(model=records['model'].fillna(
+                    default_model))
+        values, n_unknown = evaluate(records)
+        if out_format == 'csv':
+            np.savetxt(out, values, fmt=CSV_FORMAT)
+        else:
+            out.write(values.astype('<f8').tobytes())
+        points += len(values)
+        missing += np.isnan(values[:, 0]).sum()
+        unknown += n_unknown
+    out.flush()
+    if f is not sys.stdin and f is not sys.stdin.buffer:
+        f.close()
+    if not quiet:
+        seconds = time.time() - start
+        print('%d point(s) in %.1f s (%s), %d without a result%s' %
+              (points, seconds, FIELD_MODEL, missing,
+               ' (%d with an unknown model)' % unknown if unknown else ''),
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    try:
+        main()
+    except BrokenPipeError:
+        # the reader (e.g. head) stopped early
+        sys.stdout = open(os.devnull, 'w')
+        sys.exit(1)
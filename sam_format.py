@@ -0,0 +1,143 @@
+import numpy as np
+
+SAM_FORMAT_URL = "http://cires.colorado.edu/people/jones.craig/PMag_Formats.html"
+
+# fixed width columns of the second line of a sample file as
+# (field, width, decimals). A decimals value of None passes the field through
+# verbatim (strat_level is written as it was typed into the template).
+SAMPLE_LAYOUT = [('strat_level', 6, None),
+                 ('core_strike', 5, 1),
+                 ('core_dip', 5, 1),
+                 ('bedding_strike', 5, 1),
+                 ('bedding_dip', 5, 1),
+                 ('mass', 5, 1)]
+
+SITE_ID_WIDTH = 5
+SAMPLE_NAME_WIDTH = 9
+COMMENT_WIDTH = 255
+
+
+class SampleFormatter(object):
+    """
+    DESCRIPTION
+        Renders the two header lines of RAPID sample files for whole arrays of
+        samples at once. The column layout is compiled when the formatter is
+        created so rendering a site is only a handful of array operations.
+
+        Widths are checked in bulk: render returns every offending value
+        rather than stopping at the first one.
+
+    SYNTAX
+        formatter = SampleFormatter()
+        heads, problems = formatter.render(site_id, names, comments, columns)
+
+    """
+
+    def __init__(self, layout=SAMPLE_LAYOUT, site_width=SITE_ID_WIDTH,
+                 name_width=SAMPLE_NAME_WIDTH, comment_width=COMMENT_WIDTH):
+        self.layout = list(layout)
+        self.fields = [field for field, width, decimals in self.layout]
+        self.site_width = site_width
+        self.name_width = name_width
+        self.comment_width = comment_width
+        self.widths = [width for field, width, decimals in self.layout]
+        self.templates = ['%.{}f'.format(decimals) if decimals is not None
+                          else None for field, width, decimals in self.layout]
+
+    def format_column(self, values, template):
+        """
+        Rounds a column using a '%.Nf' template and returns it as an array of
+        strings. NaN values become empty strings; with a template of None the
+        values are only converted to strings.
+        """
+        if template is None:
+            return np.array([str(v) for v in values], dtype=str)
+        values = np.asarray(values, dtype=float)
+        # '%.1f' rounds exactly like str(round(value, 1))
+        strs = np.char.mod(template, values)
+        strs[np.isnan(values)] = ''
+        return strs
+
+    def format_columns(self, columns):
+        """
+        Formats every column of the layout, returning a dict of field to
+        arrays of (unpadded) strings.
+        """
+        return {field: self.format_column(columns[field], template)
+                for field, template in zip(self.fields, self.templates)}
+
+    def check_widths(self, site_id, names, comments, formatted):
+        """
+        Returns a list of (row, field, value, width) tuples for every value
+        that does not fit into its SAM column. The row is None for the site_id.
+        """
+        problems = []
+        if len(site_id) > self.site_width:
+            problems.append((None, 'site_id', site_id, self.site_width))
+        checks = [('sample_name', names, self.name_width),
+                  ('comment', comments, self.comment_width)]
+        checks += [(field, formatted[field], width)
+                   for field, width in zip(self.fields, self.widths)]
+        for field, strs, width in checks:
+            strs = np.asarray(strs, dtype=str)
+            for row in np.flatnonzero(np.char.str_len(strs) > width):
+                problems.append((int(row), field, str(strs[row]), width))
+        return problems
+
+    def render(self, site_id, names, comments, columns):
+        """
+        DESCRIPTION
+            Renders the header lines of a set of sample files.
+
+            @param: site_id - site id prepended to every sample name
+            @param: names - sequence of sample names
+            @param: comments - sequence of sample comments
+            @param: columns - dict of field name to sequence of values for
+                    every field of the layout
+
+        OUTPUT
+            heads - list of file heads (two '\\r\\n' terminated lines each)
+            problems - list of (row, field, value, width) tuples of values
+                       that exceed the SAM column widths
+
+        """
+        return self.render_formatted(site_id, names, comments,
+                                     self.format_columns(columns))
+
+    def render_formatted(self, site_id, names, comments, formatted):
+        """
+        Same as render but takes columns already passed through
+        format_columns.
+        """
+        names = np.asarray([str(n) for n in names], dtype=str)
+        comments = np.asarray([str(c) for c in comments], dtype=str)
+        problems = self.check_widths(site_id, names, comments, formatted)
+
+        first = np.char.add(np.char.add(site_id + ' ', names),
+                            np.char.add(' ', comments))
+        second = np.full(len(names), '', dtype=str)
+        for field, width in zip(self.fields, self.widths):
+            padded = np.char.rjust(formatted[field], width)
+            second = np.char.add(np.char.add(second, ' '), padded)
+        heads = np.char.add(np.char.add(first, '\r\n'),
+                            np.char.add(second, '\r\n'))
+        return heads.tolist(), problems
+
+
+def describe_problems(problems, names=None):
+    """
+    Turns the problem tuples returned by SampleFormatter.render into a list of
+    human readable messages. If the sample names are given they are used in
+    place of row numbers.
+    """
+    messages = []
+    for row, field, value, width in problems:
+        if row is None:
+            where = 'site'
+        elif names is not None:
+            where = 'sample %s' % names[row]
+        else:
+            where = 'row %d' % row
+        messages.append("%s: %s '%s' exceeds %d characters" %
+                        (where, field, value, width))
+    return messages
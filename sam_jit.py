@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import contextlib
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# the compiled kernels are used when numba is installed, unless the
+# SAM_NO_JIT environment variable is set (or enabled is set to False)
+enabled = numba is not None and not os.environ.get('SAM_NO_JIT')
+
+
+def jit(function):
+    """
+    Compiles function with numba (caching the machine code next to this
+    file so only the first run compiles it), or leaves it as it is.
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True)(function)
+
+
+def active():
+    """
+    True if the compiled kernels are used.
+    """
+    return enabled and numba is not None
+
+
+@contextlib.contextmanager
+def disabled():
+    """
+    Uses the numpy implementation inside the with block.
+    """
+    global enabled
+    saved, enabled = enabled, False
+    try:
+        yield
+    finally:
+        enabled = saved
+
+
+@jit
+def _magsyn_points(gh, sv, b, date, itype, alt, colat, elong, out):
+    # magsyn of mk_sam_utilities for every point, keeping its float32
+    # intermediates so that both give the same numbers
+    p = np.zeros(66, np.float32)
+    q = np.zeros(66, np.float32)
+    cl = np.zeros(10, np.float32)
+    sl = np.zeros(10, np.float32)
+    for point in range(date.shape[0]):
+        row = point if gh.shape[0] > 1 else 0
+        p[:] = 0.
+        q[:] = 0.
+        cl[:] = 0.
+        sl[:] = 0.
+        t = date[point] - b[point]
+        r = alt[point]
+        one = colat[point]*0.0174532925
+        ct = np.cos(one)
+        st = np.sin(one)
+        one = elong[point]*0.0174532925
+        cl[0] = np.cos(one)
+        sl[0] = np.sin(one)
+        x, y, z = 0.0, 0.0, 0.0
+        cd, sd = 1.0, 0.0
+        l, ll, m, n = 1, 0, 1, 0
+        fn, gn = 0.0, 0.0
+        if itype != 2:
+            a2 = 40680925.0
+            b2 = 40408585.0
+            one = a2 * st * st
+            two = b2 * ct * ct
+            three = one + two
+            rho = np.sqrt(three)
+            r = np.sqrt(alt[point]*(alt[point]+2.0*rho) +
+                        (a2*one+b2*two)/three)
+            cd = (alt[point] + rho) / r
+            sd = (a2 - b2) / rho * ct * st / r
+            one = ct
+            ct = ct*cd - st*sd
+            st = st*cd + one*sd
+        ratio = 6371.2 / r
+        rr = ratio * ratio
+        p[0] = 1.0
+        p[2] = st
+        q[0] = 0.0
+        q[2] = ct
+        for k in range(1, 66):
+            if n < m:
+                m = 0
+                n = n + 1
+                rr = rr * ratio
+                fn = float(n)
+                gn = float(n - 1)
+            fm = float(m)
+            if k != 2:
+                if m == n:
+                    one = np.sqrt(1.0 - 0.5/fm)
+                    j = k - n - 1
+                    p[k] = one * st * p[j]
+                    q[k] = one * (st*q[j] + ct*p[j])
+                    cl[m-1] = cl[m-2]*cl[0] - sl[m-2]*sl[0]
+                    sl[m-1] = sl[m-2]*cl[0] + cl[m-2]*sl[0]
+                else:
+                    gm = float(m * m)
+                    one = np.sqrt(fn*fn - gm)
+                    two = np.sqrt(gn*gn - gm) / one
+                    three = (fn + gn) / one
+                    i = k - n
+                    j = i - n + 1
+                    p[k] = three*ct*p[i] - two*p[j]
+                    q[k] = three*(ct*q[i] - st*p[i]) - two*q[j]
+            one = (gh[row, l-1] + sv[row, ll+l-1]*t)*rr
+            if m != 0:
+                two = (gh[row, l] + sv[row, ll+l]*t)*rr
+                three = one*cl[m-1] + two*sl[m-1]
+                x = x + three*q[k]
+                z = z - (fn + 1.0)*three*p[k]
+                if st != 0.0:
+                    y = y + (one*sl[m-1] - two*cl[m-1])*fm*p[k]/st
+                else:
+                    y = y + (one*sl[m-1] - two*cl[m-1])*q[k]*ct
+                l = l + 2
+            else:
+                x = x + one*q[k]
+                z = z - (fn + 1.0)*one*p[k]
+                l = l + 1
+            m = m + 1
+        one = x
+        x = x*cd + z*sd
+        z = z*cd - one*sd
+        out[0, point] = x
+        out[1, point] = y
+        out[2, point] = z
+        out[3, point] = np.sqrt(x*x + y*y + z*z)
+
+
+def magsyn_points(gh, sv, b, date, itype, alt, colat, elong):
+    """
+    Compiled magsyn for many points, with the arguments of magsyn_array.
+    Returns x, y, z, f arrays.
+    """
+    b, date, alt, colat, elong = np.broadcast_arrays(
+        *[np.asarray(v, dtype=float) for v in [b, date, alt, colat, elong]])
+    shape = date.shape
+    b, date, alt, colat, elong = [np.array(v.ravel())
+                                  for v in [b, date, alt, colat, elong]]
+    gh = np.atleast_2d(np.asarray(gh, dtype=float))
+    sv = np.atleast_2d(np.asarray(sv, dtype=float))
+    out = np.empty((4, date.size))
+    _magsyn_points(gh, sv, b, date, int(itype), alt, colat, elong, out)
+    return tuple(v.reshape(shape) for v in out)
+
+
+@jit
+def _sundec_points(year, mon, day, hours, minutes, delta_u, lat, lon,
+                   shadow_angle, out):
+    # sundec (with julian and gha) of mk_sam_utilities for every reading
+    rad = np.pi/180.
+    ig = 15+31*(10+12*1582)
+    for point in range(year.shape[0]):
+        hrs = hours[point] - np.trunc(delta_u[point])
+        d = day[point]
+        if hrs > 24:
+            d = d + 1
+            hrs = hrs - 24
+        if hrs < 0:
+            d = d - 1
+            hrs = hrs + 24
+        # julian
+        yr = year[point]
+        mo = mon[point]
+        if yr == 0:
+            out[point] = np.nan
+            continue
+        if yr < 0:
+            yr = yr + 1
+        if mo > 2:
+            julian_year = yr
+            julian_month = mo + 1
+        else:
+            julian_year = yr - 1
+            julian_month = mo + 13
+        julian_day = np.trunc(365.25*julian_year) + \
+            np.trunc(30.6001*julian_month) + d + 1720995
+        if d + 31*(mo + 12*yr) >= ig:
+            jadj = np.trunc(0.01*julian_year)
+            julian_day = julian_day + 2 - jadj + np.trunc(0.25*jadj)
+        # gha
+        f = (hrs + minutes[point]/60.)/24.
+        dd = julian_day - 2451545.0 + f
+        L = 280.460 + 0.9856474*dd
+        g = 357.528 + 0.9856003*dd
+        L = L % 360.
+        g = g % 360.
+        lamb = L + 1.915*np.sin(g*rad) + .02*np.sin(2*g*rad)
+        epsilon = 23.439 - 0.0000004*dd
+        t = (np.tan((epsilon*rad)/2))**2
+        r = 1/rad
+        rl = lamb*rad
+        alpha = lamb - r*t*np.sin(2*rl) + (r/2)*t*t*np.sin(4*rl)
+        delta = np.sin(epsilon*rad)*np.sin(lamb*rad)
+        delta = np.arcsin(delta)/rad
+        eqt = (L - alpha)
+        utm = f*24*60
+        H = utm/4 + eqt + 180
+        H = H % 360.0
+        # azimuth of the sun
+        H = H + lon[point]
+        if H > 360:
+            H = H - 360
+        la = lat[point]
+        if H > 90 and H < 270:
+            la = -la
+        la = la*rad
+        delta = delta*rad
+        H = H*rad
+        ctheta = np.sin(la)*np.sin(delta) + np.cos(la)*np.cos(delta)*np.cos(H)
+        theta = np.arccos(ctheta)
+        beta = np.cos(delta)*np.sin(H)/np.sin(theta)
+        beta = np.arcsin(beta)/rad
+        if delta < la:
+            beta = 180 - beta
+        out[point] = (180 - beta + shadow_angle[point]) % 360.
+
+
+def sundec_points(year, mon, day, hours, minutes, delta_u, lat, lon,
+                  shadow_angle):
+    """
+    Compiled sundec for arrays of readings, with the arguments of
+    sundec_array.
+    """
+    values = np.broadcast_arrays(
+        *[np.asarray(v, dtype=float) for v in [year, mon, day, hours,
+                                               minutes, delta_u, lat, lon,
+                                               shadow_angle]])
+    shape = values[0].shape
+    values = [np.array(v.ravel()) for v in values]
+    out = np.empty(values[0].size)
+    _sundec_points(*(values + [out]))
+    return out.reshape(shape)
+
+
+def compile_kernels():
+    """
+    Compiles (or loads the cached) kernels by running them once.
+    """
+    gh = np.zeros((1, 120))
+    gh[0, 0] = -29404.
+    magsyn_points(gh, gh, 2020., 2020.5, 1, 0., 45., 10.)
+    sundec_points(2020, 7, 1, 12, 0, -5, 45., -90., 0.)
+
+
+def main():
+    """
+    NAME
+        sam_jit.py
+
+    DESCRIPTION
+        Compiles the numba kernels for magsyn and sundec and caches them so
+        that later runs start without compiling. The kernels are used
+        automatically when numba is installed; set SAM_NO_JIT=1 to use the
+        plain numpy code instead.
+
+    SYNTAX
+        ~/$ python sam_jit.py
+
+    """
+    if numba is None:
+        print('numba is not installed, the numpy implementation is used')
+        return
+    start = time.time()
+    compile_kernels()
+    print('kernels ready (%.1f s)' % (time.time() - start))
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
@@ -0,0 +1,120 @@
+import sys
+import json
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger('mk_sam')
+
+# console verbosity: -q only shows warnings, the default one summary per site
+# and -v every sample
+QUIET, NORMAL, VERBOSE = -1, 0, 1
+CONSOLE_LEVELS = {QUIET: logging.WARNING,
+                  NORMAL: logging.INFO,
+                  VERBOSE: logging.DEBUG}
+# samples named in the message of a grouped site warning, the event keeps all
+MAX_LISTED_SAMPLES = 10
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats every record as a single JSON object holding the time, level,
+    event name and message along with any fields passed to event().
+    """
+
+    def format(self, record):
+        entry = OrderedDict()
+        entry['time'] = round(record.created, 3)
+        entry['level'] = record.levelname.lower()
+        entry['event'] = getattr(record, 'event', 'message')
+        entry['message'] = record.getMessage()
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(verbosity=NORMAL, event_file=None):
+    """
+    DESCRIPTION
+        Configures the mk_sam logger.
+
+        @param: verbosity - QUIET, NORMAL or VERBOSE console output
+        @param: event_file - optional path of a JSON-lines file receiving
+                every event (including per sample events) regardless of the
+                console verbosity; '-' writes the events to stdout
+
+    """
+    logger.handlers = []
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    console = logging.StreamHandler(sys.stderr if event_file == '-'
+                                    else sys.stdout)
+    console.setLevel(CONSOLE_LEVELS[max(QUIET, min(VERBOSE, verbosity))])
+    console.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(console)
+    if event_file is not None:
+        if event_file == '-':
+            events = logging.StreamHandler(sys.stdout)
+        else:
+            events = logging.FileHandler(event_file, mode='a')
+        events.setLevel(logging.DEBUG)
+        events.setFormatter(JsonLinesFormatter())
+        logger.addHandler(events)
+
+
+def event(level, name, message, **fields):
+    """
+    Logs a message with an event name and structured fields. The fields only
+    appear in the JSON-lines stream, the console shows the message.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={'event': name, 'fields': fields})
+
+
+def debug(name, message, **fields):
+    event(logging.DEBUG, name, message, **fields)
+
+
+def info(name, message, **fields):
+    event(logging.INFO, name, message, **fields)
+
+
+def warning(name, message, **fields):
+    event(logging.WARNING, name, message, **fields)
+
+
+class SiteWarnings(object):
+    """
+    DESCRIPTION
+        Collects the warnings of a site so that each kind of warning is shown
+        once per site listing the samples it applies to (the message names
+        the first MAX_LISTED_SAMPLES, the samples field of the event all of
+        them). Every individual warning is still logged at debug level.
+
+    SYNTAX
+        warnings = SiteWarnings(site_id)
+        warnings.add('dec_mismatch', sample, 'local IGRF declination & ...')
+        warnings.flush()
+
+    """
+
+    def __init__(self, site_id):
+        self.site_id = site_id
+        self.kinds = OrderedDict()
+
+    def add(self, kind, sample, message, **fields):
+        debug(kind, 'WARNING: ' + self.site_id + str(sample) + ' ' + message,
+              site_id=self.site_id, sample=str(sample), **fields)
+        if kind not in self.kinds:
+            self.kinds[kind] = (message, [])
+        self.kinds[kind][1].append(str(sample))
+
+    def flush(self):
+        for kind, (message, samples) in self.kinds.items():
+            listed = ', '.join(samples[:MAX_LISTED_SAMPLES])
+            if len(samples) > MAX_LISTED_SAMPLES:
+                listed += ', ... and %d more' % \
+                    (len(samples) - MAX_LISTED_SAMPLES)
+            warning(kind + '_summary',
+                    'WARNING: %d sample(s) of %s: %s (%s)' %
+                    (len(samples), self.site_id, message, listed),
+                    site_id=self.site_id, samples=samples)
+        self.kinds = OrderedDict()
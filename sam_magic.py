@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import math
+import numpy as np
+import pandas as pd
+import sam_log
+
+CITATIONS = 'This study'
+# columns of the MagIC 3.0 tables written
+SITE_COLUMNS = ['site', 'location', 'samples', 'lat', 'lon', 'citations']
+SAMPLE_COLUMNS = ['sample', 'site', 'specimens', 'azimuth', 'dip',
+                  'bed_dip_direction', 'bed_dip', 'azimuth_dec_correction',
+                  'height', 'method_codes', 'citations']
+SPECIMEN_COLUMNS = ['specimen', 'sample', 'weight', 'method_codes',
+                    'citations']
+TABLES = [('sites', SITE_COLUMNS), ('samples', SAMPLE_COLUMNS),
+          ('specimens', SPECIMEN_COLUMNS)]
+
+
+def orientation_method(df):
+    """
+    Returns the MagIC orientation method code of a site: SO-SUN if every
+    sample was oriented with the sun compass, SO-MAG if every sample was
+    oriented with the magnetic compass and SO-SM for a mix of both.
+    """
+    if all(df.T['comment'] == 'sun compass orientation'):
+        return 'SO-SUN'
+    elif all(df.T['comment'] == 'mag compass orientation (IGRF corrected)'):
+        return 'SO-MAG'
+    return 'SO-SM'
+
+
+def location_name(hdf):
+    """
+    Returns the site_name of a site, or 'unknown' if it has none.
+    """
+    site_name = hdf['site_info']['site_name']
+    if isinstance(site_name, str) and site_name != '':
+        return site_name
+    return 'unknown'
+
+
+def naming_convention(df, hdf):
+    """
+    DESCRIPTION
+        Determines the sample naming convention of a site (as used by
+        PmagPy) and the number of terminal characters of the sample names
+        that designate the specimen.
+
+        @param: df - sample Dataframe
+        @param: hdf - site DataFrame
+
+    OUTPUT
+        convention - '2', '3', '4' or '5' (see below)
+        term_unique - number of terminal characters
+
+    """
+    first_sample_id = str(df.keys()[0])
+    """Sample naming conventions:
+    [1] XXXXY: where XXXX is an arbitrary length site designation and Y
+    is the single character sample designation.  e.g., TG001a is the
+    first sample from site TG001.    [default]
+    [2] XXXX-YY: YY sample from site XXXX (XXX, YY of arbitary length)
+    [3] XXXX.YY: YY sample from site XXXX (XXX, YY of arbitary length)
+    [4-Z] XXXX[YYY]:  YYY is sample designation with Z characters from site XXX
+    [5] site name = sample name
+    [6] site name entered in site_name column in the orient.txt format input file
+    [7-Z] [XXX]YYY:  XXX is site designation with Z characters from samples  XXXYYY
+    """
+    # check for naming convention 2
+    if first_sample_id[0] == '-' or hdf['site_info']['site_id'][-1] == '-':
+        convention = '2'
+        # if delimiter in sample id, remove it
+        if first_sample_id[0] == '-':
+            first_sample_id.replace('-', '', 1)
+    # check for naming convention 3
+    elif first_sample_id[0] == '.' or hdf['site_info']['site_id'][-1] == '.':
+        convention = '3'
+        if first_sample_id[0] == '.':
+            first_sample_id.replace('.', '', 1)
+    # check for naming convention 5
+    elif hdf['site_info']['site_id'] == first_sample_id:
+        convention = '5'
+    # assign 4 as last resort -- should also notify user of uncertain values
+    else:
+        convention = '4'
+
+    # DETERMINE NUMBER OF TERMINAL CHARACTERS
+    sample_list = list(map(str, df.keys()))
+    sample_ct = len(sample_list)
+    # get length of shortest sample name
+    char_num = len(min(sample_list, key=len))
+    term_ct, term_unique = 0, 0
+    # initialize list keeping track of remaining (left) characters
+    the_rest = sample_list
+    # scan sample name from right to left
+    while term_ct < char_num:
+        # pop off last character from each name
+        lastchar = [t[-1] for t in the_rest]
+        the_rest = [t[0:-1] for t in the_rest]
+        term_ct += 1
+        unique_chars = np.unique(lastchar)
+        unique_rest = np.unique(the_rest)
+        # determine the number of characters distinguishing specimen/sample
+        # NOTE: this is not flawless, but appears to work in most cases.
+        if len(unique_chars) == 1 and len(unique_rest) == sample_ct:
+            # term_unique += 1
+            term_unique = term_ct
+            continue
+        if len(unique_rest) < sample_ct:
+            break
+    return convention, term_unique
+
+
+def parse_site(sample, convention, site_id):
+    """
+    Returns the site of a MagIC sample name by the naming convention (see
+    naming_convention), as PmagPy does. Sites without a delimiter
+    (convention 4) keep their site_id.
+    """
+    if convention == '2':
+        return sample.strip('-').split('-')[0]
+    if convention == '3':
+        return sample.split('.')[0]
+    if convention == '5':
+        return sample
+    return site_id
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def site_records(hdf, df):
+    """
+    DESCRIPTION
+        Builds the MagIC records of a processed site from the values written
+        to its sample files, with the names and orientation method code the
+        .inp file gives PmagPy so that the tables match what cit_magic
+        makes of the .inp.
+
+        @param: hdf - site DataFrame
+        @param: df - sample Dataframe after process_site (or read from the
+                .csv written by mk_sam_file.py)
+
+    OUTPUT
+        lists of the site, sample and specimen records (dictionaries)
+
+    """
+    site_info = hdf['site_info']
+    site_id = site_info['site_id']
+    method = orientation_method(df)
+    convention, term_chars = naming_convention(df, hdf)
+    sites, samples, specimens = {}, {}, []
+    for sample_name in df.keys():
+        values = df[sample_name]
+        # the specimen is the sample file, named as in the .sam file
+        specimen = site_id + str(sample_name)
+        sample = specimen[:-term_chars] if term_chars else specimen
+        site = parse_site(sample, convention, site_id)
+
+        # the strike written to the sample file, corrected if asked for
+        bedding_strike = to_float(values['bedding_strike'])
+        if str(values['correct_bedding_using_local_dec']).lower() == 'yes' \
+                and not math.isnan(to_float(values['corrected_bedding_strike'])):
+            bedding_strike = to_float(values['corrected_bedding_strike'])
+        mass = to_float(values['mass'])
+
+        specimens.append({
+            'specimen': specimen, 'sample': sample,
+            # a mass of 1.0 g is the default of samples without one
+            'weight': '' if mass == 1.0 or math.isnan(mass) else
+                      '%.3e' % (mass*1e-3),
+            'method_codes': 'LP-NOMAG' if mass == 1.0 else '',
+            'citations': CITATIONS})
+        if sample in samples:
+            samples[sample]['specimens'] += ':' + specimen
+        else:
+            samples[sample] = {
+                'sample': sample, 'site': site, 'specimens': specimen,
+                'azimuth': '%.1f' % ((to_float(values['core_strike']) - 90.)
+                                     % 360.),
+                'dip': '%.1f' % -to_float(values['core_dip']),
+                'bed_dip_direction': '%.1f' % ((bedding_strike + 90.) % 360.),
+                'bed_dip': '%.1f' % to_float(values['bedding_dip']),
+                # the azimuths are already corrected for the declination
+                'azimuth_dec_correction': '0.0',
+                'height': '%g' % to_float(values['strat_level']),
+                'method_codes': method,
+                'citations': CITATIONS}
+        if site in sites:
+            if sample not in sites[site]['samples'].split(':'):
+                sites[site]['samples'] += ':' + sample
+        else:
+            sites[site] = {
+                'site': site, 'location': location_name(hdf),
+                'samples': sample,
+                'lat': '%g' % float(site_info['site_lat']),
+                'lon': '%g' % (float(site_info['site_long']) % 360.),
+                'citations': CITATIONS}
+    return list(sites.values()), list(samples.values()), specimens
+
+
+def magic_tables(sites):
+    """
+    DESCRIPTION
+        Builds the MagIC sites, samples and specimens tables of any number
+        of processed sites.
+
+        @param: sites - list of (hdf, df) of every site
+
+    OUTPUT
+        dictionary of the table name and its DataFrame
+
+    """
+    return records_tables([site_records(hdf, df) for hdf, df in sites])
+
+
+def records_tables(site_rows):
+    """
+    Builds the MagIC tables from the site_records of any number of sites,
+    see magic_tables.
+    """
+    records = dict((table, []) for table, columns in TABLES)
+    for rows_of_site in site_rows:
+        for (table, columns), rows in zip(TABLES, rows_of_site):
+            records[table] += rows
+    tables = {}
+    for table, columns in TABLES:
+        rows = pd.DataFrame(records[table], columns=columns)
+        # a name can only appear once in a MagIC table
+        tables[table] = rows.drop_duplicates(columns[0], keep='last')
+    return tables
+
+
+def write_magic_table(file_name, table, rows):
+    """
+    Writes a tab delimited MagIC 3.0 table.
+    """
+    with open(file_name, 'w', newline='') as f:
+        f.write('tab\t%s\n' % table)
+        rows.to_csv(f, sep='\t', index=False, lineterminator='\n')
+
+
+def write_tables(directory, tables):
+    """
+    DESCRIPTION
+        Writes MagIC tables as sites.txt, samples.txt and specimens.txt.
+
+        @param: directory - directory to write to
+        @param: tables - dictionary from magic_tables
+
+    OUTPUT
+        list of the files written
+
+    """
+    if directory != '' and not os.path.exists(directory):
+        os.makedirs(directory)
+    file_names = []
+    for table, columns in TABLES:
+        file_name = os.path.join(directory, table + '.txt')
+        write_magic_table(file_name, table, tables[table])
+        sam_log.debug('write', 'Writing file - ' + file_name, path=file_name)
+        file_names.append(file_name)
+    return file_names
+
+
+def main():
+    """
+    NAME
+        sam_magic.py
+
+    DESCRIPTION
+        Writes the MagIC 3.0 sites, samples and specimens tables of sites
+        written by mk_sam_file.py, read from their .csv files instead of
+        converting every .sam and sample file with cit_magic. The names,
+        naming convention and orientation method codes (SO-SUN, SO-MAG,
+        SO-SM) are the ones of the .inp files. mk_sam_file.py -magic writes
+        the same tables while processing.
+
+    SYNTAX
+        ~/$ python sam_magic.py archive_directory ... [options]
+        ~/$ python sam_magic.py site_output/GB20-.csv ... [options]
+
+    OPTIONS
+        -od OUTPUT_DIRECTORY : directory for sites.txt, samples.txt and
+                               specimens.txt (default is the current
+                               directory)
+        -v : list every file written
+        -q : only print warnings
+
+    """
+    args = sys.argv[1:]
+    output_directory = ''
+    verbosity = sam_log.NORMAL
+    if '-v' in args:
+        args.remove('-v')
+        verbosity = sam_log.VERBOSE
+    if '-q' in args:
+        args.remove('-q')
+        verbosity = sam_log.QUIET
+    if '-od' in args:
+        ind = args.index('-od')
+        output_directory = args[ind+1]
+        del args[ind:ind+2]
+    sam_log.setup_logging(verbosity)
+    # imported here, mk_sam_file.py imports this module
+    from mk_sam_file import read_site
+    from sam_migrate import find_sites
+
+    sites = []
+    for file_name in find_sites(args):
+        hdf, df, sdf = read_site(file_name)
+        sites.append((hdf, df))
+    if not sites:
+        sam_log.warning('magic', 'no written sites found')
+        return
+    tables = magic_tables(sites)
+    write_tables(output_directory, tables)
+    sam_log.info('write_magic', 'Wrote MagIC tables of %d site(s), %d '
+                 'sample(s) to %s' % (len(tables['sites']),
+                                      len(tables['samples']),
+                                      output_directory or '.'),
+                 sites=len(tables['sites']), samples=len(tables['samples']),
+                 output_directory=output_directory)
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python
+
+import os
+import re
+import sys
+import numpy as np
+from sam_merge import read_head, ENCODING
+import sam_log
+
+# values of a measurement line after the demag step, in file order (see
+# SAM_file_format.pdf): geographic and stratigraphic direction, intensity
+# (emu/cm^3, normalized by the core volume or mass), error angle, direction
+# in core coordinates and the standard deviations of x, y and z (1e-5 emu)
+LINE_FIELDS = ['dec_geo', 'inc_geo', 'dec_strat', 'inc_strat', 'moment',
+               'error_angle', 'dec_core', 'inc_core', 'x_sigma', 'y_sigma',
+               'z_sigma']
+# the moment components in core coordinates, calculated from moment,
+# dec_core and inc_core
+COMPONENTS = ['x', 'y', 'z']
+# demag type (NRM, AF, TT, ...) and level at the start of a line
+STEP = re.compile(r'^\s*([A-Za-z]+)\s*([-+]?\d*\.?\d*)')
+
+
+def measurement_dtype(name_length=16):
+    """
+    Returns the dtype of the measurement records.
+    """
+    return np.dtype([('specimen', 'U%d' % name_length), ('step_type', 'U4'),
+                     ('step', 'f8')] +
+                    [(field, 'f8') for field in LINE_FIELDS + COMPONENTS])
+
+
+def index_dtype(name_length=16, path_length=64):
+    """
+    Returns the dtype of the index: the sample file of every specimen, the
+    byte offset of its first measurement line and its rows in the records.
+    """
+    return np.dtype([('specimen', 'U%d' % name_length),
+                     ('path', 'U%d' % path_length), ('offset', 'i8'),
+                     ('start', 'i8'), ('count', 'i8')])
+
+
+def sample_files(paths):
+    """
+    Returns (specimen, path) of the sample files in paths: the samples
+    listed in .sam files (directories are searched recursively for them),
+    other files are taken as sample files.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            sams = []
+            for directory, dirs, names in os.walk(path):
+                dirs.sort()
+                sams += [os.path.join(directory, name) for name in sorted(names)
+                         if name.lower().endswith('.sam')]
+        elif path.lower().endswith('.sam'):
+            sams = [path]
+        else:
+            files.append((os.path.basename(path), path))
+            continue
+        for sam in sams:
+            directory = os.path.split(sam)[0]
+            with open(sam, encoding=ENCODING, errors='replace') as f:
+                lines = f.read().splitlines()
+            if lines and lines[0].strip() in ['CIT', '2G', 'APP', 'JRA']:
+                lines = lines[1:]
+            # comment and locality lines, then one sample per line
+            for line in lines[2:]:
+                if line.strip() == '':
+                    continue
+                specimen = line.split()[0]
+                files.append((specimen, os.path.join(directory, specimen)))
+    return files
+
+
+def read_data(path):
+    """
+    Returns the byte offset of the first measurement line of a sample file
+    and the bytes of the file from there on.
+    """
+    with open(path, 'rb') as f:
+        offset = read_head(f)[1]
+        f.seek(offset)
+        return offset, f.read()
+
+
+def count_lines(data):
+    """
+    Returns the number of measurement lines split_lines finds in data,
+    without decoding them.
+    """
+    return sum(1 for line in data.split(b'\n') if line.strip() != b'')
+
+
+def split_lines(data):
+    """
+    Returns the measurement lines in the bytes of a sample file after its
+    header.
+    """
+    lines = [line.rstrip(b'\r') for line in data.split(b'\n')]
+    return [line.decode(ENCODING, errors='replace') for line in lines
+            if line.strip() != b'']
+
+
+def parse_lines(lines):
+    """
+    DESCRIPTION
+        Parses measurement lines (of any number of sample files) into a
+        (len(lines), 13) float array and the demag types. Lines with all
+        eleven values are converted in one step, the others (no standard
+        deviations, or values that do not parse) one at a time with NaN
+        for the missing values.
+
+    OUTPUT
+        step_types - list of the demag type of every line
+        values - float array of the step and LINE_FIELDS of every line
+
+    """
+    step_types, steps, rests = [], [], []
+    for line in lines:
+        # the type and level take the first 6 characters (NRM has none)
+        match = STEP.match(line[:6])
+        step_type = match.group(1).upper() if match else ''
+        level = match.group(2) if match else ''
+        step_types.append(step_type)
+        steps.append(level if level not in ['', '.', '-', '+'] else '0')
+        rests.append(line[6:].split()[:len(LINE_FIELDS)])
+    values = np.full((len(lines), len(LINE_FIELDS) + 1), np.nan)
+    if not lines:
+        return step_types, values
+    full = np.array([len(rest) == len(LINE_FIELDS) for rest in rests])
+    try:
+        values[full, 1:] = np.array([rest for rest, ok in zip(rests, full)
+                                     if ok], dtype='U24').astype(float)
+    except ValueError:
+        full[:] = False
+    for i in np.flatnonzero(~full):
+        for j, value in enumerate(rests[i]):
+            try:
+                values[i, j + 1] = float(value)
+            except ValueError:
+                break
+    for i, step in enumerate(steps):
+        try:
+            values[i, 0] = float(step)
+        except ValueError:
+            pass
+    return step_types, values
+
+
+def to_records(specimens, step_types, values):
+    """
+    Builds the measurement records of parsed lines and calculates the
+    moment components in core coordinates.
+    """
+    length = max([len(s) for s in specimens] + [1])
+    records = np.zeros(len(step_types), measurement_dtype(length))
+    records['specimen'] = specimens
+    records['step_type'] = step_types
+    records['step'] = values[:, 0]
+    for j, field in enumerate(LINE_FIELDS):
+        records[field] = values[:, j + 1]
+    rad = np.pi/180.
+    dec, inc = records['dec_core']*rad, records['inc_core']*rad
+    records['x'] = records['moment']*np.cos(inc)*np.cos(dec)
+    records['y'] = records['moment']*np.cos(inc)*np.sin(dec)
+    records['z'] = records['moment']*np.sin(inc)
+    return records
+
+
+def iter_measurements(files, chunk_size=1000):
+    """
+    DESCRIPTION
+        Reads the measurement lines of sample files, chunk_size files at a
+        time, so that an archive of any size can be processed in constant
+        memory.
+
+        @param: files - list of (specimen, path) (see sample_files)
+        @param: chunk_size - number of files per chunk
+
+    OUTPUT
+        yields (records, index) of every chunk, see measurement_dtype and
+        index_dtype; start in the index counts from the first record of
+        all chunks
+
+    """
+    start = 0
+    for first in range(0, len(files), chunk_size):
+        specimens, lines, entries = [], [], []
+        for specimen, path in files[first:first + chunk_size]:
+            try:
+                offset, data = read_data(path)
+            except IOError as err:
+                sam_log.warning('measurements', 'could not read %s (%s)' %
+                                (path, err), path=path)
+                continue
+            file_lines = split_lines(data)
+            lines += file_lines
+            specimens += [specimen]*len(file_lines)
+            entries.append((specimen, path, offset, start, len(file_lines)))
+            start += len(file_lines)
+        step_types, values = parse_lines(lines)
+        records = to_records(specimens, step_types, values)
+        length = max([len(entry[0]) for entry in entries] + [1])
+        path_length = max([len(entry[1]) for entry in entries] + [1])
+        index = np.array(entries, dtype=index_dtype(length, path_length))
+        yield records, index
+
+
+def read_measurements(paths, chunk_size=1000):
+    """
+    DESCRIPTION
+        Reads the measurements of all sample files in paths.
+
+        @param: paths - .sam files, directories holding them or sample files
+        @param: chunk_size - number of files parsed at a time
+
+    OUTPUT
+        records - structured array with a row for every measurement line
+                  (see measurement_dtype)
+        index - structured array with a row for every sample file (see
+                index_dtype)
+
+    """
+    chunks = list(iter_measurements(sample_files(paths), chunk_size))
+    if not chunks:
+        return np.zeros(0, measurement_dtype()), np.zeros(0, index_dtype())
+    records, index = zip(*chunks)
+    return concatenate(records), concatenate(index)
+
+
+def count_measurements(files):
+    """
+    Counts the measurement lines of sample files, one file at a time and
+    without parsing them. Returns the (specimen, path) of the files that
+    could be read and their numbers of lines.
+    """
+    readable, counts = [], []
+    for specimen, path in files:
+        try:
+            counts.append(count_lines(read_data(path)[1]))
+        except IOError as err:
+            sam_log.warning('measurements', 'could not read %s (%s)' %
+                            (path, err), path=path)
+            continue
+        readable.append((specimen, path))
+    return readable, counts
+
+
+def write_measurements(paths, out_file, chunk_size=1000):
+    """
+    DESCRIPTION
+        Writes the measurements of all sample files in paths as
+        read_measurements returns them, one chunk at a time so that memory
+        use does not grow with the archive: to a .csv file, or to the .npy
+        files of the records and the index, which are created at their full
+        size after the lines are counted (see count_measurements) and filled
+        through a memory map.
+
+        @param: paths - .sam files, directories holding them or sample files
+        @param: out_file - .csv file, or .npy file of the records (the index
+                goes to the same name with .index.npy)
+        @param: chunk_size - number of files parsed at a time
+
+    OUTPUT
+        numbers of measurements and specimens written
+
+    """
+    if out_file.lower().endswith('.csv'):
+        names = measurement_dtype().names
+        fmt = ['%s', '%s'] + ['%.6g']*(len(names) - 2)
+        rows, specimens = 0, 0
+        with open(out_file, 'w') as f:
+            f.write(','.join(names) + '\n')
+            for records, index in iter_measurements(sample_files(paths),
+                                                    chunk_size):
+                np.savetxt(f, records, delimiter=',', fmt=fmt)
+                rows += len(records)
+                specimens += len(index)
+        return rows, specimens
+
+    files, counts = count_measurements(sample_files(paths))
+    if files:
+        length = max(len(specimen) for specimen, path in files)
+        path_length = max(len(path) for specimen, path in files)
+        dtypes = measurement_dtype(length), index_dtype(length, path_length)
+    else:
+        # as read_measurements returns them
+        dtypes = measurement_dtype(), index_dtype()
+    root = out_file[:-4] if out_file.lower().endswith('.npy') else out_file
+    records = np.lib.format.open_memmap(root + '.npy', 'w+', dtypes[0],
+                                        (sum(counts),))
+    index = np.lib.format.open_memmap(root + '.index.npy', 'w+', dtypes[1],
+                                      (len(files),))
+    rows, specimens = 0, 0
+    for chunk, chunk_index in iter_measurements(files, chunk_size):
+        if chunk_index['count'].tolist() != \
+                counts[specimens:specimens + len(chunk_index)]:
+            raise ValueError('sample files changed while they were read')
+        records[rows:rows + len(chunk)] = chunk.astype(records.dtype)
+        index[specimens:specimens + len(chunk_index)] = \
+            chunk_index.astype(index.dtype)
+        rows += len(chunk)
+        specimens += len(chunk_index)
+    if specimens != len(files):
+        raise ValueError('sample files changed while they were read')
+    records.flush()
+    index.flush()
+    return rows, specimens
+
+
+def concatenate(arrays):
+    """
+    Concatenates structured arrays whose string fields differ in length.
+    """
+    dtype = np.result_type(*[a.dtype for a in arrays]) if len(arrays) > 1 \
+        else arrays[0].dtype
+    return np.concatenate([a.astype(dtype) for a in arrays])
+
+
+def main():
+    """
+    NAME
+        sam_measurements.py
+
+    DESCRIPTION
+        Reads the measurement lines RAPID has appended to the sample files of
+        any number of sites into a structured NumPy array with a row for
+        every measurement: specimen, demag type and level, the directions,
+        intensity and error angle of the line, the standard deviations and
+        the moment components x, y and z in core coordinates. The index has
+        the file, the byte offset of the first measurement line and the rows
+        of every specimen.
+
+        The arrays are saved as .npy files that np.load(file,
+        mmap_mode='r') maps without reading them into memory. They are
+        written a chunk of files at a time, after the measurement lines of
+        all files are counted, so an archive of any size is converted in
+        constant memory.
+
+    SYNTAX
+        ~/$ python sam_measurements.py archive_directory ... -o FILE [options]
+        ~/$ python sam_measurements.py site/GB20-.sam ... -o FILE [options]
+
+    OPTIONS
+        -o FILE : write the measurements to FILE (.npy, the index goes to
+                  FILE with .index.npy) or to a .csv file
+        -chunk N : number of sample files parsed at a time (default 1000)
+        -q : only print warnings
+
+    """
+    args = sys.argv[1:]
+    out_file, chunk_size = None, 1000
+    verbosity = sam_log.NORMAL
+    if '-q' in args:
+        args.remove('-q')
+        verbosity = sam_log.QUIET
+    if '-chunk' in args:
+        ind = args.index('-chunk')
+        chunk_size = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-o' in args:
+        ind = args.index('-o')
+        out_file = args[ind+1]
+        del args[ind:ind+2]
+    if out_file is None or not args:
+        help(main)
+        sys.exit(1)
+    sam_log.setup_logging(verbosity)
+
+    rows, specimens = write_measurements(args, out_file, chunk_size)
+    sam_log.info('measurements', 'Read %d measurement(s) of %d specimen(s)' %
+                 (rows, specimens), measurements=rows, specimens=specimens,
+                 path=out_file)
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import math
+import tempfile
+import tracemalloc
+import multiprocessing
+import numpy as np
+import pandas as pd
+from sam_format import SampleFormatter
+from sam_validate import check_site
+from sam_summary import site_summary
+from sam_qc import qc_summary
+from mk_sam_utilities import get_field_model, igrf
+import sam_log
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# the stages of mk_sam_file.py main for one site, in order
+STAGES = ['read', 'check', 'calculate', 'write_sam', 'write_samples',
+          'write_csv', 'write_inp', 'summary']
+SIZES = [10, 1000, 100000]
+# sites smaller than this are dominated by fixed costs (imports, the field
+# model coefficients) and are not used for the growth check
+MIN_GROWTH_SIZE = 1000
+# largest growth exponent of the traced peak of a stage between two sizes:
+# 1 is linear, a stage above this grows faster than linearly
+GROWTH_LIMIT = 1.2
+# largest traced peak of a stage per sample (bytes) at the largest size
+PER_SAMPLE_LIMIT = 16384
+# peak resident memory of a run (MB), the field laptops have 8 GB
+RSS_LIMIT = 8192.
+SITE_ID = 'MB01-'
+RESULT_COLUMNS = ['samples', 'stage', 'seconds', 'traced_peak',
+                  'bytes_per_sample', 'rss_peak']
+
+
+def synthetic_template(n, seed=0, sun_fraction=0.5):
+    """
+    DESCRIPTION
+        Makes the text of a site template with n samples of random field
+        readings that pass check_site, a fraction of them with sun compass
+        data.
+
+        @param: n - number of samples
+        @param: seed - seed of the random readings
+        @param: sun_fraction - fraction of samples with sun compass data
+
+    OUTPUT
+        text of a .csv template (see sam_sample_template.csv)
+
+    """
+    rng = np.random.default_rng(seed)
+    template = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'sam_sample_template.csv')
+    with open(template, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    site = [SITE_ID, 'Synthetic site', '%.3f' % rng.uniform(-60., 60.),
+            '%.3f' % rng.uniform(-180., 180.), '%.0f' % rng.uniform(0., 2000.)]
+    for i, value in enumerate(site):
+        items = lines[i + 1].split(',')
+        items[1] = value
+        lines[i + 1] = ','.join(items)
+    columns = lines[6].split(',')
+
+    sun = rng.random(n) < sun_fraction
+    values = {
+        'sample_name': np.char.add(np.arange(1, n + 1).astype(str), 'a'),
+        'strat_level': np.char.mod('%.1f', rng.uniform(0., 100., n)),
+        'magnetic_core_strike': np.char.mod('%.0f', rng.uniform(0., 360., n)),
+        'core_dip': np.char.mod('%.0f', rng.uniform(0., 90., n)),
+        'bedding_strike': np.char.mod('%.0f', rng.uniform(0., 360., n)),
+        'bedding_dip': np.char.mod('%.0f', rng.uniform(0., 60., n)),
+        'correct_bedding_using_local_dec': np.where(rng.random(n) < 0.5,
+                                                    'yes', 'no'),
+        'mass': np.char.mod('%.2f', rng.uniform(5., 15., n))}
+    # every sample has the date (the IGRF needs it), the sun compass
+    # samples the reading and time as well
+    values.update({
+        'GMT_offset': np.full(n, '0'),
+        'year': np.full(n, '2019'),
+        'month': np.char.mod('%d', rng.integers(1, 13, n)),
+        'days': np.char.mod('%d', rng.integers(1, 29, n))})
+    sun_values = {
+        'shadow_angle': np.char.mod('%.1f', rng.uniform(0., 360., n)),
+        'hours': np.char.mod('%d', rng.integers(10, 15, n)),
+        'minutes': np.char.mod('%d', rng.integers(0, 60, n))}
+    for column, value in sun_values.items():
+        values[column] = np.where(sun, value, '')
+    rows = np.full((n, len(columns)), '', dtype=object)
+    for j, column in enumerate(columns):
+        if column in values:
+            rows[:, j] = values[column]
+    body = [','.join(row) for row in rows.tolist()]
+    return '\n'.join(lines[:7] + body) + '\n'
+
+
+def rss_peak():
+    """
+    Returns the peak resident memory of this process (MB) since the last
+    reset_rss_peak, or NaN where it cannot be read.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return float(line.split()[1])/1024.
+    except IOError:
+        pass
+    if resource is None:
+        return math.nan
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    return peak/1024.**2 if sys.platform == 'darwin' else peak/1024.
+
+
+def reset_rss_peak():
+    """
+    Resets the peak resident memory of this process to its current value
+    (Linux only, elsewhere rss_peak stays the peak of the whole run).
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except IOError:
+        pass
+
+
+def profile_site(n, seed=0, trace=True):
+    """
+    DESCRIPTION
+        Runs every stage of mk_sam_file.py main on a synthetic site of n
+        samples, written to a scratch directory, and measures each one.
+
+        @param: n - number of samples
+        @param: seed - seed of the synthetic site
+        @param: trace - measure the Python allocations with tracemalloc
+                (slower), otherwise only the resident memory
+
+    OUTPUT
+        list of (samples, stage, seconds, traced_peak, bytes_per_sample,
+        rss_peak) with the peaks in MB: traced_peak is the peak of the
+        allocations of the stage above what was allocated when it started
+        (NaN without trace), rss_peak the peak of the process
+
+    """
+    # imported here so that the import is not counted in the first stage
+    import mk_sam_file as msf
+    # the field model is loaded and the synthesis compiled once, as in
+    # sam_daemon.warm_up, so that neither is charged to the first stage
+    # that needs them
+    get_field_model()
+    igrf([2020., 0., 45., 0.])
+    sam_log.setup_logging(sam_log.QUIET)
+    formatter = SampleFormatter()
+    results = []
+    with tempfile.TemporaryDirectory() as od:
+        file_name = os.path.join(od, 'site.csv')
+        with open(file_name, 'w', newline='') as f:
+            f.write(synthetic_template(n, seed))
+        state = {}
+        warnings = sam_log.SiteWarnings(SITE_ID)
+
+        def read():
+            msf.fix_line_breaks(file_name)
+            state['hdf'], state['df'], state['sdf'] = msf.read_site(file_name)
+
+        def check():
+            check_site(file_name, state['hdf'], state['df'], state['sdf'],
+                       formatter)
+
+        def calculate():
+            msf.calculate_values(state['hdf'], state['df'], state['sdf'],
+                                 warnings)
+
+        def summary():
+            qc_summary(site_summary(state['hdf'], state['df'], state['sdf']))
+
+        stages = {
+            'read': read, 'check': check, 'calculate': calculate,
+            'write_sam': lambda: msf.write_sam_file(od, state['df'],
+                                                    state['hdf']),
+            'write_samples': lambda: msf.write_sample_files(
+                od, state['df'], state['hdf'], formatter, warnings),
+            'write_csv': lambda: msf.write_csv_file(
+                file_name, od, state['df'], state['sdf'], state['hdf']),
+            'write_inp': lambda: msf.generate_inp_file(od, state['df'],
+                                                       state['hdf']),
+            'summary': summary}
+        if trace:
+            tracemalloc.start()
+        for stage in STAGES:
+            reset_rss_peak()
+            if trace:
+                tracemalloc.reset_peak()
+                # what earlier stages keep (the DataFrames) is not counted
+                kept = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            stages[stage]()
+            seconds = time.perf_counter() - start
+            traced = tracemalloc.get_traced_memory()[1] - kept if trace \
+                else math.nan
+            results.append((n, stage, seconds, traced/1024.**2, traced/n,
+                            rss_peak()))
+        if trace:
+            tracemalloc.stop()
+    return results
+
+
+def run_sizes(sizes, seed=0, trace=True):
+    """
+    Profiles synthetic sites of every size, each in a fresh process so that
+    the resident memory of one does not carry over to the next. Returns a
+    DataFrame with RESULT_COLUMNS.
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for n in sizes:
+        with context.Pool(1) as pool:
+            results += pool.apply(profile_site, (n, seed, trace))
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
+
+def check_results(results, growth_limit=GROWTH_LIMIT,
+                  per_sample_limit=PER_SAMPLE_LIMIT, rss_limit=RSS_LIMIT):
+    """
+    DESCRIPTION
+        Checks the memory of every stage against the limits.
+
+        @param: results - DataFrame from run_sizes
+        @param: growth_limit - largest exponent of the growth of the traced
+                peak between consecutive sizes of at least MIN_GROWTH_SIZE
+        @param: per_sample_limit - largest traced peak per sample (bytes)
+                at the largest size
+        @param: rss_limit - largest peak resident memory (MB)
+
+    OUTPUT
+        list of messages, empty if every stage is within the limits
+
+    """
+    failures = []
+    large = results[results['samples'] >= MIN_GROWTH_SIZE]
+    for stage, rows in large.groupby('stage', sort=False):
+        rows = rows.sort_values('samples')
+        for (n1, peak1), (n2, peak2) in zip(
+                rows[['samples', 'traced_peak']].values[:-1],
+                rows[['samples', 'traced_peak']].values[1:]):
+            if peak1 > 0 and peak2 > 0 and n2 > n1:
+                exponent = math.log(peak2/peak1)/math.log(n2/n1)
+                if exponent > growth_limit:
+                    failures.append('%s: traced peak grows as n^%.2f from %d '
+                                    'to %d samples' % (stage, exponent, n1,
+                                                       n2))
+        # the fixed costs are spread over most samples at the largest size
+        n, per_sample = rows[['samples', 'bytes_per_sample']].values[-1]
+        if per_sample > per_sample_limit:
+            failures.append('%s: %.0f bytes per sample at %d samples' %
+                            (stage, per_sample, n))
+    for n, stage, rss in results[['samples', 'stage', 'rss_peak']].values:
+        if rss > rss_limit:
+            failures.append('%s: peak resident memory %.0f MB at %d samples' %
+                            (stage, rss, n))
+    return failures
+
+
+def main():
+    """
+    NAME
+        sam_memory.py
+
+    DESCRIPTION
+        Measures the memory of every stage of mk_sam_file.py (read, check,
+        calculate, write_sam, write_samples, write_csv, write_inp, summary)
+        on synthetic sites of increasing size: the peak of the Python
+        allocations of the stage (tracemalloc) and the peak resident memory
+        of the process. Every size runs in a fresh process.
+
+        Exits with status 1 if a stage grows faster than linearly (its
+        traced peak grows as more than n^1.2 between sizes of 1000 samples
+        or more), uses more than 16 kB per sample at the largest size, or
+        the process peaks above 8 GB (the field laptops), so it can run with
+        sam_check.py before a change is merged.
+
+        The default sizes take about 15 minutes. A site of 1,000,000
+        samples writes a million sample files and takes hours with
+        tracemalloc; run it with -sizes 1000,1000000 -no-trace for the
+        resident memory only.
+
+    SYNTAX
+        ~/$ python sam_memory.py [options]
+
+    OPTIONS
+        -sizes N[,N] : numbers of samples of the sites (default
+                       10,1000,100000)
+        -seed SEED : seed of the synthetic sites (default 0)
+        -o FILE : also write the measurements to a .csv file
+        -no-trace : only measure the resident memory (tracemalloc slows
+                    the stages down, the growth and per sample checks are
+                    skipped)
+        -growth EXPONENT : growth limit (default 1.2)
+        -max-rss MB : resident memory limit (default 8192)
+
+    """
+    args = sys.argv[1:]
+    sizes, seed, out_file = SIZES, 0, None
+    growth_limit, rss_limit = GROWTH_LIMIT, RSS_LIMIT
+    trace = '-no-trace' not in args
+    if not trace:
+        args.remove('-no-trace')
+    if '-sizes' in args:
+        ind = args.index('-sizes')
+        sizes = [int(size) for size in args[ind+1].split(',')]
+        del args[ind:ind+2]
+    if '-seed' in args:
+        ind = args.index('-seed')
+        seed = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-o' in args:
+        ind = args.index('-o')
+        out_file = args[ind+1]
+        del args[ind:ind+2]
+    if '-growth' in args:
+        ind = args.index('-growth')
+        growth_limit = float(args[ind+1])
+        del args[ind:ind+2]
+    if '-max-rss' in args:
+        ind = args.index('-max-rss')
+        rss_limit = float(args[ind+1])
+        del args[ind:ind+2]
+
+    results = run_sizes(sizes, seed, trace)
+    print('%9s %-14s %9s %12s %12s %10s' % ('samples', 'stage', 'seconds',
+                                             'traced (MB)', 'bytes/sample',
+                                             'RSS (MB)'))
+    for row in results.itertuples(index=False):
+        print('%9d %-14s %9.2f %12.1f %12.0f %10.1f' % tuple(row))
+    if out_file is not None:
+        results.to_csv(out_file, index=False)
+    failures = check_results(results, growth_limit,
+                             PER_SAMPLE_LIMIT if trace else math.inf,
+                             rss_limit)
+    for failure in failures:
+        print('FAILED ' + failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
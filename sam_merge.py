@@ -0,0 +1,126 @@
+import os
+import shutil
+import locale
+import tempfile
+
+# sample files are written with the default encoding of open()
+ENCODING = locale.getpreferredencoding(False)
+# the two header lines are well below this (255 character comment)
+HEAD_BYTES = 1024
+
+
+def read_head(f):
+    """
+    DESCRIPTION
+        Reads the two header lines of an open (binary) sample file.
+
+    OUTPUT
+        head - the header bytes including the line ends
+        rest - offset of the first measurement line
+
+    """
+    f.seek(0)
+    block = f.read(HEAD_BYTES)
+    end = 0
+    for i in range(2):
+        nl = block.find(b'\n', end)
+        if nl == -1:
+            return block, len(block)
+        end = nl + 1
+    return block[:end], end
+
+
+def missing_runs(f, rest, runs):
+    """
+    DESCRIPTION
+        Finds the runs that are not yet measurement lines of an open
+        (binary) sample file, reading from offset rest only until every run
+        is found. The runs written with a file directly follow its header,
+        so checking an up to date file reads about as many lines as it has
+        runs, however many measurements RAPID appended. A file missing a
+        run is read to its end once, before the run is appended.
+
+        @param: f - sample file opened for reading in binary mode
+        @param: rest - offset of the first measurement line (see read_head)
+        @param: runs - list of measurement lines without line breaks
+
+    OUTPUT
+        missing - the runs that are not in the file, in the order of runs
+        line_end - whether the file ends with a line break
+
+    """
+    wanted = set(runs)
+    f.seek(rest)
+    for line in f:
+        if not wanted:
+            break
+        wanted.discard(line.rstrip(b'\r\n'))
+    f.seek(0, os.SEEK_END)
+    if f.tell() == 0:
+        line_end = True
+    else:
+        f.seek(-1, os.SEEK_END)
+        line_end = f.read(1) == b'\n'
+    return [run for run in runs if run in wanted], line_end
+
+
+def merge_sample_file(path, head, runs):
+    """
+    DESCRIPTION
+        Brings an existing sample file up to date without rewriting the
+        measurements RAPID has appended to it.
+
+        The header lines are replaced in place when the new ones have the
+        same length (the orientation line is fixed width, so only a changed
+        comment forces a rewrite of the file). Runs that are not already one
+        of the measurement lines of the file are appended, wherever RAPID
+        put them; a file that does not end with a line break gets one before
+        the runs. Only the measurement lines up to the last run found are
+        read, all of them if a run is missing (see missing_runs).
+
+        @param: path - path of the sample file
+        @param: head - the two '\r\n' terminated header lines
+        @param: runs - list of measurement lines from the template
+
+    OUTPUT
+        (header, appended) where header is 'unchanged', 'in place' or
+        'rewritten' and appended is the number of runs added
+
+    """
+    head = head.encode(ENCODING)
+    runs = [run.rstrip('\r\n').encode(ENCODING) for run in runs
+            if run.strip() != '']
+    with open(path, 'r+b') as f:
+        old_head, rest = read_head(f)
+        if old_head == head:
+            header = 'unchanged'
+        elif len(old_head) == len(head):
+            f.seek(0)
+            f.write(head)
+            header = 'in place'
+        else:
+            header = 'rewritten'
+
+        new_runs, line_end = missing_runs(f, rest, runs)
+        if new_runs and header != 'rewritten':
+            f.seek(0, os.SEEK_END)
+            if not line_end:
+                f.write(b'\r\n')
+            f.write(b''.join(run + b'\r\n' for run in new_runs))
+
+    if header == 'rewritten':
+        # the header changed length, copy the measurements behind it
+        directory = os.path.split(path)[0] or '.'
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as out, open(path, 'rb') as f:
+            out.write(head)
+            f.seek(rest)
+            shutil.copyfileobj(f, out)
+            if new_runs:
+                out.seek(0, os.SEEK_END)
+                if out.tell() > len(head) and not line_end:
+                    out.write(b'\r\n')
+                out.write(b''.join(run + b'\r\n' for run in new_runs))
+        shutil.copymode(path, tmp)
+        os.replace(tmp, path)
+    return header, len(new_runs)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+from mk_sam_utilities import FIELD_MODEL, get_field_model, igrf_array, \
+    to_year_fraction_array
+from mk_sam_file import read_site, sample_heads, write_csv_file
+from sam_format import SampleFormatter
+from sam_merge import read_head, merge_sample_file, ENCODING
+from sam_validate import first_reading
+import sam_log
+
+DELTA_COLUMNS = ['site_id', 'sample_name', 'IGRF_local_dec_old',
+                 'IGRF_local_dec_new', 'dec_delta', 'core_strike_old',
+                 'core_strike_new', 'corrected_bedding_strike_old',
+                 'corrected_bedding_strike_new', 'rewritten']
+
+
+def find_sites(paths):
+    """
+    Returns the site .csv files written by mk_sam_file.py in paths: .csv
+    files are taken as they are, directories are searched (recursively) for
+    .sam files with a .csv of the same site next to them.
+    """
+    csv_files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            csv_files.append(path)
+            continue
+        for directory, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                root, ext = os.path.splitext(name)
+                if ext == '.sam' and root + '.csv' in files:
+                    csv_files.append(os.path.join(directory, root + '.csv'))
+    return csv_files
+
+
+def to_float(values):
+    return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').values
+
+
+def recompute_declinations(sites, field_model=None):
+    """
+    DESCRIPTION
+        Recalculates the IGRF declination of every sample of any number of
+        sites in one batch and the core and bedding strikes that depend on
+        it: core_strike of samples oriented with the magnetic compass only
+        and corrected_bedding_strike where the bedding is corrected.
+
+        @param: sites - list of (file_name, hdf, df, sdf) of written sites
+                (see read_site)
+        @param: field_model - optional result of get_field_model()
+
+    OUTPUT
+        list of DataFrames, one per site, with the old and new values of
+        every sample (DELTA_COLUMNS without rewritten) and the new
+        calculated_IGRF as [dec, inc, f]
+
+    """
+    blocks = []
+    for file_name, hdf, df, sdf in sites:
+        site = hdf['site_info']
+        t = sdf.transpose()
+        s = df.transpose()
+        block = pd.DataFrame({'site_id': site['site_id'],
+                              'sample_name': list(df.keys())})
+        for column in ['year', 'month', 'days', 'hours', 'minutes']:
+            block[column] = [first_reading(value) for value in t[column]]
+        for column in ['site_lat', 'site_long', 'site_elevation']:
+            block[column] = float(site[column])
+        for column in ['sun_core_strike', 'magnetic_core_strike',
+                       'bedding_strike', 'IGRF_local_dec', 'core_strike',
+                       'corrected_bedding_strike']:
+            block[column] = to_float(s[column])
+        blocks.append(block)
+    samples = pd.concat(blocks, ignore_index=True)
+
+    elevation = np.nan_to_num(samples['site_elevation'].values)
+    dates = to_year_fraction_array(samples['year'].values,
+                                   samples['month'].values,
+                                   samples['days'].values,
+                                   samples['hours'].values,
+                                   samples['minutes'].values)
+    dec, inc, f = igrf_array(dates, elevation/1000., samples['site_lat'].values,
+                             samples['site_long'].values,
+                             field_model=field_model)
+    local_dec = np.where(dec > 180, dec - 360, dec)
+
+    mag_only = np.isnan(samples['sun_core_strike'].values) & \
+        ~np.isnan(samples['magnetic_core_strike'].values)
+    core_strike = samples['magnetic_core_strike'].values + local_dec
+    core_strike = np.where(core_strike < 0, core_strike + 360, core_strike)
+    core_strike = np.where(mag_only, core_strike, samples['core_strike'].values)
+    corrected = ~np.isnan(samples['corrected_bedding_strike'].values)
+    bedding = np.where(corrected, samples['bedding_strike'].values + local_dec,
+                       np.nan)
+
+    deltas = pd.DataFrame({
+        'site_id': samples['site_id'],
+        'sample_name': samples['sample_name'],
+        'IGRF_local_dec_old': samples['IGRF_local_dec'],
+        'IGRF_local_dec_new': local_dec,
+        'dec_delta': local_dec - samples['IGRF_local_dec'].values,
+        'core_strike_old': samples['core_strike'],
+        'core_strike_new': core_strike,
+        'corrected_bedding_strike_old': samples['corrected_bedding_strike'],
+        'corrected_bedding_strike_new': bedding})
+    deltas['calculated_IGRF'] = [[d, i, ff] for d, i, ff in zip(dec, inc, f)]
+    ends = np.cumsum([len(block) for block in blocks])
+    return [deltas.iloc[end - len(block):end].reset_index(drop=True)
+            for block, end in zip(blocks, ends)]
+
+
+def migrate_site(file_name, hdf, df, sdf, deltas, formatter=None,
+                 dry_run=False):
+    """
+    DESCRIPTION
+        Brings the files of a written site up to date with recomputed
+        declinations. The sample header lines are rendered as mk_sam_file.py
+        would and compared with the files; only sample files whose header
+        changes at the precision of the SAM format are updated (in place,
+        keeping any measurements) and the site .csv is only rewritten if
+        any sample changed.
+
+        @param: file_name - path of the site .csv written by mk_sam_file.py
+        @param: hdf, df, sdf - the site read with read_site(file_name)
+        @param: deltas - DataFrame of the site from recompute_declinations
+        @param: formatter - SampleFormatter for the sample files
+        @param: dry_run - only find the files that would change
+
+    OUTPUT
+        deltas with the rewritten column added
+
+    """
+    if formatter is None:
+        formatter = SampleFormatter()
+    directory = os.path.split(file_name)[0]
+    site_id = hdf['site_info']['site_id']
+    for i, sample in enumerate(df.keys()):
+        df[sample]['calculated_IGRF'] = deltas['calculated_IGRF'][i]
+        df[sample]['IGRF_local_dec'] = deltas['IGRF_local_dec_new'][i]
+        df[sample]['core_strike'] = deltas['core_strike_new'][i]
+        df[sample]['corrected_bedding_strike'] = \
+            deltas['corrected_bedding_strike_new'][i]
+    heads = sample_heads(df, hdf, formatter, sam_log.SiteWarnings(site_id))[0]
+
+    rewritten = []
+    for head, sample in zip(heads, df.keys()):
+        path = os.path.join(directory, site_id + str(sample))
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                old_head = read_head(f)[0]
+            changed = old_head != head.encode(ENCODING)
+        else:
+            changed = True
+        rewritten.append(changed)
+        if changed and not dry_run:
+            if os.path.exists(path):
+                merge_sample_file(path, head, [])
+            else:
+                with open(path, 'w+') as f:
+                    f.write(head)
+            sam_log.debug('write', 'Updating file - ' + path, path=path)
+    if any(rewritten) and not dry_run:
+        write_csv_file(file_name, directory, df, sdf, hdf)
+
+    deltas = deltas[DELTA_COLUMNS[:-1]].copy()
+    deltas['rewritten'] = rewritten
+    return deltas
+
+
+def main():
+    """
+    NAME
+        sam_migrate.py
+
+    DESCRIPTION
+        Re-orients an archive of written sites under the field model that
+        mk_sam_utilities.py currently loads (e.g. after updating to a new
+        IGRF generation). The IGRF declination of every sample is
+        recalculated in one batch, and with it the core strikes of samples
+        oriented with the magnetic compass only and the corrected bedding
+        strikes. Only the sample and .csv files whose values change at the
+        0.1 degree precision of the SAM format are rewritten; measurements
+        in the sample files are kept.
+
+    SYNTAX
+        ~/$ python sam_migrate.py archive_directory ... [options]
+        ~/$ python sam_migrate.py site_output/GB20-.csv ... [options]
+
+    OPTIONS
+        -o FILE : write the old and new values of every sample to a .csv file
+        -n : dry run, only report what would change
+        -v : list every file updated
+        -q : only print warnings
+
+    """
+    args = sys.argv[1:]
+    out_file = None
+    verbosity = sam_log.NORMAL
+    dry_run = '-n' in args
+    if dry_run:
+        args.remove('-n')
+    if '-v' in args:
+        args.remove('-v')
+        verbosity = sam_log.VERBOSE
+    if '-q' in args:
+        args.remove('-q')
+        verbosity = sam_log.QUIET
+    if '-o' in args:
+        ind = args.index('-o')
+        out_file = args[ind+1]
+        del args[ind:ind+2]
+    sam_log.setup_logging(verbosity)
+
+    sites = [(file_name,) + read_site(file_name)
+             for file_name in find_sites(args)]
+    if not sites:
+        sam_log.warning('migrate', 'no written sites found')
+        return
+    site_deltas = recompute_declinations(sites, get_field_model())
+
+    formatter = SampleFormatter()
+    reports, changed_sites = [], 0
+    for (file_name, hdf, df, sdf), deltas in zip(sites, site_deltas):
+        deltas = migrate_site(file_name, hdf, df, sdf, deltas, formatter,
+                              dry_run)
+        site_id = hdf['site_info']['site_id']
+        n_changed = int(deltas['rewritten'].sum())
+        sam_log.info('migrate_site', '%s: %d of %d sample(s) change, '
+                     'declination changed by up to %.2f degrees' %
+                     (site_id, n_changed, len(deltas),
+                      np.nanmax(np.abs(deltas['dec_delta'].values))),
+                     site_id=site_id, path=file_name, changed=n_changed,
+                     samples=len(deltas),
+                     dec_delta_max=np.nanmax(np.abs(deltas['dec_delta'].values)))
+        reports.append(deltas)
+        changed_sites += n_changed > 0
+    report = pd.concat(reports, ignore_index=True)
+    sam_log.info('migrate', '%s %d sample file(s) of %d site(s) to %s, %d '
+                 'site(s) unchanged' %
+                 ('Would update' if dry_run else 'Updated',
+                  report['rewritten'].sum(), changed_sites, FIELD_MODEL,
+                  len(sites) - changed_sites),
+                 samples=int(report['rewritten'].sum()),
+                 sites=changed_sites, field_model=FIELD_MODEL,
+                 dry_run=dry_run)
+    if out_file is not None:
+        report.to_csv(out_file, index=False)
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+from sam_merge import read_head, ENCODING
+from sam_measurements import read_measurements
+import sam_log
+
+# columns of the orientation line of a sample file (see SAM_file_format.pdf)
+HEAD_FIELDS = [('strat_level', 1, 7), ('core_strike', 8, 13),
+               ('core_dip', 14, 19), ('bedding_strike', 20, 25),
+               ('bedding_dip', 26, 31), ('mass', 32, 37)]
+# differences (degrees) between the recorded and recalculated directions
+# that are reported, the directions are written with 0.1 degree precision
+TOLERANCE = 0.2
+
+
+def dir2cart_array(dec, inc, intensity=1.):
+    """
+    Returns the (..., 3) cartesian coordinates of directions.
+    """
+    rad = np.pi/180.
+    dec, inc, intensity = np.broadcast_arrays(
+        *[np.asarray(v, dtype=float) for v in [dec, inc, intensity]])
+    return np.stack([intensity*np.cos(inc*rad)*np.cos(dec*rad),
+                     intensity*np.cos(inc*rad)*np.sin(dec*rad),
+                     intensity*np.sin(inc*rad)], axis=-1)
+
+
+def cart2dir_array(xyz):
+    """
+    Returns the declinations, inclinations and lengths of (..., 3)
+    cartesian vectors.
+    """
+    xyz = np.asarray(xyz, dtype=float)
+    r = np.sqrt(np.sum(xyz*xyz, axis=-1))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        inc = np.degrees(np.arcsin(np.clip(xyz[..., 2]/r, -1., 1.)))
+    dec = np.degrees(np.arctan2(xyz[..., 1], xyz[..., 0])) % 360.
+    return dec, inc, r
+
+
+def sample_matrices(core_strike, core_dip, declination=0.):
+    """
+    DESCRIPTION
+        Builds the rotations from core to geographic coordinates. The core
+        strike and dip are the CIT ones of the core plate: the x axis (the
+        scratch) points to core_strike - 90 and plunges -core_dip, y is
+        horizontal along core_strike (as PmagPy's dogeo with the azimuth and
+        plunge cit_magic writes).
+
+        @param: core_strike, core_dip - arrays (or numbers) in degrees
+        @param: declination - magnetic declination added to the strikes, the
+                value of the .sam file (0 for the files of mk_sam_file.py,
+                their strikes are corrected already)
+
+    OUTPUT
+        (N, 3, 3) array whose columns are the x, y and z axes of each core
+        in geographic coordinates
+
+    """
+    core_strike, core_dip, declination = np.broadcast_arrays(
+        *[np.atleast_1d(np.asarray(v, dtype=float))
+          for v in [core_strike, core_dip, declination]])
+    azimuth = core_strike + declination - 90.
+    plunge = -core_dip
+    return np.stack([dir2cart_array(azimuth, plunge),
+                     dir2cart_array(azimuth + 90., 0.),
+                     dir2cart_array(azimuth - 180., 90. - plunge)], axis=-1)
+
+
+def tilt_matrices(bedding_strike, bedding_dip, declination=0.):
+    """
+    DESCRIPTION
+        Builds the rotations from geographic to stratigraphic (tilt
+        corrected) coordinates, rotating the bedding back to horizontal
+        about its strike (as PmagPy's dotilt).
+
+        @param: bedding_strike, bedding_dip - arrays (or numbers) in degrees,
+                right-hand rule
+        @param: declination - magnetic declination added to the strikes
+
+    OUTPUT
+        (N, 3, 3) array
+
+    """
+    bedding_strike, bedding_dip, declination = np.broadcast_arrays(
+        *[np.atleast_1d(np.asarray(v, dtype=float))
+          for v in [bedding_strike, bedding_dip, declination]])
+    rad = np.pi/180.
+    dip_direction = (bedding_strike + declination + 90.)*rad
+    sa, ca = -np.sin(dip_direction), np.cos(dip_direction)
+    cdp, sdp = np.cos(bedding_dip*rad), np.sin(bedding_dip*rad)
+    return np.stack([
+        np.stack([sa*sa + ca*ca*cdp, ca*sa*(1. - cdp), sdp*ca], axis=-1),
+        np.stack([ca*sa*(1. - cdp), ca*ca + sa*sa*cdp, -sa*sdp], axis=-1),
+        np.stack([-ca*sdp, sdp*sa, cdp], axis=-1)], axis=-2)
+
+
+def rotate(matrices, xyz):
+    """
+    Applies (N, 3, 3) rotations to (N, 3) vectors (N can be 1 for either).
+    """
+    return np.einsum('...ij,...j->...i', matrices, xyz)
+
+
+def reorient(dec, inc, core_strike, core_dip, bedding_strike, bedding_dip,
+             declination=0.):
+    """
+    DESCRIPTION
+        Rotates directions measured in core coordinates to geographic and
+        stratigraphic coordinates, every direction with the orientation of
+        its own sample.
+
+        @param: dec, inc - directions in core coordinates, arrays or numbers
+        @param: core_strike, core_dip - orientation of the core of every
+                direction
+        @param: bedding_strike, bedding_dip - bedding of every direction
+        @param: declination - magnetic declination added to the strikes
+
+    OUTPUT
+        dec_geo, inc_geo, dec_strat, inc_strat arrays (of one element for
+        numbers)
+
+    """
+    geo = rotate(sample_matrices(core_strike, core_dip, declination),
+                 dir2cart_array(np.atleast_1d(dec), np.atleast_1d(inc)))
+    strat = rotate(tilt_matrices(bedding_strike, bedding_dip, declination),
+                   geo)
+    dec_geo, inc_geo = cart2dir_array(geo)[:2]
+    dec_strat, inc_strat = cart2dir_array(strat)[:2]
+    return dec_geo, inc_geo, dec_strat, inc_strat
+
+
+def sam_declinations(directory):
+    """
+    Returns the magnetic declination of every specimen listed in the .sam
+    files of a directory.
+    """
+    declinations = {}
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith('.sam'):
+            continue
+        with open(os.path.join(directory, name), encoding=ENCODING,
+                  errors='replace') as f:
+            lines = f.read().splitlines()
+        if lines and lines[0].strip() in ['CIT', '2G', 'APP', 'JRA']:
+            lines = lines[1:]
+        try:
+            declination = float(lines[1].split()[2])
+        except (IndexError, ValueError):
+            declination = 0.
+        for line in lines[2:]:
+            if line.strip() != '':
+                declinations[line.split()[0]] = declination
+    return declinations
+
+
+def read_orientations(index):
+    """
+    DESCRIPTION
+        Reads the orientation line of every sample file of an index (see
+        sam_measurements.read_measurements) and the declination of its .sam
+        file.
+
+    OUTPUT
+        DataFrame with the specimen, HEAD_FIELDS and declination
+
+    """
+    rows, declinations = [], {}
+    for specimen, path in zip(index['specimen'], index['path']):
+        directory = os.path.split(path)[0] or '.'
+        if directory not in declinations:
+            declinations[directory] = sam_declinations(directory)
+        with open(path, 'rb') as f:
+            head = read_head(f)[0].decode(ENCODING, errors='replace')
+        lines = head.splitlines()
+        line = lines[1] if len(lines) > 1 else ''
+        row = {'specimen': specimen,
+               'declination': declinations[directory].get(specimen, 0.)}
+        for field, start, end in HEAD_FIELDS:
+            try:
+                row[field] = float(line[start:end])
+            except ValueError:
+                row[field] = np.nan
+        rows.append(row)
+    return pd.DataFrame(rows, columns=['specimen'] +
+                        [field for field, start, end in HEAD_FIELDS] +
+                        ['declination'])
+
+
+def check_measurements(records, index):
+    """
+    DESCRIPTION
+        Recalculates the geographic and stratigraphic directions of
+        measurements from their core coordinates and the orientation lines
+        of the sample files.
+
+        @param: records, index - from sam_measurements.read_measurements
+
+    OUTPUT
+        DataFrame with a row for every measurement: specimen, step, the
+        recorded and recalculated directions and the angles between them
+
+    """
+    orientations = read_orientations(index)
+    rows = np.repeat(np.arange(len(index)), index['count'])
+    sample = orientations.iloc[rows]
+    dec_geo, inc_geo, dec_strat, inc_strat = reorient(
+        records['dec_core'], records['inc_core'],
+        sample['core_strike'].values, sample['core_dip'].values,
+        sample['bedding_strike'].values, sample['bedding_dip'].values,
+        sample['declination'].values)
+    check = pd.DataFrame({'specimen': records['specimen'],
+                          'step_type': records['step_type'],
+                          'step': records['step'],
+                          'dec_geo': records['dec_geo'],
+                          'inc_geo': records['inc_geo'],
+                          'dec_geo_new': dec_geo, 'inc_geo_new': inc_geo,
+                          'dec_strat': records['dec_strat'],
+                          'inc_strat': records['inc_strat'],
+                          'dec_strat_new': dec_strat,
+                          'inc_strat_new': inc_strat})
+    for name in ['geo', 'strat']:
+        old = dir2cart_array(check['dec_' + name].values,
+                             check['inc_' + name].values)
+        new = dir2cart_array(check['dec_%s_new' % name].values,
+                             check['inc_%s_new' % name].values)
+        cos = np.clip(np.sum(old*new, axis=-1), -1., 1.)
+        check['angle_' + name] = np.degrees(np.arccos(cos))
+    return check
+
+
+def main():
+    """
+    NAME
+        sam_orient.py
+
+    DESCRIPTION
+        Checks the orientations of the measurements in sample files: every
+        measurement is rotated from core coordinates to geographic and
+        stratigraphic coordinates with the orientation line of its sample
+        file (all samples at once, with (N, 3, 3) rotation matrices) and
+        compared with the directions recorded in the file. Specimens whose
+        recorded directions differ by more than the tolerance were measured
+        with another orientation than the one in their file, e.g. because
+        the file was re-oriented after the measurements.
+
+        From python, sample_matrices and tilt_matrices return the rotation
+        matrices and reorient applies them to arrays of directions.
+
+    SYNTAX
+        ~/$ python sam_orient.py archive_directory ... [options]
+        ~/$ python sam_orient.py site/GB20-.sam ... [options]
+
+    OPTIONS
+        -o FILE : write the recorded and recalculated directions of every
+                  measurement to a .csv file
+        -tol DEGREES : difference that is reported (default 0.2)
+        -q : only print warnings
+
+    """
+    args = sys.argv[1:]
+    out_file, tolerance = None, TOLERANCE
+    verbosity = sam_log.NORMAL
+    if '-q' in args:
+        args.remove('-q')
+        verbosity = sam_log.QUIET
+    if '-o' in args:
+        ind = args.index('-o')
+        out_file = args[ind+1]
+        del args[ind:ind+2]
+    if '-tol' in args:
+        ind = args.index('-tol')
+        tolerance = float(args[ind+1])
+        del args[ind:ind+2]
+    sam_log.setup_logging(verbosity)
+
+    records, index = read_measurements(args)
+    check = check_measurements(records, index)
+    if out_file is not None:
+        check.to_csv(out_file, index=False)
+    worst = check.groupby('specimen', sort=False)[['angle_geo',
+                                                   'angle_strat']].max()
+    off = worst[(worst > tolerance).any(axis=1)]
+    for specimen, angles in off.iterrows():
+        sam_log.warning('orientation', '%s: recorded directions differ by up '
+                        'to %.1f degrees (geographic) and %.1f degrees '
+                        '(stratigraphic) from its orientation line' %
+                        (specimen, angles['angle_geo'], angles['angle_strat']),
+                        specimen=specimen, angle_geo=angles['angle_geo'],
+                        angle_strat=angles['angle_strat'])
+    sam_log.info('orientation', 'Checked %d measurement(s) of %d specimen(s), '
+                 '%d specimen(s) differ by more than %g degrees' %
+                 (len(check), len(index), len(off), tolerance),
+                 measurements=len(check), specimens=len(index),
+                 differ=len(off))
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
@@ -0,0 +1,156 @@
+import queue
+import threading
+import collections
+
+# items a stage may hold ahead of the next one
+DEPTH = 2
+# seconds between checks whether a blocked stage was stopped
+POLL = 0.1
+
+
+def prefetch(function, items, depth=DEPTH):
+    """
+    DESCRIPTION
+        Applies function to every item in a background thread, at most
+        depth results ahead of the consumer, e.g. to read the next file
+        while the current one is processed. The items are iterated in the
+        background thread as well, so they may be a generator that reads.
+
+        @param: function - called with every item
+        @param: items - iterable of the items
+        @param: depth - results held before the thread waits
+
+    OUTPUT
+        generator of function(item) in the order of the items; an exception
+        of function or of the items is raised by the generator
+
+    """
+    results = queue.Queue(depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(value):
+        while not stop.is_set():
+            try:
+                results.put(value, timeout=POLL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((function(item), None)):
+                    return
+        except BaseException as err:
+            put((None, err))
+            return
+        put((done, None))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            value, err = results.get()
+            if err is not None:
+                raise err
+            if value is done:
+                return
+            yield value
+    finally:
+        stop.set()
+        thread.join()
+
+
+def bounded_imap(pool, function, items, window):
+    """
+    DESCRIPTION
+        Like pool.imap but with at most window items submitted and not yet
+        consumed, so a slow consumer holds back the pool instead of
+        collecting its results.
+
+        @param: pool - multiprocessing pool, or None to call function here
+        @param: window - items in flight, at least the number of processes
+                to keep them busy
+
+    OUTPUT
+        generator of function(item) in the order of the items
+
+    """
+    if pool is None:
+        for item in items:
+            yield function(item)
+        return
+    pending = collections.deque()
+    for item in items:
+        pending.append(pool.apply_async(function, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+class Sink(object):
+    """
+    DESCRIPTION
+        Runs function on the items submitted to it in a background thread,
+        e.g. to write the files of one site while the next one is
+        calculated. submit blocks while depth items are waiting, so the
+        producer cannot run away from a slow sink. If function raises, the
+        remaining items are dropped and the exception is raised by the next
+        submit or by close.
+
+    SYNTAX
+        with Sink(write, depth=2) as sink:
+            for item in items:
+                sink.submit(item)
+
+    """
+
+    def __init__(self, function, depth=DEPTH):
+        self.function = function
+        self.items = queue.Queue(depth)
+        self.error = None
+        self.thread = threading.Thread(target=self.consume, daemon=True)
+        self.thread.start()
+
+    def consume(self):
+        while True:
+            item = self.items.get()
+            if item is self.items:
+                return
+            if self.error is None:
+                try:
+                    self.function(item)
+                except BaseException as err:
+                    self.error = err
+
+    def submit(self, item):
+        if self.error is not None:
+            raise self.error
+        self.items.put(item)
+
+    def close(self):
+        """
+        Waits until every item is done and raises the error of function,
+        if any.
+        """
+        if self.thread.is_alive():
+            # the queue itself marks the end of the items
+            self.items.put(self.items)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        if kind is None:
+            self.close()
+        elif self.thread.is_alive():
+            # an error of the producer: finish what was submitted and stop
+            self.items.put(self.items)
+            self.thread.join()
+        return False
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+import pandas as pd
+from mk_sam_utilities import sundec_array
+from sam_summary import MISMATCH_LIMIT, read_summary, summary_readings
+import sam_log
+
+# scale turning a median absolute deviation into a standard deviation
+MAD_SCALE = 1.4826
+# samples further than OUTLIER_CUT robust standard deviations from the site
+# mean declination are flagged as outliers
+OUTLIER_CUT = 3.
+# lower bound of the robust spread (degrees) so that a tightly grouped site
+# does not flag every sample that is a degree off
+MIN_SPREAD = 1.
+# whole hour errors of GMT_offset tried when looking for systematic errors
+GMT_SHIFTS = [-3, -2, -1, 1, 2, 3]
+
+QC_COLUMNS = ['site_id', 'n_pairs', 'dec_mean', 'dec_R', 'dec_circular_std',
+              'dec_mad', 'igrf_dec_mean', 'dec_offset', 'n_outliers',
+              'suspected', 'suspected_residual', 'passed']
+
+
+def wrap180(angles):
+    """
+    wraps angles (degrees) into [-180, 180)
+    """
+    return (np.asarray(angles, dtype=float) + 180.) % 360. - 180.
+
+
+def circular_mean(angles, codes, n_groups):
+    """
+    DESCRIPTION
+        Circular mean of angles by group, ignoring NaN values.
+
+        @param: angles - array of angles in degrees
+        @param: codes - array of group numbers (0 to n_groups-1)
+        @param: n_groups - number of groups
+
+    OUTPUT
+        mean - mean direction of each group in degrees (-180 to 180)
+        R - mean resultant length of each group (0 to 1)
+        n - number of angles in each group
+
+    """
+    angles = np.asarray(angles, dtype=float)
+    valid = ~np.isnan(angles)
+    rad = np.radians(angles[valid])
+    codes = np.asarray(codes)[valid]
+    n = np.bincount(codes, minlength=n_groups)
+    C = np.bincount(codes, np.cos(rad), minlength=n_groups)
+    S = np.bincount(codes, np.sin(rad), minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.degrees(np.arctan2(S, C))
+        R = np.hypot(C, S) / n
+    mean[n == 0] = np.nan
+    return mean, R, n
+
+
+def reading_mean(angles, codes, n_groups):
+    """
+    Circular mean of the readings of every sample as
+    mk_sam_file.sun_core_strikes averages them: a single reading is kept as
+    it is, NaN readings are ignored.
+    """
+    angles = np.asarray(angles, dtype=float)
+    codes = np.asarray(codes)
+    mean, R, n = circular_mean(angles, codes, n_groups)
+    single = (n == 1)[codes] & ~np.isnan(angles)
+    mean[codes[single]] = angles[single]
+    return mean
+
+
+def group_median(values, codes, n_groups):
+    """
+    Median of values by group, ignoring NaN values (NaN for empty groups).
+    """
+    return pd.Series(values).groupby(np.asarray(codes)).median() \
+        .reindex(range(n_groups)).values
+
+
+def candidate_residuals(summary):
+    """
+    DESCRIPTION
+        Recalculates the sun compass declination of every sample under a set
+        of hypotheses about systematic field errors and returns the residual
+        against the IGRF declination for each. Every reading is recalculated
+        (see sam_summary.summary_readings) and the residuals of the readings
+        of a sample are averaged with reading_mean.
+
+        @param: summary - table from sam_summary.site_summary
+
+    OUTPUT
+        names - list of hypotheses, the first one being the data as entered
+        residuals - (hypotheses x samples) array of
+                    sun strike - magnetic strike - IGRF declination in
+                    degrees (-180 to 180), NaN where there is no sun/mag pair
+
+    """
+    names = ['nominal'] + ['GMT_offset changed by %+d h' % shift
+                           for shift in GMT_SHIFTS]
+    shifts = np.array([0] + GMT_SHIFTS + [0], dtype=float)[:, None]
+    clockwise = np.zeros(shifts.shape, dtype=bool)
+    clockwise[-1] = True
+    names.append('clockwise sun compass')
+
+    summary = summary.reset_index(drop=True)
+    readings = summary_readings(summary)
+    codes = readings['sample'].values
+
+    def value(column):
+        return summary[column].values.astype(float)[codes]
+
+    shadow = readings['shadow_angle'].values[None, :]
+    shadow = np.where(clockwise, (360. - shadow) % 360., shadow)
+    strikes = sundec_array(readings['year'].values, readings['month'].values,
+                           readings['days'].values, readings['hours'].values,
+                           readings['minutes'].values,
+                           readings['GMT_offset'].values + shifts,
+                           value('site_lat'), value('site_long'), shadow)
+    residuals = wrap180(strikes - value('magnetic_core_strike') -
+                        value('IGRF_local_dec'))
+    return names, np.array([wrap180(reading_mean(r, codes, len(summary)))
+                            for r in residuals])
+
+
+def qc_summary(summary, limit=MISMATCH_LIMIT, cut=OUTLIER_CUT):
+    """
+    DESCRIPTION
+        Checks the declinations calculated from sun and magnetic compass
+        pairs of any number of sites at once.
+
+        For every site the circular mean, mean resultant length, circular
+        standard deviation and median absolute deviation (MAD) of the
+        calculated declinations are found. Samples further than cut robust
+        standard deviations (MAD * 1.4826) from the site mean are outliers.
+
+        The sun compass readings are also recalculated with GMT_offset off by
+        whole hours and as clockwise sun compass readings; if one of these
+        brings the median residual against IGRF within limit while the data
+        as entered are not, it is reported as suspected.
+
+        A site passes when its mean offset from IGRF is within limit and
+        nothing is suspected. Sites without sun/mag pairs pass.
+
+        @param: summary - table from sam_summary.site_summary (or several
+                concatenated)
+        @param: limit - allowed difference from IGRF in degrees
+        @param: cut - outlier cut in robust standard deviations
+
+    OUTPUT
+        sites - DataFrame with QC_COLUMNS, one row per site
+        samples - copy of summary with dec_deviation (from the site mean)
+                  and dec_outlier columns added
+
+    """
+    summary = summary.reset_index(drop=True)
+    codes, site_ids = pd.factorize(summary['site_id'])
+    n_sites = len(site_ids)
+    dec = pd.to_numeric(summary['calculated_mag_dec'], errors='coerce').values
+    igrf = summary['IGRF_local_dec'].values
+
+    mean, R, n = circular_mean(dec, codes, n_sites)
+    deviation = wrap180(dec - mean[codes])
+    mad = group_median(np.abs(deviation), codes, n_sites)
+    spread = np.maximum(MAD_SCALE * mad, MIN_SPREAD)
+    outlier = np.abs(deviation) > cut * spread[codes]
+    offset = circular_mean(wrap180(dec - igrf), codes, n_sites)[0]
+    igrf_mean = circular_mean(igrf, codes, n_sites)[0]
+
+    names, residuals = candidate_residuals(summary)
+    fits = np.array([group_median(np.abs(r), codes, n_sites)
+                     for r in residuals])
+    best = np.argmin(np.where(np.isnan(fits), np.inf, fits), axis=0)
+    best_fit = fits[best, np.arange(n_sites)]
+    suspect = (best != 0) & (fits[0] > limit) & (best_fit <= limit)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        circular_std = np.degrees(np.sqrt(-2. * np.log(R)))
+    sites = pd.DataFrame({'site_id': site_ids,
+                          'n_pairs': n,
+                          'dec_mean': mean,
+                          'dec_R': R,
+                          'dec_circular_std': circular_std,
+                          'dec_mad': mad,
+                          'igrf_dec_mean': igrf_mean,
+                          'dec_offset': offset,
+                          'n_outliers': np.bincount(codes, outlier,
+                                                    minlength=n_sites).astype(int),
+                          'suspected': np.where(suspect,
+                                                np.array(names)[best], ''),
+                          'suspected_residual': np.where(suspect, best_fit,
+                                                         np.nan)})
+    sites['passed'] = (n == 0) | ((np.abs(offset) <= limit) & ~suspect)
+
+    samples = summary.copy()
+    samples['dec_deviation'] = deviation
+    samples['dec_outlier'] = outlier
+    return sites[QC_COLUMNS], samples
+
+
+def log_qc(sites, samples, limit=MISMATCH_LIMIT):
+    """
+    Logs the results of qc_summary: one line per site and a warning for each
+    site with outliers, a suspected systematic error or a failed check.
+    """
+    for site in sites.itertuples(index=False):
+        fields = dict(site._asdict())
+        if site.n_pairs == 0:
+            sam_log.info('qc_site', '%s has no sun/mag compass pairs' %
+                         site.site_id, **fields)
+            continue
+        sam_log.info('qc_site', '%s calculated declination %+.1f (circular '
+                     'std %.1f, %d pairs), IGRF %+.1f' %
+                     (site.site_id, site.dec_mean, site.dec_circular_std,
+                      site.n_pairs, site.igrf_dec_mean), **fields)
+        if site.n_outliers:
+            outliers = samples['sample_name'][(samples['site_id'] == site.site_id) &
+                                              samples['dec_outlier']].tolist()
+            sam_log.warning('qc_outliers', 'WARNING: %d outlier(s) in the '
+                            'calculated declination of %s (%s)' %
+                            (site.n_outliers, site.site_id, ', '.join(outliers)),
+                            site_id=site.site_id, samples=outliers)
+        if site.suspected:
+            sam_log.warning('qc_suspected', 'WARNING: %s sun compass data fit '
+                            'IGRF within %.1f degrees with %s' %
+                            (site.site_id, site.suspected_residual,
+                             site.suspected), **fields)
+        elif not site.passed:
+            sam_log.warning('qc_failed', 'WARNING: %s calculated declination '
+                            'is %+.1f degrees from IGRF (limit %g)' %
+                            (site.site_id, site.dec_offset, limit), **fields)
+
+
+def main():
+    """
+    NAME
+        sam_qc.py
+
+    DESCRIPTION
+        Checks the sun vs. magnetic compass declinations of a summary table
+        written by mk_sam_file.py -summary. Exits with status 1 if any site
+        fails so it can gate a batch pipeline.
+
+    SYNTAX
+        ~/$ python sam_qc.py season.parquet [options]
+
+    OPTIONS
+        -limit DEGREES : allowed difference from IGRF (default 5)
+        -o FILE : write the per site results to a .csv file
+        -q : only print warnings
+
+    """
+    args = sys.argv[1:]
+    limit, out_file = MISMATCH_LIMIT, None
+    verbosity = sam_log.NORMAL
+    if '-limit' in args:
+        ind = args.index('-limit')
+        limit = float(args[ind+1])
+        del args[ind:ind+2]
+    if '-o' in args:
+        ind = args.index('-o')
+        out_file = args[ind+1]
+        del args[ind:ind+2]
+    if '-q' in args:
+        args.remove('-q')
+        verbosity = sam_log.QUIET
+    sam_log.setup_logging(verbosity)
+
+    sites, samples = qc_summary(read_summary(args[0]), limit)
+    log_qc(sites, samples, limit)
+    if out_file is not None:
+        sites.to_csv(out_file, index=False)
+    if not sites['passed'].all():
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import numpy as np
+from mk_sam_utilities import FIELD_MODEL, PSV_MODELS, get_field_model, \
+    use_field_model
+
+# first bytes of a store, followed by the length of its JSON header
+MAGIC = b'SAMCOEF1'
+# the tables start at a multiple of ALIGNMENT bytes
+ALIGNMENT = 64
+
+
+def publish(file_name, mods=(None,)):
+    """
+    DESCRIPTION
+        Writes the coefficient tables of the field models into a store that
+        other processes map into memory with attach: the IGRF table and the
+        table of every PSV model, as float64 arrays behind a JSON header
+        with their epochs, offsets and shapes.
+
+        @param: file_name - path of the store
+        @param: mods - PSV models to include (None for the IGRF only, which
+                every model includes)
+
+    OUTPUT
+        file_name; raises ValueError for a model whose table is not
+        rectangular
+
+    """
+    tables = {}
+    for mod in mods:
+        models, igrf13coeffs, psvmodels, psvcoeffs = get_field_model(mod=mod)
+        tables['igrf'] = (models, igrf13coeffs)
+        if mod is not None:
+            tables[mod] = (psvmodels, psvcoeffs)
+    header, arrays, offset = {'field_model': FIELD_MODEL, 'tables': {}}, [], 0
+    for name, (epochs, coeffs) in tables.items():
+        try:
+            coeffs = np.ascontiguousarray(coeffs, dtype='<f8')
+        except ValueError:
+            raise ValueError('the %s table is not rectangular' % name)
+        header['tables'][name] = {'epochs': list(epochs), 'offset': offset,
+                                  'shape': list(coeffs.shape)}
+        arrays.append(coeffs)
+        offset += coeffs.size
+    text = json.dumps(header).encode('utf-8')
+    start = len(MAGIC) + 8 + len(text)
+    padding = -start % ALIGNMENT
+    # written under another name first so that no worker attaches to a
+    # partly written store
+    partial = file_name + '.partial'
+    with open(partial, 'wb') as f:
+        f.write(MAGIC + np.uint64(len(text) + padding).tobytes() + text +
+                b' '*padding)
+        for coeffs in arrays:
+            f.write(coeffs.tobytes())
+    os.replace(partial, file_name)
+    return file_name
+
+
+def read_header(file_name):
+    """
+    Returns the JSON header of a store and the offset of its tables.
+    """
+    with open(file_name, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('%s is not a coefficient store' % file_name)
+        length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(length).decode('utf-8'))
+    return header, len(MAGIC) + 8 + length
+
+
+def attach(file_name):
+    """
+    DESCRIPTION
+        Maps a store written by publish into memory, read-only, and makes
+        get_field_model return its tables: every process attached to the
+        same store shares one copy of the tables through the page cache, and
+        none of them imports or parses the coefficients module.
+
+    OUTPUT
+        list of the models attached (None for the IGRF)
+
+    """
+    header, start = read_header(file_name)
+    if header['field_model'] != FIELD_MODEL:
+        raise ValueError('%s holds %s, not %s' % (file_name,
+                                                  header['field_model'],
+                                                  FIELD_MODEL))
+    data = np.memmap(file_name, dtype='<f8', mode='r', offset=start)
+    tables = {}
+    for name, table in header['tables'].items():
+        size = int(np.prod(table['shape']))
+        tables[name] = (table['epochs'], data[table['offset']:
+                                              table['offset'] + size]
+                        .reshape(table['shape']))
+    models, igrf13coeffs = tables.pop('igrf')
+    use_field_model((models, igrf13coeffs, None, None))
+    for mod, (psvmodels, psvcoeffs) in tables.items():
+        use_field_model((models, igrf13coeffs, psvmodels, psvcoeffs), mod)
+    return [None] + list(tables)
+
+
+def main():
+    """
+    NAME
+        sam_shared.py
+
+    DESCRIPTION
+        Writes the coefficient tables of the field models into a store that
+        processes map into memory instead of each loading its own copy.
+        mk_sam_file.py -procs writes a store of the IGRF for its workers by
+        itself; a store written here can be attached from python with
+        sam_shared.attach(file_name), e.g. in the initializer of a
+        multiprocessing pool, after which get_field_model, doigrf and
+        igrf_array read the shared tables.
+
+    SYNTAX
+        ~/$ python sam_shared.py coefficients.bin [options]
+
+    OPTIONS
+        -mod MODEL : include a PSV model (arch3k, cals3k, pfm9k, hfm10k,
+                     cals10k.2, cals10k.1b, cals10k, shadif14k, shawq2k,
+                     shawqIA), can be repeated
+        -all : include every PSV model
+
+    OUTPUT
+        the store and the size of its tables
+
+    """
+    args = sys.argv[1:]
+    mods = [None]
+    if '-all' in args:
+        args.remove('-all')
+        mods += PSV_MODELS
+    while '-mod' in args:
+        ind = args.index('-mod')
+        mods.append(args[ind+1])
+        del args[ind:ind+2]
+    if len(args) != 1:
+        help(main)
+        sys.exit(1)
+    start = time.time()
+    publish(args[0], mods)
+    header = read_header(args[0])[0]
+    for name, table in header['tables'].items():
+        print('%s: %d epochs x %d coefficients' % (name, table['shape'][0],
+                                                   table['shape'][1]))
+    print('Wrote %s (%.1f MB) in %.1f s' % (args[0],
+                                            os.path.getsize(args[0])/1e6,
+                                            time.time() - start))
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
@@ -0,0 +1,173 @@
+import os
+import numpy as np
+import pandas as pd
+from sam_validate import first_reading, split_readings
+import sam_log
+
+# difference in degrees between the IGRF declination and the declination
+# calculated from the sun and magnetic compasses that is flagged
+MISMATCH_LIMIT = 5.
+
+SUMMARY_COLUMNS = ['site_id', 'sample_name', 'sun_core_strike',
+                   'IGRF_local_dec', 'calculated_mag_dec', 'core_strike',
+                   'corrected_bedding_strike', 'sun_compass',
+                   'dec_mismatch', 'default_mass', 'sun_spread',
+                   'sun_readings', 'sun_core_strike_spread']
+NUMERIC_COLUMNS = ['sun_core_strike', 'IGRF_local_dec', 'calculated_mag_dec',
+                   'core_strike', 'corrected_bedding_strike']
+# field readings kept next to the results so that a summary can be checked
+# again (see sam_qc) without the templates
+SITE_INPUTS = ['site_lat', 'site_long', 'site_elevation']
+SAMPLE_INPUTS = ['magnetic_core_strike', 'bedding_strike']
+SUN_INPUTS = ['shadow_angle', 'GMT_offset', 'year', 'month', 'days', 'hours',
+              'minutes']
+# every reading of the SUN_INPUTS as entered, separated by ';' (see
+# summary_readings)
+READING_INPUTS = [column + '_readings' for column in SUN_INPUTS]
+INPUT_COLUMNS = SITE_INPUTS + SAMPLE_INPUTS + ['correct_bedding'] + \
+    SUN_INPUTS + READING_INPUTS
+
+
+def site_summary(hdf, df, sdf):
+    """
+    DESCRIPTION
+        Collects the calculated values of a processed site into a table with
+        one row per sample.
+
+        @param: hdf - site DataFrame
+        @param: df - sample Dataframe after mk_sam_file has filled in the
+                calculated fields
+        @param: sdf - sun compass Dataframe
+
+    OUTPUT
+        DataFrame with SUMMARY_COLUMNS followed by INPUT_COLUMNS. Values that
+        could not be calculated (e.g. calculated_mag_dec without sun compass
+        data) are NaN. sun_compass is True where the orientation comes from
+        the sun compass, dec_mismatch where the calculated and IGRF
+        declinations differ by more than MISMATCH_LIMIT degrees,
+        default_mass where no mass was entered and 1.0 g is written, and
+        sun_spread where the sun compass readings of a sample are more than
+        MISMATCH_LIMIT degrees apart (the warnings of mk_sam_file).
+        sun_readings is the number of sun compass readings averaged into
+        sun_core_strike and sun_core_strike_spread their circular standard
+        deviation; the SUN_INPUTS of samples with several readings are those
+        of the first one and READING_INPUTS hold all of them (see
+        summary_readings).
+
+    """
+    samples = df.transpose()
+    sun = sdf.transpose()
+    summary = pd.DataFrame({'site_id': hdf['site_info']['site_id'],
+                            'sample_name': [str(s) for s in samples.index]})
+    for column in NUMERIC_COLUMNS + SAMPLE_INPUTS:
+        summary[column] = pd.to_numeric(samples[column].values,
+                                        errors='coerce').astype(float)
+    for column in SITE_INPUTS:
+        summary[column] = float(hdf['site_info'][column])
+    for column in SUN_INPUTS:
+        summary[column] = [first_reading(value) for value in sun[column].values]
+        summary[column + '_readings'] = [
+            value if isinstance(value, str) else
+            '' if pd.isnull(value) else repr(float(value))
+            for value in sun[column].values]
+    for column, default in [('sun_readings', 1.), ('sun_core_strike_spread',
+                                                   np.nan)]:
+        summary[column] = pd.to_numeric(samples[column].values,
+                                        errors='coerce').astype(float) \
+            if column in samples else default
+    summary['correct_bedding'] = samples['correct_bedding_using_local_dec'] \
+        .astype(str).str.lower().values == 'yes'
+    summary['sun_compass'] = summary['sun_core_strike'].notnull()
+    summary['dec_mismatch'] = (abs(summary['IGRF_local_dec'] -
+                                   summary['calculated_mag_dec']) > MISMATCH_LIMIT)
+    # only known once the sample files are rendered
+    summary['default_mass'] = samples['default_mass'].values.astype(bool) \
+        if 'default_mass' in samples else False
+    summary['sun_spread'] = summary['sun_core_strike_spread'] > MISMATCH_LIMIT
+    return summary[SUMMARY_COLUMNS + INPUT_COLUMNS]
+
+
+def summary_readings(summary):
+    """
+    DESCRIPTION
+        Expands the sun compass inputs of a summary into one row per reading
+        (see sam_validate.split_readings), so that the readings of a sample
+        can be averaged as mk_sam_file.sun_core_strikes does. Summaries
+        written without READING_INPUTS give the first reading of every
+        sample.
+
+        @param: summary - table from site_summary (or several concatenated)
+
+    OUTPUT
+        DataFrame with sample (the row of the sample in summary) and the
+        SUN_INPUTS of every reading, at least one row per sample
+
+    """
+    summary = summary.reset_index(drop=True)
+    if all(column in summary for column in READING_INPUTS):
+        cells = summary[READING_INPUTS].astype(str)
+        cells.columns = SUN_INPUTS
+    else:
+        cells = summary[SUN_INPUTS]
+    return split_readings(cells)[0][['sample'] + SUN_INPUTS]
+
+
+def write_summary(summary, file_name):
+    """
+    DESCRIPTION
+        Writes a summary table as a single columnar file. The format follows
+        the extension of file_name: .parquet or .feather (both need pyarrow),
+        anything else is written as a NumPy .npz archive with one array per
+        column. Without pyarrow the .npz format is used as a fallback.
+
+        @param: summary - DataFrame from site_summary (or several of them
+                concatenated)
+        @param: file_name - path to write to
+
+    OUTPUT
+        path of the file that was written
+
+    """
+    summary = summary.reset_index(drop=True)
+    root, ext = os.path.splitext(file_name)
+    ext = ext.lower()
+    directory = os.path.split(file_name)[0]
+    if directory != '' and not os.path.exists(directory):
+        os.makedirs(directory)
+    if ext in ['.parquet', '.feather']:
+        try:
+            import pyarrow
+        except ImportError:
+            sam_log.warning('no_pyarrow', 'pyarrow is not installed, '
+                            'writing the summary as .npz')
+        else:
+            if ext == '.parquet':
+                summary.to_parquet(file_name, index=False)
+            else:
+                summary.to_feather(file_name)
+            return file_name
+        file_name = root + '.npz'
+    elif ext != '.npz':
+        file_name = file_name + '.npz'
+    arrays = {}
+    for column in summary.columns:
+        values = summary[column].values
+        if values.dtype == object:
+            values = values.astype(str)
+        arrays[column] = values
+    np.savez(file_name, **arrays)
+    return file_name
+
+
+def read_summary(file_name):
+    """
+    Reads a summary table written by write_summary back into a DataFrame.
+    """
+    ext = os.path.splitext(file_name)[1].lower()
+    if ext == '.parquet':
+        return pd.read_parquet(file_name)
+    if ext == '.feather':
+        return pd.read_feather(file_name)
+    with np.load(file_name) as arrays:
+        return pd.DataFrame(dict((column, arrays[column])
+                                 for column in arrays.files))
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+from mk_sam_utilities import SUN_MODELS, sundec_array, sundec_ephemeris
+
+# columns of the sites file, named as in the site templates
+SITE_COLUMNS = ['site_id', 'site_lat', 'site_long', 'GMT_offset']
+# local hours covered by default, the sun compass is not used at night
+FIRST_HOUR, LAST_HOUR = 5, 21
+# the azimuths of the csv tables are written in hundredths of a degree
+CSV_DECIMALS = 2
+
+
+def read_sites(file_name):
+    """
+    Returns the sites of a csv file with a header line and SITE_COLUMNS:
+    site id, latitude, longitude (negative for south and west) and the hours
+    to subtract from local time to get GMT, as in the site templates.
+    """
+    sites = pd.read_csv(file_name, skipinitialspace=True, comment='#',
+                        dtype={'site_id': str})
+    missing = [column for column in SITE_COLUMNS if column not in sites]
+    if missing:
+        raise ValueError('%s has no %s column(s)' % (file_name,
+                                                      ', '.join(missing)))
+    sites = sites[SITE_COLUMNS].copy()
+    for column in SITE_COLUMNS[1:]:
+        sites[column] = pd.to_numeric(sites[column])
+    if sites['site_id'].duplicated().any():
+        raise ValueError('%s lists a site more than once' % file_name)
+    return sites.reset_index(drop=True)
+
+
+def calendar_days(days):
+    """
+    Returns the year, month and day arrays of a datetime64[D] array.
+    """
+    days = np.asarray(days, dtype='datetime64[D]')
+    months = days.astype('datetime64[M]')
+    year = months.astype('datetime64[Y]').astype(int) + 1970
+    month = months.astype(int) % 12 + 1
+    day = (days - months.astype('datetime64[D]')).astype(int) + 1
+    return year, month, day
+
+
+def build_table(sites, start, end, first_hour=FIRST_HOUR,
+                last_hour=LAST_HOUR, step=1, sun_model=None):
+    """
+    DESCRIPTION
+        Calculates the azimuth of the sun at every site, for every day of a
+        date range and every step minutes of local time. The azimuths of a
+        site are calculated at once for all days and times, exactly as
+        mk_sam_file.py calculates a sun compass reading with a shadow angle
+        of 0; the core strike of a reading is the azimuth plus its shadow
+        angle.
+
+        @param: sites - DataFrame with SITE_COLUMNS (see read_sites)
+        @param: start, end - first and last day (local dates, 'YYYY-MM-DD')
+        @param: first_hour, last_hour - local times of the first and last
+                minute of every day
+        @param: step - minutes between the times
+        @param: sun_model - None for the sundec calculation, or a model of
+                mk_sam_utilities.SUN_MODELS (see sundec_ephemeris)
+
+    OUTPUT
+        dictionary of the table: 'site_id', 'site_lat', 'site_long',
+        'GMT_offset' (one value per site), 'first_day' (datetime64[D]),
+        'first_minute' and 'step' (minutes of local time) and 'azimuth', a
+        float32 array of sites x days x times
+
+    """
+    start, end = np.datetime64(start, 'D'), np.datetime64(end, 'D')
+    if end < start:
+        raise ValueError('the date range ends before it starts')
+    if step < 1 or not 0 <= first_hour <= last_hour <= 24:
+        raise ValueError('the hours must be within 0-24 and step at least 1')
+    first_minute = int(first_hour*60)
+    times = np.arange(first_minute, int(last_hour*60) + 1, int(step))
+    year, month, day = calendar_days(np.arange(start, end + 1))
+    # days along the second axis, times along the third
+    year, month, day = [v[:, None] for v in [year, month, day]]
+    hours, minutes = times // 60, times % 60
+    azimuth = np.empty((len(sites), len(year), len(times)), dtype=np.float32)
+    for i, site in sites.iterrows():
+        args = [year, month, day, hours, minutes, site['GMT_offset'],
+                site['site_lat'], site['site_long'], 0.]
+        if sun_model is None:
+            azimuth[i] = sundec_array(*args)
+        else:
+            azimuth[i] = sundec_ephemeris(*args, model=sun_model)
+    return {'site_id': sites['site_id'].to_numpy(dtype=str),
+            'site_lat': sites['site_lat'].to_numpy(dtype=float),
+            'site_long': sites['site_long'].to_numpy(dtype=float),
+            'GMT_offset': sites['GMT_offset'].to_numpy(dtype=float),
+            'first_day': start, 'first_minute': first_minute,
+            'step': int(step), 'azimuth': azimuth}
+
+
+def save_table(table, file_name):
+    """
+    Writes a table of build_table to a compressed .npz file.
+    """
+    arrays = dict(table)
+    arrays['first_day'] = np.array(str(table['first_day']))
+    np.savez_compressed(file_name, **arrays)
+
+
+def load_table(file_name):
+    """
+    Reads a table written by save_table.
+    """
+    with np.load(file_name, allow_pickle=False) as npz:
+        table = dict((name, npz[name]) for name in npz.files)
+    table['first_day'] = np.datetime64(str(table['first_day']), 'D')
+    for name in ['first_minute', 'step']:
+        table[name] = int(table[name])
+    return table
+
+
+def write_csv(table, directory):
+    """
+    DESCRIPTION
+        Writes the table of every site to <directory>/<site_id>_sun.csv: a
+        line for every local time (HH:MM) with the azimuth of the sun on
+        every day of the table, a column per day.
+
+    OUTPUT
+        list of the files written
+
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    n_days, n_times = table['azimuth'].shape[1:]
+    days = np.arange(table['first_day'], table['first_day'] + n_days)
+    times = table['first_minute'] + table['step']*np.arange(n_times)
+    labels = np.array(['%02d:%02d' % (t // 60, t % 60) for t in times])
+    # every azimuth is one of 360*10**CSV_DECIMALS strings, formatted once
+    scale = 10**CSV_DECIMALS
+    text = np.array(['%.*f' % (CSV_DECIMALS, k/float(scale))
+                     for k in range(360*scale + 1)] + [''])
+    files = []
+    for i, site_id in enumerate(table['site_id']):
+        azimuth = table['azimuth'][i].T
+        codes = np.where(np.isnan(azimuth), len(text) - 1,
+                         np.rint(np.nan_to_num(azimuth.astype(float))*scale).astype(int))
+        cells = np.column_stack([labels, text[codes]])
+        file_name = os.path.join(directory, '%s_sun.csv' % site_id)
+        with open(file_name, 'w') as f:
+            f.write(','.join(['local_time'] + list(days.astype(str))) + '\n')
+            f.write('\n'.join(','.join(row) for row in cells.tolist()) + '\n')
+        files.append(file_name)
+    return files
+
+
+def lookup(table, site_id, year, month, day, hours, minutes,
+           shadow_angle=0.):
+    """
+    DESCRIPTION
+        Looks up the azimuth of the sun, or the core strike of sun compass
+        readings, in a table of build_table. The azimuth is interpolated
+        linearly between the times of the table (along the shorter way
+        around the circle); within a degree or two of the sun passing the
+        zenith, where the azimuth turns quickly, interpolated values between
+        the times of the table are poor.
+
+        @param: table - from build_table or load_table
+        @param: site_id - site(s) of the table
+        @param: year, month, day, hours, minutes - local date and time of
+                the readings
+        @param: shadow_angle - shadow angle of the readings (0 for the
+                azimuth of the sun)
+
+        all inputs but the table are broadcast against each other
+
+    OUTPUT
+        array of azimuths or core strikes (degrees from true north), NaN for
+        unknown sites and for dates and times outside of the table
+
+    """
+    site_id, year, month, day, hours, minutes, shadow_angle = \
+        np.broadcast_arrays(np.asarray(site_id, dtype=str),
+                            *[np.asarray(v, dtype=float) for v in
+                              [year, month, day, hours, minutes,
+                               shadow_angle]])
+    azimuth = table['azimuth']
+    n_sites, n_days, n_times = azimuth.shape
+    order = np.argsort(table['site_id'])
+    position = np.searchsorted(table['site_id'], site_id, sorter=order)
+    position = np.minimum(position, n_sites - 1)
+    site = order[position]
+    known = table['site_id'][site] == site_id
+
+    valid = ~np.isnan(year + month + day)
+    years = (np.where(valid, year, 1970).astype(int) - 1970) \
+        .astype('datetime64[Y]')
+    days = (years.astype('datetime64[M]') +
+            (np.where(valid, month, 1).astype(int) - 1)) \
+        .astype('datetime64[D]') + (np.where(valid, day, 1).astype(int) - 1)
+    day_index = (days - table['first_day']).astype(int)
+    point = ((hours*60. + minutes) - table['first_minute'])/table['step']
+    with np.errstate(invalid='ignore'):
+        inside = known & valid & (day_index >= 0) & (day_index < n_days) & \
+            (point >= 0) & (point <= n_times - 1)
+    point = np.where(inside, point, 0.)
+    site, day_index = np.where(inside, site, 0), np.where(inside, day_index, 0)
+    i0 = np.minimum(np.floor(point).astype(int), n_times - 1)
+    i1 = np.minimum(i0 + 1, n_times - 1)
+    a0 = azimuth[site, day_index, i0].astype(float)
+    a1 = azimuth[site, day_index, i1].astype(float)
+    turn = (a1 - a0 + 180.) % 360. - 180.
+    value = (a0 + (point - i0)*turn + shadow_angle) % 360.
+    return np.where(inside, value, np.nan)
+
+
+def main():
+    """
+    NAME
+        sam_sun_table.py
+
+    DESCRIPTION
+        Precomputes the azimuth of the sun for the sites of a field campaign,
+        for every minute of the day over a range of dates, so sun compass
+        readings can be checked in the field without a site template. The
+        core strike of a reading is the azimuth of the sun at its local
+        time plus its shadow angle, as mk_sam_file.py calculates it.
+
+        The sites file is a csv file with a header line and the columns
+        site_id, site_lat, site_long and GMT_offset (hours to subtract from
+        local time to get GMT, as in the site templates). The tables are
+        written to a compressed .npz file (-o), which -lookup reads, and/or
+        to a csv file per site with a line per local time and a column per
+        day (-csv).
+
+        From python, build_table calculates the tables, load_table reads
+        them and lookup returns interpolated azimuths or core strikes for
+        arrays of readings.
+
+    SYNTAX
+        ~/$ python sam_sun_table.py sites.csv -from 2024-07-01 -to 2024-07-31
+            [options]
+        ~/$ python sam_sun_table.py -table sun.npz -lookup SITE DATE HH:MM
+            [-shadow ANGLE]
+
+    OPTIONS
+        -from DATE, -to DATE : first and last day of the tables (local
+                               dates, YYYY-MM-DD)
+        -hours FIRST LAST : local hours covered (default 5 21)
+        -step MINUTES : minutes between the times of the tables (default 1)
+        -sun MODEL : solar position model, almanac or noaa, instead of the
+                     sundec calculation (see mk_sam_file.py)
+        -o FILE : write the tables to a .npz file (default sun_tables.npz)
+        -csv DIRECTORY : also write a csv table for every site
+        -table FILE : .npz file to look up in
+        -lookup SITE DATE HH:MM : print the azimuth of the sun at a site
+        -shadow ANGLE : with -lookup, also print the core strike of a
+                        reading with this shadow angle
+
+    """
+    args = sys.argv[1:]
+    start, end, out_file, csv_directory = None, None, 'sun_tables.npz', None
+    first_hour, last_hour, step, sun_model = FIRST_HOUR, LAST_HOUR, 1, None
+    table_file, reading, shadow_angle = None, None, None
+    if '-from' in args:
+        ind = args.index('-from')
+        start = args[ind+1]
+        del args[ind:ind+2]
+    if '-to' in args:
+        ind = args.index('-to')
+        end = args[ind+1]
+        del args[ind:ind+2]
+    if '-hours' in args:
+        ind = args.index('-hours')
+        first_hour, last_hour = float(args[ind+1]), float(args[ind+2])
+        del args[ind:ind+3]
+    if '-step' in args:
+        ind = args.index('-step')
+        step = int(args[ind+1])
+        del args[ind:ind+2]
+    if '-sun' in args:
+        ind = args.index('-sun')
+        sun_model = args[ind+1]
+        del args[ind:ind+2]
+        if sun_model not in SUN_MODELS:
+            raise ValueError('-sun must be one of: ' + ', '.join(SUN_MODELS))
+    if '-o' in args:
+        ind = args.index('-o')
+        out_file = args[ind+1]
+        del args[ind:ind+2]
+    if '-csv' in args:
+        ind = args.index('-csv')
+        csv_directory = args[ind+1]
+        del args[ind:ind+2]
+    if '-table' in args:
+        ind = args.index('-table')
+        table_file = args[ind+1]
+        del args[ind:ind+2]
+    if '-lookup' in args:
+        ind = args.index('-lookup')
+        reading = args[ind+1:ind+4]
+        del args[ind:ind+4]
+    if '-shadow' in args:
+        ind = args.index('-shadow')
+        shadow_angle = float(args[ind+1])
+        del args[ind:ind+2]
+
+    if reading is not None:
+        table = load_table(table_file or out_file)
+        site_id, date, clock = reading
+        year, month, day = [int(v) for v in date.split('-')]
+        hours, minutes = [int(v) for v in clock.split(':')]
+        azimuth = lookup(table, site_id, year, month, day, hours, minutes)
+        if np.isnan(azimuth):
+            print('%s %s %s is not in %s' % (site_id, date, clock,
+                                             table_file or out_file))
+            return
+        print('sun azimuth: %.2f' % azimuth)
+        if shadow_angle is not None:
+            print('core strike: %.2f' % ((azimuth + shadow_angle) % 360.))
+        return
+
+    if len(args) != 1 or start is None or end is None:
+        raise ValueError('give a sites file, -from and -to (see -h)')
+    begin = time.time()
+    sites = read_sites(args[0])
+    table = build_table(sites, start, end, first_hour, last_hour, step,
+                        sun_model)
+    save_table(table, out_file)
+    if csv_directory is not None:
+        write_csv(table, csv_directory)
+    n_sites, n_days, n_times = table['azimuth'].shape
+    print('%d site(s) x %d day(s) x %d time(s) in %.1f s, written to %s%s' %
+          (n_sites, n_days, n_times, time.time() - begin, out_file,
+           ' and ' + csv_directory if csv_directory is not None else ''))
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
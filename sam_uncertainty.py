@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+import sys
+import numpy as np
+import pandas as pd
+from mk_sam_utilities import sundec_array, igrf_array, to_year_fraction_array
+from sam_summary import read_summary, summary_readings
+from sam_qc import reading_mean
+import sam_log
+
+# default 1 sigma field errors
+SHADOW_SIGMA = 1.5     # degrees, sun compass shadow angle
+COMPASS_SIGMA = 1.5    # degrees, magnetic compass (cores and bedding)
+TIME_SIGMA = 1.        # minutes, watch time
+GMT_ERROR_RATE = 0.    # chance of a GMT_offset one hour off (daylight saving)
+
+UNCERTAINTY_COLUMNS = ['core_strike_mc', 'core_strike_std',
+                       'corrected_bedding_strike_std']
+
+
+def circular_std(angles, axis=-1):
+    """
+    Circular mean and standard deviation (degrees) of angles along axis.
+    """
+    rad = np.radians(angles)
+    C = np.mean(np.cos(rad), axis=axis)
+    S = np.mean(np.sin(rad), axis=axis)
+    R = np.minimum(np.hypot(C, S), 1.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.degrees(np.sqrt(-2. * np.log(R)))
+    return np.degrees(np.arctan2(S, C)) % 360., std
+
+
+def monte_carlo(summary, draws=1000, shadow_sigma=SHADOW_SIGMA,
+                compass_sigma=COMPASS_SIGMA, time_sigma=TIME_SIGMA,
+                gmt_error_rate=GMT_ERROR_RATE, resample_igrf=False,
+                seed=None):
+    """
+    DESCRIPTION
+        Propagates field reading errors into the sample orientations. For
+        every sample draws perturbed realizations of the shadow angle,
+        reading time, GMT_offset and magnetic compass readings and pushes all
+        of them through the sun compass (and optionally IGRF) calculation as
+        one (readings x draws) array. Samples oriented more than once (see
+        sam_summary.summary_readings) draw every reading on its own, apart
+        from GMT_offset errors that apply to all readings of a sample, and
+        average them in every draw with sam_qc.reading_mean as
+        mk_sam_file.sun_core_strikes does.
+
+        The IGRF declination changes by far less than 0.1 degree over the
+        time errors considered, so by default the declination of the summary
+        is used for every draw. With resample_igrf the field is evaluated
+        for every draw instead, which is several times slower.
+
+        @param: summary - table from sam_summary.site_summary
+        @param: draws - number of realizations per sample
+        @param: shadow_sigma - error of the shadow angle (degrees)
+        @param: compass_sigma - error of magnetic compass readings (degrees)
+        @param: time_sigma - error of the reading time (minutes)
+        @param: gmt_error_rate - probability of GMT_offset being one hour off
+        @param: resample_igrf - evaluate IGRF for every draw
+        @param: seed - seed of the random number generator
+
+    OUTPUT
+        DataFrame with site_id, sample_name and UNCERTAINTY_COLUMNS:
+        circular mean and standard deviation of core_strike and the standard
+        deviation of corrected_bedding_strike (NaN where the bedding is not
+        corrected) over the draws
+
+    """
+    rng = np.random.default_rng(seed)
+    summary = summary.reset_index(drop=True)
+    n = len(summary)
+    shape = (n, draws)
+
+    def column(name):
+        return summary[name].values.astype(float)[:, None]
+
+    readings = summary_readings(summary)
+    codes = readings['sample'].values
+    # the first reading of every sample gives its IGRF date
+    first = np.flatnonzero(~readings['sample'].duplicated().values)
+    reading_shape = (len(readings), draws)
+
+    def reading(name):
+        return readings[name].values.astype(float)[:, None]
+
+    minutes = reading('minutes') + rng.normal(0., time_sigma, reading_shape)
+    gmt_error = np.zeros(shape)
+    if gmt_error_rate > 0:
+        off = rng.random(shape) < gmt_error_rate
+        gmt_error = off * rng.choice([-1., 1.], shape)
+    gmt_offset = reading('GMT_offset') + gmt_error[codes]
+    shadow = reading('shadow_angle') + rng.normal(0., shadow_sigma,
+                                                  reading_shape)
+    strikes = sundec_array(reading('year'), reading('month'), reading('days'),
+                           reading('hours'), minutes, gmt_offset,
+                           column('site_lat')[codes],
+                           column('site_long')[codes], shadow)
+    # one group per sample and draw
+    groups = codes[:, None]*draws + np.arange(draws)
+    sun_strike = reading_mean(strikes.ravel(), groups.ravel(),
+                              n*draws).reshape(shape)
+
+    if resample_igrf:
+        # the date in UTC, as the GMT_offset errors move it too; missing
+        # time fields count as 1 and a missing elevation as 0, as in
+        # calculate_values
+        days, hours, first_minutes = [
+            np.nan_to_num(values[first], nan=1.)
+            for values in [reading('days'), reading('hours'), minutes]]
+        dates = to_year_fraction_array(reading('year')[first],
+                                       reading('month')[first], days,
+                                       hours - gmt_offset[first],
+                                       first_minutes)
+        dec = igrf_array(dates,
+                         np.nan_to_num(column('site_elevation'))/1000.,
+                         column('site_lat'), column('site_long'))[0]
+        dec = np.where(dec > 180, dec - 360, dec)
+    else:
+        dec = column('IGRF_local_dec')
+    mag_strike = (column('magnetic_core_strike') +
+                  rng.normal(0., compass_sigma, shape) + dec) % 360.
+    use_sun = ~np.isnan(sun_strike)
+    core_strike = np.where(use_sun, sun_strike, mag_strike)
+    bedding = (column('bedding_strike') + rng.normal(0., compass_sigma, shape) +
+               dec) % 360.
+
+    core_mean, core_std = circular_std(core_strike)
+    bedding_std = circular_std(bedding)[1]
+    bedding_std[~summary['correct_bedding'].values.astype(bool)] = np.nan
+    return pd.DataFrame({'site_id': summary['site_id'].values,
+                         'sample_name': summary['sample_name'].values,
+                         'core_strike_mc': core_mean,
+                         'core_strike_std': core_std,
+                         'corrected_bedding_strike_std': bedding_std})
+
+
+def log_uncertainty(uncertainty):
+    """
+    Logs the largest core_strike and bedding strike uncertainty of every site.
+    """
+    for site_id, site in uncertainty.groupby('site_id', sort=False):
+        worst = site['core_strike_std'].idxmax() \
+            if site['core_strike_std'].notnull().any() else None
+        if worst is None:
+            continue
+        sam_log.info('uncertainty', '%s core_strike uncertainty up to %.1f '
+                     'degrees (%s), bedding strike up to %.1f degrees' %
+                     (site_id, site['core_strike_std'].max(),
+                      site['sample_name'][worst],
+                      site['corrected_bedding_strike_std'].max()),
+                     site_id=site_id,
+                     core_strike_std_max=site['core_strike_std'].max(),
+                     bedding_strike_std_max=site['corrected_bedding_strike_std'].max())
+
+
+def main():
+    """
+    NAME
+        sam_uncertainty.py
+
+    DESCRIPTION
+        Monte Carlo uncertainties of the core and bedding strikes of every
+        sample in a summary table written by mk_sam_file.py -summary.
+
+    SYNTAX
+        ~/$ python sam_uncertainty.py season.parquet [options]
+
+    OPTIONS
+        -n DRAWS : number of realizations per sample (default 1000)
+        -shadow SIGMA : shadow angle error in degrees (default 1.5)
+        -compass SIGMA : magnetic compass error in degrees (default 1.5)
+        -time SIGMA : time error in minutes (default 1)
+        -gmt RATE : probability of a GMT_offset one hour off (default 0)
+        -igrf : evaluate IGRF for every draw
+        -o FILE : write the per sample results to a .csv file
+
+    """
+    args = sys.argv[1:]
+    options = {'-n': 1000, '-shadow': SHADOW_SIGMA, '-compass': COMPASS_SIGMA,
+               '-time': TIME_SIGMA, '-gmt': GMT_ERROR_RATE, '-o': None}
+    for flag in list(options.keys()):
+        if flag in args:
+            ind = args.index(flag)
+            options[flag] = args[ind+1] if flag == '-o' else float(args[ind+1])
+            del args[ind:ind+2]
+    resample_igrf = '-igrf' in args
+    if resample_igrf:
+        args.remove('-igrf')
+    sam_log.setup_logging()
+
+    uncertainty = monte_carlo(read_summary(args[0]), int(options['-n']),
+                              options['-shadow'], options['-compass'],
+                              options['-time'], options['-gmt'],
+                              resample_igrf)
+    log_uncertainty(uncertainty)
+    if options['-o'] is not None:
+        uncertainty.to_csv(options['-o'], index=False)
+
+
+if __name__ == "__main__":
+    if '-h' in sys.argv:
+        help(main)
+        sys.exit()
+    main()
@@ -0,0 +1,324 @@
+import numpy as np
+import pandas as pd
+from mk_sam_utilities import igrf_array, to_year_fraction_array
+from sam_format import (SampleFormatter, SAM_FORMAT_URL, SITE_ID_WIDTH,
+                        SAMPLE_NAME_WIDTH, COMMENT_WIDTH)
+
+# line of the first sample in the template (one based, as shown by a
+# spreadsheet program), the sample table header is on line 7
+FIRST_SAMPLE_ROW = 8
+
+# template column -> sample file column whose width it has to fit, None
+# for the strikes, which are corrected for the declination before they are
+# written (see written_strikes)
+NUMERIC_COLUMNS = [('magnetic_core_strike', None),
+                   ('core_dip', 'core_dip'),
+                   ('bedding_strike', None),
+                   ('bedding_dip', 'bedding_dip'),
+                   ('mass', 'mass')]
+SUN_COLUMNS = ['shadow_angle', 'GMT_offset', 'year', 'month', 'days',
+               'hours', 'minutes']
+# needed for the IGRF calculation of every sample
+IGRF_COLUMNS = ['GMT_offset', 'year', 'month']
+# separates repeated sun compass readings of a sample in one cell
+READING_SEPARATOR = ';'
+
+
+class SiteValidationError(ValueError):
+    """
+    Raised by check_site, carries the full list of problems found in a site
+    template.
+    """
+
+    def __init__(self, file_name, problems):
+        self.file_name = file_name
+        self.problems = problems
+        self.reports = [(file_name, problems)]
+        ValueError.__init__(self, format_report(file_name, problems))
+
+    @classmethod
+    def combine(cls, errors):
+        """
+        Merges the errors of several templates into a single error whose
+        message holds the report of every template.
+        """
+        combined = cls(errors[0].file_name, errors[0].problems)
+        for err in errors[1:]:
+            combined.reports.extend(err.reports)
+        combined.args = ('\n'.join(format_report(file_name, problems)
+                                   for file_name, problems in combined.reports),)
+        return combined
+
+
+def reading_values(value):
+    """
+    Returns the list of readings in a sun compass cell.
+    """
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(READING_SEPARATOR)]
+    return [value]
+
+
+def first_reading(value):
+    """
+    Returns the first reading of a sun compass cell as a number (NaN if it
+    is missing or not a number).
+    """
+    try:
+        return float(reading_values(value)[0])
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def split_readings(sun):
+    """
+    DESCRIPTION
+        Splits the sun compass columns into one row per reading. Samples
+        oriented more than once have their values separated by ';' (e.g.
+        shadow_angle '35.5;36;35.5' with hours '10;10;11' and minutes
+        '5;20;0'); a column with a single value applies to every reading of
+        the sample.
+
+        @param: sun - sun compass DataFrame with samples as rows
+                (sdf.transpose())
+
+    OUTPUT
+        readings - DataFrame with a row per reading: sample (position of
+                   the sample), the SUN_COLUMNS as numbers (NaN where
+                   missing or not a number) and the SUN_COLUMNS as entered
+                   (with the suffix _raw)
+        mismatched - boolean array, True for samples whose columns hold
+                     different numbers of readings
+
+    """
+    cells = dict((column, [reading_values(v) for v in sun[column].values])
+                 for column in SUN_COLUMNS)
+    rows, mismatched = [], np.zeros(len(sun), dtype=bool)
+    for i in range(len(sun)):
+        counts = [len(cells[column][i]) for column in SUN_COLUMNS]
+        n = max(counts)
+        mismatched[i] = any(count not in [1, n] for count in counts)
+        for k in range(n):
+            row = {'sample': i}
+            for column in SUN_COLUMNS:
+                values = cells[column][i]
+                row[column + '_raw'] = values[k] if k < len(values) else \
+                    values[0] if len(values) == 1 else np.nan
+            rows.append(row)
+    readings = pd.DataFrame(rows, columns=['sample'] + [column + '_raw' for
+                                                        column in SUN_COLUMNS])
+    for column in SUN_COLUMNS:
+        raw = readings[column + '_raw']
+        # blank readings between separators count as missing
+        raw = raw.where(raw.astype(str).str.strip() != '', np.nan)
+        readings[column + '_raw'] = raw
+        readings[column] = pd.to_numeric(raw, errors='coerce').astype(float)
+    return readings, mismatched
+
+
+def written_strikes(hdf, samples, readings):
+    """
+    DESCRIPTION
+        Returns the core strike and the corrected bedding strike of every
+        sample as mk_sam_file.calculate_values calculates them from the
+        magnetic compass, with the IGRF declination of the first sun compass
+        reading (time fields that are missing count as 1).
+
+        @param: hdf - site DataFrame
+        @param: samples - sample DataFrame with samples as rows
+        @param: readings - from split_readings
+
+    OUTPUT
+        core_strike, corrected_bedding_strike - arrays, NaN where the
+        declination or the strike is not known
+
+    """
+    site = hdf['site_info']
+    first = readings[~readings['sample'].duplicated()]
+    when = [first[column].values for column in ['year', 'month', 'days']] + \
+        [np.nan_to_num(first[column].values, nan=1.) for column in
+         ['hours', 'minutes']]
+    dec = np.full(len(samples), np.nan)
+    coordinates = pd.to_numeric(pd.Series([site['site_lat'],
+                                           site['site_long'],
+                                           site['site_elevation']]),
+                                errors='coerce').values
+    days = np.nan_to_num(when[2], nan=1.)
+    valid = ~np.isnan(when[0]) & ~np.isnan(when[1]) & (when[0] >= 1900) & \
+        (when[1] >= 1) & (when[1] <= 12) & (days >= 1) & (days <= 31)
+    if valid.any() and not np.isnan(coordinates[:2]).any():
+        date = to_year_fraction_array(when[0][valid], when[1][valid],
+                                      days[valid], when[3][valid],
+                                      when[4][valid])
+        values = igrf_array(date, np.nan_to_num(coordinates[2])/1000.,
+                            coordinates[0], coordinates[1])[0]
+        dec[first['sample'].values[valid]] = np.where(values > 180,
+                                                      values - 360, values)
+    magnetic = pd.to_numeric(samples['magnetic_core_strike'],
+                             errors='coerce').values.astype(float)
+    bedding = pd.to_numeric(samples['bedding_strike'],
+                            errors='coerce').values.astype(float)
+    core = magnetic + dec
+    core = np.where(core < 0, core + 360, core)
+    return core, bedding + dec
+
+
+def validate_site(hdf, df, sdf, formatter=None):
+    """
+    DESCRIPTION
+        Checks a whole site template before anything is calculated or written.
+        All checks run over complete columns so every violation in the file
+        is found in one pass.
+
+        @param: hdf - site DataFrame
+        @param: df - sample Dataframe (transposed, samples are columns)
+        @param: sdf - sun compass Dataframe (transposed, samples are columns)
+        @param: formatter - SampleFormatter providing the SAM column widths
+
+    OUTPUT
+        list of (row, sample, field, message) tuples where row is the line
+        of the sample in the template or None for site level problems
+
+    """
+    if formatter is None:
+        formatter = SampleFormatter()
+    widths = dict(zip(formatter.fields, formatter.widths))
+    templates = dict(zip(formatter.fields, formatter.templates))
+    problems = []
+
+    site = hdf['site_info']
+    site_id = site['site_id']
+    if not isinstance(site_id, str) or site_id == '':
+        problems.append((None, None, 'site_id', 'site_id is required'))
+    elif len(site_id) > SITE_ID_WIDTH:
+        problems.append((None, None, 'site_id',
+                         "'%s' exceeds %d characters" % (site_id, SITE_ID_WIDTH)))
+    for value in ['site_lat', 'site_long']:
+        if np.isnan(pd.to_numeric(pd.Series([site[value]]), errors='coerce')[0]):
+            problems.append((None, None, value, 'must be a number'))
+
+    samples = df.transpose()
+    sun = sdf.transpose()
+    names = pd.Series([str(s) for s in samples.index])
+    rows = np.arange(len(names)) + FIRST_SAMPLE_ROW
+
+    def report(mask, field, message):
+        for i in np.flatnonzero(np.asarray(mask)):
+            text = message if isinstance(message, str) else message(i)
+            problems.append((int(rows[i]), names[i], field, text))
+
+    report(names.str.len() > SAMPLE_NAME_WIDTH, 'sample_name',
+           lambda i: "'%s' exceeds %d characters" % (names[i], SAMPLE_NAME_WIDTH))
+    report(names.duplicated(), 'sample_name', 'sample name is not unique')
+
+    comments = samples['comment'].fillna('').astype(str).reset_index(drop=True)
+    report(comments.str.len() > COMMENT_WIDTH, 'comment',
+           'comment exceeds %d characters' % COMMENT_WIDTH)
+
+    strat = samples['strat_level'].fillna('0').astype(str).reset_index(drop=True)
+    report(strat.str.len() > widths['strat_level'], 'strat_level',
+           lambda i: "'%s' exceeds %d characters" % (strat[i],
+                                                     widths['strat_level']))
+
+    for column, field in NUMERIC_COLUMNS:
+        raw = samples[column].reset_index(drop=True)
+        values = pd.to_numeric(raw, errors='coerce').astype(float)
+        report(values.isnull() & raw.notnull(), column,
+               lambda i: "'%s' is not a number" % raw[i])
+        if field is None:
+            continue
+        strs = formatter.format_column(values.values, templates[field])
+        report(np.char.str_len(strs) > widths[field], column,
+               lambda i: "'%s' exceeds %d characters" % (strs[i], widths[field]))
+
+    report(samples['magnetic_core_strike'].isnull().values &
+           sun['shadow_angle'].isnull().values, 'magnetic_core_strike',
+           'either magnetic_core_strike or shadow_angle is required')
+    report(samples['core_dip'].isnull().values, 'core_dip',
+           'core_dip is required')
+
+    correct = samples['correct_bedding_using_local_dec'].reset_index(drop=True)
+    report(correct.notnull() & ~correct.astype(str).str.lower().isin(['yes', 'no']),
+           'correct_bedding_using_local_dec', "must be 'yes' or 'no'")
+
+    readings, mismatched = split_readings(sun)
+    codes = readings['sample'].values
+
+    # the strikes as they are written: the core strike from the magnetic
+    # compass if no sun compass reading is complete, the bedding strike
+    # corrected for the declination unless correct_bedding_using_local_dec
+    # is 'no'
+    core, corrected = written_strikes(hdf, samples, readings)
+    sun_complete = np.bincount(
+        codes[readings[SUN_COLUMNS].notnull().all(axis=1).values],
+        minlength=len(names)) > 0
+    bedding = pd.to_numeric(samples['bedding_strike'],
+                            errors='coerce').values.astype(float)
+    no_correction = correct.astype(str).str.lower().values == 'no'
+    for column, field, values, used in [
+            ('magnetic_core_strike', 'core_strike', core, ~sun_complete),
+            ('bedding_strike', 'bedding_strike', corrected, ~no_correction),
+            ('bedding_strike', 'bedding_strike', bedding, no_correction)]:
+        strs = formatter.format_column(values, templates[field])
+        report(used & (np.char.str_len(strs) > widths[field]), column,
+               lambda i: "written as '%s', which exceeds %d characters" %
+               (strs[i], widths[field]))
+
+    def by_sample(mask):
+        return np.bincount(codes[np.asarray(mask)], minlength=len(names)) > 0
+
+    report(mismatched, 'shadow_angle', 'the sun compass columns hold '
+           'different numbers of readings (separate them with %s)' %
+           READING_SEPARATOR)
+    raw_cells = sun.reset_index(drop=True)
+    for column in SUN_COLUMNS:
+        report(by_sample(readings[column].isnull().values &
+                         readings[column + '_raw'].notnull().values), column,
+               lambda i: "'%s' is not a number" % raw_cells[column][i])
+    first = ~pd.Series(codes).duplicated().values
+    missing = np.ones(len(names), dtype=bool)
+    missing[codes[first]] = readings[IGRF_COLUMNS].isnull().any(axis=1) \
+        .values[first]
+    report(missing, 'GMT_offset', 'not enough data to calculate IGRF to '
+           'correct bedding please input at least GMT_offset, year, month, '
+           'day of measurement')
+
+    complete = readings[SUN_COLUMNS].notnull().all(axis=1).values
+    years = readings['year'].values
+    report(by_sample(complete & ((years < 1000) | (years > 9999))), 'year',
+           'must input full year for sun compass calculation (i.e. YYYY)')
+    ranges = [('month', 1, 12), ('days', 1, 31), ('hours', 0, 24),
+              ('minutes', 0, 59)]
+    for column, low, high in ranges:
+        values = readings[column].values
+        report(by_sample((values < low) | (values > high)), column,
+               'must be between %d and %d' % (low, high))
+
+    # site problems first, then in the order of the template
+    problems.sort(key=lambda problem: -1 if problem[0] is None else problem[0])
+    return problems
+
+
+def format_report(file_name, problems):
+    """
+    Formats the problems found by validate_site into a single report.
+    """
+    lines = ['%d problem(s) found in %s (refer to: %s)' %
+             (len(problems), file_name, SAM_FORMAT_URL)]
+    for row, sample, field, message in problems:
+        if row is None:
+            lines.append('    site info, %s: %s' % (field, message))
+        else:
+            lines.append('    row %d (sample %s), %s: %s' %
+                         (row, sample, field, message))
+    return '\n'.join(lines)
+
+
+def check_site(file_name, hdf, df, sdf, formatter=None):
+    """
+    Runs validate_site and raises a SiteValidationError listing every problem
+    if any were found.
+    """
+    problems = validate_site(hdf, df, sdf, formatter)
+    if problems:
+        raise SiteValidationError(file_name, problems)
@@ -0,0 +1,100 @@
+import io
+import csv
+import datetime
+
+# first cell of the sample header row of a site template
+HEADER_CELL = 'sample_name'
+HEADER_ROW = 6
+
+
+def cell_text(value):
+    """
+    Returns a cell value as it would appear in a .csv export of the
+    template (whole numbers without a decimal point, 15 significant digits).
+    """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        if value.is_integer():
+            return '%d' % value
+        return '%.15g' % value
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def sheet_template(rows):
+    """
+    DESCRIPTION
+        Turns the rows of a worksheet into the text of the equivalent .csv
+        template. Every line is padded or cut to the width of the sample
+        header row and empty lines below it are dropped.
+
+        @param: rows - iterable of row value tuples
+
+    OUTPUT
+        the template text, or None if the rows are not a site template
+
+    """
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    head = []
+    width = None
+    for i, row in enumerate(rows):
+        cells = [cell_text(value) for value in row]
+        if width is None:
+            if i < HEADER_ROW:
+                head.append(cells)
+                continue
+            if not cells or cells[0] != HEADER_CELL:
+                return None
+            while cells and cells[-1] == '':
+                cells.pop()
+            width = len(cells)
+            for line in head:
+                writer.writerow((line + [''] * width)[:width])
+        elif not any(cells):
+            continue
+        writer.writerow((cells + [''] * width)[:width])
+    if width is None:
+        return None
+    return out.getvalue()
+
+
+def read_workbook(file_name):
+    """
+    DESCRIPTION
+        Reads the site templates of a workbook filled in from
+        sam_sample_template.xlsx, one site per sheet. The workbook is opened
+        read-only so the rows of every sheet are streamed instead of the
+        whole workbook being loaded. Sheets that are not laid out like the
+        template (sample_name at the start of row 7) are skipped.
+
+        @param: file_name - path of the .xlsx workbook
+
+    OUTPUT
+        list of (sheet name, template text) in the order of the sheets; the
+        text reads like the .csv export of the sheet
+
+    """
+    try:
+        import openpyxl
+    except ImportError:
+        raise ImportError('openpyxl is needed to read .xlsx templates '
+                          '(or export the sheets to .csv)')
+    workbook = openpyxl.load_workbook(file_name, read_only=True,
+                                      data_only=True)
+    templates = []
+    try:
+        for sheet in workbook.worksheets:
+            # the stored dimensions of sheets written by other programs can
+            # be wrong, let the rows decide
+            sheet.reset_dimensions()
+            template = sheet_template(sheet.iter_rows(values_only=True))
+            if template is not None:
+                templates.append((sheet.title, template))
+    finally:
+        workbook.close()
+    return templates